@@ -0,0 +1,61 @@
+"""
+    Compares saving uploads with the old fixed 16KB buffer against the
+    adaptive buffer size picked by flask_transfer.buffering.
+
+        python benchmarks/bench_buffer_size.py --sizes 1KB,1MB,1GB --repeat 5
+
+    Uploads are generated on the fly, and aren't backed by a file, so the
+    kernel copy path is never taken and only the buffer size differs.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from werkzeug import FileStorage  # noqa
+
+from flask_transfer import Transfer  # noqa
+from common import GeneratedStream, parse_size, timer  # noqa
+
+
+def run(size, metadata, directory, repeat):
+    transfer = Transfer()
+    timings = []
+    for i in range(repeat):
+        upload = FileStorage(stream=GeneratedStream(size), filename='upload.bin',
+                             content_length=size)
+        path = os.path.join(directory, 'upload.bin')
+        start = timer()
+        transfer.save(upload, destination=path, metadata=dict(metadata), validate=False)
+        timings.append(timer() - start)
+        os.remove(path)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='1KB,1MB,1GB')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--dir', default=None, help='Directory to write to.')
+    args = parser.parse_args()
+
+    directory = args.dir or tempfile.mkdtemp()
+    try:
+        print('{0:>8} {1:>12} {2:>12} {3:>8}'.format('size', 'fixed 16KB', 'adaptive', 'speedup'))
+        for text in args.sizes.split(','):
+            size = parse_size(text)
+            fixed = run(size, {'buffer_size': 16384}, directory, args.repeat)
+            adaptive = run(size, {}, directory, args.repeat)
+            print('{0:>8} {1:>11.4f}s {2:>11.4f}s {3:>7.2f}x'.format(
+                text.strip(), fixed, adaptive, fixed / adaptive))
+    finally:
+        if args.dir is None:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,224 @@
+"""
+    Benchmark cases. Each case is a function that sets everything up and
+    returns a Case: a callable that does one timed operation and builds its
+    inputs from scratch each time, plus the number of bytes it moves, which
+    is used for throughput.
+"""
+from collections import namedtuple
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+
+from werkzeug import FileStorage
+
+from flask_transfer import Transfer
+from flask_transfer.hashing import Digests
+from flask_transfer.metrics import HistogramCollector
+from flask_transfer.validators import (AllowedExts, AndValidator, DeniedExts,
+                                       FunctionValidator, OrValidator)
+
+from common import GeneratedStream, NullSink, format_size
+
+Case = namedtuple('Case', ['run', 'nbytes', 'teardown'])
+
+DEFAULT_SIZES = [100, 64 * 1024, 16 * 1024 * 1024]
+DEFAULT_SHAPES = [1, 4, 16, 64]
+
+
+def _nothing():
+    pass
+
+
+class _Source(object):
+    """Makes fresh uploads of size bytes, either generated on the fly (never
+    backed by a file) or read from a temporary file, like Werkzeug spools
+    large request bodies to.
+    """
+    def __init__(self, kind, size):
+        self.kind = kind
+        self.size = size
+        self._file = None
+        if kind == 'file':
+            self._file = tempfile.TemporaryFile()
+            block = b'\0' * (1024 * 1024)
+            remaining = size
+            while remaining:
+                chunk = block[:min(remaining, len(block))]
+                self._file.write(chunk)
+                remaining -= len(chunk)
+            self._file.flush()
+
+    def upload(self):
+        if self._file is not None:
+            self._file.seek(0)
+            stream = self._file
+        else:
+            stream = GeneratedStream(self.size)
+        return FileStorage(stream=stream, filename='upload.bin',
+                           content_length=self.size)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+
+def _discard(filehandle, metadata):
+    read = filehandle.stream.read
+    while read(1024 * 1024):
+        pass
+
+
+def save_case(destination, source, size):
+    "Transfer.save to a path, a writable object or a callable destination."
+    source = _Source(source, size)
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'upload.bin')
+    transfer = Transfer()
+    dest = {'path': path, 'writable': NullSink(), 'callable': _discard}[destination]
+
+    def run():
+        transfer.save(source.upload(), destination=dest, validate=False)
+
+    def teardown():
+        source.close()
+        shutil.rmtree(directory)
+    return Case(run, size, teardown)
+
+
+def _passing(filehandle, metadata):
+    return True
+
+
+def _validator_tree(shape, count):
+    leaf = lambda: FunctionValidator(_passing)
+    if shape == 'and-depth':
+        validator = leaf()
+        for _ in range(count - 1):
+            validator = AndValidator(validator, leaf())
+        return validator
+    if shape == 'and-width':
+        return AndValidator(*[leaf() for _ in range(count)])
+    if shape == 'or-width':
+        # everything but the last alternative fails
+        fails = [FunctionValidator(lambda fh, meta: False) for _ in range(count - 1)]
+        return OrValidator(*(fails + [leaf()]))
+    if shape == 'exts-width':
+        # collapsed into a single extension check by compile()
+        return AndValidator(*[DeniedExts('exe{0}'.format(i)) for i in range(count)] +
+                            [AllowedExts('bin')])
+    raise ValueError(shape)
+
+
+def validator_case(shape, count, compiled=False):
+    "Transfer._validate on validator trees of increasing depth and width."
+    validator = _validator_tree(shape, count)
+    if compiled:
+        validator = validator.compile()
+    transfer = Transfer(validators=[validator])
+    upload = FileStorage(stream=io.BytesIO(b''), filename='upload.bin')
+
+    def run():
+        transfer._validate(upload, {})
+    return Case(run, 0, _nothing)
+
+
+def _copying_preprocessor(filehandle, metadata):
+    # the usual mistake: pulling the whole stream into memory
+    filehandle.stream = io.BytesIO(filehandle.stream.read())
+    return filehandle
+
+
+def preprocessor_case(copies, size):
+    "Preprocessors that each copy the stream, then a discarding destination."
+    source = _Source('stream', size)
+    transfer = Transfer(destination=_discard,
+                        preprocessors=[_copying_preprocessor] * copies)
+
+    def run():
+        transfer.save(source.upload(), validate=False)
+    return Case(run, size, source.close)
+
+
+def listener_case(listeners):
+    "Overhead of instrumentation on a small save with a validator and processors."
+    source = _Source('stream', 100)
+    transfer = Transfer(destination=NullSink(), validators=[_passing],
+                        preprocessors=[lambda fh, meta: fh],
+                        postprocessors=[lambda fh, meta: fh],
+                        listeners=[HistogramCollector() for _ in range(listeners)])
+
+    def run():
+        transfer.save(source.upload())
+    return Case(run, 0, source.close)
+
+
+def _rehash(path):
+    def postprocessor(filehandle, metadata):
+        # the old way: read the saved file back
+        hasher = hashlib.sha256()
+        with open(path, 'rb') as fh:
+            for chunk in iter(lambda: fh.read(1024 * 1024), b''):
+                hasher.update(chunk)
+        metadata['digests'] = {'sha256': hasher.hexdigest()}
+        return filehandle
+    return postprocessor
+
+
+def hashing_case(mode, size):
+    "sha256 of a saved upload, computed while writing or by re-reading it."
+    source = _Source('stream', size)
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'upload.bin')
+    if mode == 'tee':
+        transfer = Transfer(destination=path, consumers=[Digests('sha256')])
+    else:
+        transfer = Transfer(destination=path, postprocessors=[_rehash(path)])
+
+    def run():
+        transfer.save(source.upload(), validate=False)
+
+    def teardown():
+        source.close()
+        shutil.rmtree(directory)
+    return Case(run, size, teardown)
+
+
+def all_cases(sizes=None, shapes=None):
+    """Returns (name, factory) pairs for every case. Factories are only
+    called when the case is run, so filtered out cases cost nothing.
+    """
+    sizes = sizes or DEFAULT_SIZES
+    shapes = shapes or DEFAULT_SHAPES
+    cases = []
+
+    for destination in ('path', 'writable', 'callable'):
+        for source in ('stream', 'file'):
+            for size in sizes:
+                name = 'save/{0}/{1}/{2}'.format(destination, source, format_size(size))
+                cases.append((name, lambda d=destination, s=source, n=size: save_case(d, s, n)))
+
+    for shape in ('and-depth', 'and-width', 'or-width', 'exts-width'):
+        for count in shapes:
+            for compiled in (False, True):
+                name = 'validators/{0}/{1}{2}'.format(shape, count,
+                                                      '/compiled' if compiled else '')
+                cases.append((name, lambda s=shape, c=count, k=compiled:
+                              validator_case(s, c, k)))
+
+    for copies in (0, 1, 4):
+        for size in sizes:
+            name = 'preprocessors/copies-{0}/{1}'.format(copies, format_size(size))
+            cases.append((name, lambda c=copies, n=size: preprocessor_case(c, n)))
+
+    for mode in ('tee', 'reread'):
+        for size in sizes:
+            name = 'hashing/{0}/{1}'.format(mode, format_size(size))
+            cases.append((name, lambda m=mode, n=size: hashing_case(m, n)))
+
+    for listeners in (0, 1):
+        name = 'metrics/listeners-{0}'.format(listeners)
+        cases.append((name, lambda n=listeners: listener_case(n)))
+
+    return cases
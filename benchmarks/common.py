@@ -0,0 +1,53 @@
+"""
+    Helpers shared by the benchmark scripts.
+"""
+import time
+
+timer = getattr(time, 'perf_counter', time.time)
+
+UNITS = {'B': 1, 'KB': 1024, 'MB': 1024 ** 2, 'GB': 1024 ** 3}
+
+
+def parse_size(text):
+    "Parses sizes such as 100B, 64KB or 1GB into bytes."
+    text = text.strip().upper()
+    for unit in sorted(UNITS, key=len, reverse=True):
+        if text.endswith(unit):
+            return int(float(text[:-len(unit)]) * UNITS[unit])
+    return int(text)
+
+
+def format_size(size):
+    for unit in ('GB', 'MB', 'KB'):
+        if size >= UNITS[unit] and size % UNITS[unit] == 0:
+            return '{0}{1}'.format(size // UNITS[unit], unit)
+    return '{0}B'.format(size)
+
+
+class GeneratedStream(object):
+    """Readable stream of size bytes that's never held in memory at once.
+    Every read returns freshly allocated bytes, like reading from a socket.
+    """
+    _block = memoryview(bytearray(1024 * 1024))
+
+    def __init__(self, size):
+        self.remaining = size
+
+    def _read(self, size):
+        size = min(size, self.remaining, len(self._block))
+        self.remaining -= size
+        return self._block[:size].tobytes()
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            chunks = []
+            while self.remaining:
+                chunks.append(self._read(self.remaining))
+            return b''.join(chunks)
+        return self._read(size)
+
+
+class NullSink(object):
+    "Writable object that throws everything away."
+    def write(self, data):
+        return len(data)
@@ -0,0 +1,220 @@
+"""
+    Runs the Flask-Transfer benchmark suite.
+
+        python benchmarks/run.py                           # everything
+        python benchmarks/run.py --filter validators/      # some of it
+        python benchmarks/run.py --sizes 100B,1MB,1GB      # bigger uploads
+        python benchmarks/run.py --json results.json       # save results
+        python benchmarks/run.py --compare results.json    # check for regressions
+
+    Every case runs in its own process, so the peak RSS reported is the
+    case's own. Latency percentiles are per operation; throughput is bytes
+    moved per second at the median latency, or operations per second for
+    cases that don't move any bytes.
+
+    With --compare, each case's median is checked against the baseline and
+    the run exits with status 1 if any got slower by more than --tolerance.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from cases import all_cases  # noqa
+from common import parse_size, timer  # noqa
+
+try:
+    import resource
+except ImportError:  # windows
+    resource = None
+
+
+def peak_rss():
+    "Peak resident set size of this process, in bytes, if it can be found."
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes everywhere but OS X
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def percentile(ordered, fraction):
+    "Nearest rank percentile of an already sorted list."
+    index = min(int(round(fraction * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+def measure(factory, min_time, min_runs, max_runs):
+    "Runs a case until it's been timed for min_time, returning its stats."
+    case = factory()
+    try:
+        case.run()  # warm up
+        timings = []
+        total = 0.0
+        while len(timings) < max_runs and (len(timings) < min_runs or total < min_time):
+            start = timer()
+            case.run()
+            elapsed = timer() - start
+            timings.append(elapsed)
+            total += elapsed
+    finally:
+        case.teardown()
+
+    timings.sort()
+    median = percentile(timings, 0.5)
+    result = {
+        'runs': len(timings),
+        'mean': total / len(timings),
+        'p50': median,
+        'p90': percentile(timings, 0.9),
+        'p99': percentile(timings, 0.99),
+        'min': timings[0],
+        'max': timings[-1],
+        'bytes': case.nbytes,
+        'peak_rss': peak_rss(),
+    }
+    if case.nbytes:
+        result['throughput'] = case.nbytes / median if median else None
+        result['throughput_unit'] = 'B/s'
+    else:
+        result['throughput'] = 1.0 / median if median else None
+        result['throughput_unit'] = 'ops/s'
+    return result
+
+
+def _child(name, sizes, shapes, options, conn):
+    # cases are looked up again by name, so nothing needs to be pickled
+    try:
+        factory = dict(all_cases(sizes, shapes))[name]
+        conn.send(('ok', measure(factory, *options)))
+    except Exception as e:  # report it rather than hanging the parent
+        conn.send(('error', repr(e)))
+    finally:
+        conn.close()
+
+
+def run_isolated(name, sizes, shapes, options):
+    parent, child = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(target=_child,
+                                      args=(name, sizes, shapes, options, child))
+    process.start()
+    child.close()
+    status, payload = parent.recv()
+    process.join()
+    if status == 'error':
+        raise RuntimeError(payload)
+    return payload
+
+
+def _human_bytes(size):
+    if size is None:
+        return '-'
+    for unit in ('GB', 'MB', 'KB'):
+        scale = {'GB': 1024 ** 3, 'MB': 1024 ** 2, 'KB': 1024}[unit]
+        if size >= scale:
+            return '{0:.1f}{1}'.format(size / float(scale), unit)
+    return '{0}B'.format(int(size))
+
+
+def _human_time(seconds):
+    if seconds >= 1:
+        return '{0:.2f}s'.format(seconds)
+    if seconds >= 1e-3:
+        return '{0:.2f}ms'.format(seconds * 1e3)
+    return '{0:.1f}us'.format(seconds * 1e6)
+
+
+def _human_throughput(result):
+    if result['throughput'] is None:
+        return '-'
+    if result['throughput_unit'] == 'B/s':
+        return _human_bytes(result['throughput']) + '/s'
+    return '{0:.0f} ops/s'.format(result['throughput'])
+
+
+def compare(results, baseline, tolerance):
+    "Returns (name, change) for every case slower than baseline by tolerance."
+    regressions = []
+    for name, result in sorted(results.items()):
+        before = baseline.get(name)
+        if not before or not before.get('p50'):
+            continue
+        change = result['p50'] / before['p50'] - 1
+        result['baseline_p50'] = before['p50']
+        result['change'] = change
+        if change > tolerance:
+            regressions.append((name, change))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--filter', action='append', default=[],
+                        help='Only run cases whose name contains this, may be repeated.')
+    parser.add_argument('--sizes', default=None,
+                        help='Comma separated upload sizes, e.g. 100B,64KB,1GB.')
+    parser.add_argument('--shapes', default=None,
+                        help='Comma separated validator tree depths/widths.')
+    parser.add_argument('--min-time', type=float, default=0.5,
+                        help='Seconds to keep timing each case for.')
+    parser.add_argument('--min-runs', type=int, default=5)
+    parser.add_argument('--max-runs', type=int, default=10000)
+    parser.add_argument('--no-isolate', action='store_true',
+                        help='Run cases in this process; peak RSS becomes cumulative.')
+    parser.add_argument('--json', dest='json_path', help='Write results to this file.')
+    parser.add_argument('--compare', help='Baseline results to compare against.')
+    parser.add_argument('--tolerance', type=float, default=0.10,
+                        help='Allowed median slowdown before failing --compare.')
+    args = parser.parse_args(argv)
+
+    sizes = [parse_size(s) for s in args.sizes.split(',')] if args.sizes else None
+    shapes = [int(s) for s in args.shapes.split(',')] if args.shapes else None
+    options = (args.min_time, args.min_runs, args.max_runs)
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as fh:
+            baseline = json.load(fh)['results']
+
+    results = {}
+    row = '{0:<44} {1:>6} {2:>10} {3:>10} {4:>10} {5:>14} {6:>9} {7:>8}'
+    print(row.format('case', 'runs', 'p50', 'p90', 'p99', 'throughput', 'peak rss', 'change'))
+    for name, factory in all_cases(sizes, shapes):
+        if args.filter and not any(f in name for f in args.filter):
+            continue
+        if args.no_isolate:
+            result = measure(factory, *options)
+        else:
+            result = run_isolated(name, sizes, shapes, options)
+        results[name] = result
+
+        change = '-'
+        if name in baseline and baseline[name].get('p50'):
+            change = '{0:+.1%}'.format(result['p50'] / baseline[name]['p50'] - 1)
+        print(row.format(name, result['runs'], _human_time(result['p50']),
+                         _human_time(result['p90']), _human_time(result['p99']),
+                         _human_throughput(result), _human_bytes(result['peak_rss']),
+                         change))
+        sys.stdout.flush()
+
+    regressions = compare(results, baseline, args.tolerance) if baseline else []
+
+    if args.json_path:
+        with open(args.json_path, 'w') as fh:
+            json.dump({'python': platform.python_version(),
+                       'implementation': platform.python_implementation(),
+                       'platform': platform.platform(),
+                       'results': results}, fh, indent=2, sort_keys=True)
+
+    for name, change in regressions:
+        print('REGRESSION {0}: median {1:+.1%}'.format(name, change))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
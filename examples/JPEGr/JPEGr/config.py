@@ -5,6 +5,15 @@ class Config(object):
     DEBUG = True
     SECRET_KEY = "it's a secret to everybody"
     UPLOAD_PATH = 'pdf'
+    # PDF conversion runs in this many processes, a few more may wait their
+    # turn for up to 10 seconds before the upload is turned away with a 503
+    TRANSFER_CPU_WORKERS = 2
+    TRANSFER_CPU_MAX_PENDING = 4
+    TRANSFER_CPU_TIMEOUT = 10
+    # converted images are kept in memory up to 2MB each and 32MB in total
+    # per process, anything more is spooled to disk
+    TRANSFER_SPOOL_THRESHOLD = 2 * 1024 * 1024
+    TRANSFER_SPOOL_BUDGET = 32 * 1024 * 1024
 
     @staticmethod
     def init_app(app):
@@ -1,7 +1,7 @@
 from flask import flash
 from flask_transfer import Transfer
-from io import BytesIO
-from itertools import count
+from flask_transfer.processors import UniqueFilename
+from flask_transfer.spooling import spool
 import os
 from wand.image import Image
 from wand.color import Color
@@ -11,10 +11,12 @@ from .utils import get_save_path
 PDFTransfer = Transfer()
 
 
-@PDFTransfer.preprocessor
+@PDFTransfer.preprocessor(cpu_bound=True)
 def pdftojpg(filehandle, meta):
     """Converts a PDF to a JPG and places it back onto the FileStorage instance
-    passed to it as a BytesIO object.
+    passed to it as a spooled stream, which moves to disk once it's large.
+    Rasterizing is CPU heavy, so it's run in a process pool rather than
+    holding up the request's worker.
 
     Optional meta arguments are:
         * resolution: int or (int, int) used for wand to determine resolution,
@@ -25,7 +27,7 @@ def pdftojpg(filehandle, meta):
     resolution = meta.get('resolution', 300)
     width = meta.get('width', 1080)
     bgcolor = Color(meta.get('bgcolor', 'white'))
-    stream = BytesIO()
+    stream = spool()
 
     with Image(blob=filehandle.stream, resolution=resolution) as img:
         img.background_color = bgcolor
@@ -53,19 +55,16 @@ def change_filename(filehandle, meta):
     return filehandle
 
 
+unique_filename = UniqueFilename(lambda filehandle, meta: os.path.dirname(get_save_path('_')))
+
+
 @PDFTransfer.preprocessor
 def avoid_name_collisions(filehandle, meta):
     """Manipulates a filename until it's unique. This can be disabled by
     setting meta['avoid_name_collision'] to any falsey value.
     """
     if meta.get('avoid_name_collision', True):
-        filename = filehandle.filename
-        original, ext = os.path.splitext(filehandle.filename)
-        counter = count()
-        while os.path.exists(get_save_path(filename)):
-            fixer = str(next(counter))
-            filename = '{}_{}{}'.format(original, fixer, ext)
-        filehandle.filename = filename
+        filehandle = unique_filename(filehandle, meta)
     return filehandle
 
 
@@ -1,7 +1,7 @@
 from flask import flash, url_for, redirect, render_template, Flask
 from flask_bootstrap import Bootstrap
 from flask_transfer import UploadError
-from .transfer import UserUpload, really_bad_du, list_files
+from .transfer import UserUpload, usage, reconciler, list_files
 from .form import UploadForm
 import os
 
@@ -16,6 +16,7 @@ app.config['MAX_UPLOAD_SIZE'] = 20 * 1024
 def create_upload_dir():
     if not os.path.exists(app.config['UPLOAD_PATH']):
         os.makedirs(app.config['UPLOAD_PATH'])
+    reconciler.reconcile()
 
 
 @app.errorhandler(UploadError)
@@ -34,7 +35,7 @@ def index():
         UserUpload.save(form.upload.data, destination=destination)
 
     max = app.config['MAX_UPLOAD_SIZE'] // 1024
-    current = really_bad_du(app.config['UPLOAD_PATH']) // 1024
+    current = usage.usage('uploads') // 1024
     files = [os.path.basename(fp) for fp in list_files(app.config['UPLOAD_PATH'])]
 
     return render_template('index.html', form=form, max=max,
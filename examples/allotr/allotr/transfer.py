@@ -1,43 +1,35 @@
 from flask import current_app, flash
-from flask_transfer import Transfer, UploadError
+from flask_transfer import Transfer
+from flask_transfer.quota import MemoryUsageStore, QuotaValidator, Reconciler
 import os
 
 
-UserUpload = Transfer()
-
-
 def list_files(path):
     files = []
     for name in os.listdir(path):
-        path = os.path.join(path, name)
-        if os.path.isfile(path):
-            files.append(path)
+        fullpath = os.path.join(path, name)
+        if os.path.isfile(fullpath):
+            files.append(fullpath)
     return files
 
 
-def really_bad_du(path):
-    "Don't actually use this, it's just an example."
-    return sum([os.path.getsize(fp) for fp in list_files(path)])
+def max_disk_usage(key):
+    # limit it at twenty kilobytes if no default is provided
+    return current_app.config.get('MAX_DISK_USAGE', 20 * 1024)
 
 
-@UserUpload.validator
-def check_disk_usage(filehandle, meta):
-    """Checks the upload directory to see if the uploaded file would exceed
-    the total disk allotment. Meant as a quick and dirty example.
-    """
-    # limit it at twenty kilobytes if no default is provided
-    MAX_DISK_USAGE = current_app.config.get('MAX_DISK_USAGE', 20 * 1024)
-    CURRENT_USAGE = really_bad_du(current_app.config['UPLOAD_PATH'])
-    filehandle.seek(0, os.SEEK_END)
-
-    if CURRENT_USAGE + filehandle.tell() > MAX_DISK_USAGE:
-        filehandle.close()
-        raise UploadError("Upload exceeds allotment.")
-    filehandle.seek(0)
-    return filehandle
+# usage is kept in memory and corrected from disk at startup, swap in a
+# SQLiteUsageStore when running more than one process
+usage = MemoryUsageStore()
+check_disk_usage = QuotaValidator(usage, limit=max_disk_usage, key='uploads')
+reconciler = Reconciler(usage, lambda: {'uploads': current_app.config['UPLOAD_PATH']})
+
+UserUpload = Transfer(validators=[check_disk_usage],
+                      postprocessors=[check_disk_usage.record])
 
 
 @UserUpload.postprocessor
 def flash_success(filehandle, meta):
     message = meta.get('message', 'Uploaded {}'.format(filehandle.filename))
     flash(message, 'success')
+    return filehandle
@@ -5,7 +5,7 @@
     uploads.
 """
 
-from .exc import UploadError
+from .exc import UploadError, TransferBusy
 from .transfer import Transfer
 from . import validators
 
@@ -0,0 +1,259 @@
+"""
+    flask_transfer.aio
+    ~~~~~~~~~~~~~~~~~~
+    asyncio native Transfer for serving uploads from async views. Requires
+    Python 3.7 or newer.
+"""
+import asyncio
+from copy import copy
+import functools
+import inspect
+
+from .exc import TransferBusy, UploadError
+from .metrics import _Span
+from .transfer import (SaveResult, Transfer, _commit, _falsey_validator_error, _in_context,
+                       _rollback)
+
+__all__ = ['AsyncTransfer']
+
+
+def _is_coroutine_callable(fn):
+    "Checks if calling fn produces a coroutine, including callable objects."
+    return (inspect.iscoroutinefunction(fn) or
+            inspect.iscoroutinefunction(getattr(fn, '__call__', None)))
+
+
+class AsyncTransfer(Transfer):
+    """Transfer whose save pipeline is a coroutine. Validators, processors and
+    destinations may be coroutine functions, which are awaited, or plain
+    callables, which are run in an executor so a slow disk or network
+    filesystem doesn't block the event loop. They're run in a copy of the
+    current request context, so `request`, `g` and `current_app` still work.
+
+    Registration is unchanged from Transfer, so existing validators and
+    processors can be moved over one route at a time.
+
+    .. code-block:: python
+
+        ImageTransfer = AsyncTransfer(validators=[AllowedExts('png', 'jpg')])
+
+        @ImageTransfer.destination
+        async def store_in_bucket(filehandle, metadata):
+            await bucket.put(filehandle.filename, filehandle.stream)
+
+        @app.route('/upload', methods=['POST'])
+        async def upload():
+            files = await request.files
+            await ImageTransfer.save(files['image'])
+
+    :param executor: concurrent.futures.Executor used to run synchronous
+        callables. None uses the event loop's default executor.
+
+    All other arguments are the same as Transfer, except that a `scheduler`
+    is ignored: validators are awaited one at a time, in order.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._executor = kwargs.pop('executor', None)
+        super(AsyncTransfer, self).__init__(*args, **kwargs)
+
+    async def _call(self, fn, *args):
+        "Awaits fn if it's a coroutine function, otherwise runs it in the executor."
+        if _is_coroutine_callable(fn):
+            result = await fn(*args)
+        else:
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(self._executor,
+                                                _in_context(functools.partial(fn, *args)))
+
+        # wrapped coroutine functions (e.g. FunctionValidator) hand back an
+        # awaitable rather than being detectable up front.
+        if inspect.isawaitable(result):
+            result = await result
+        return result
+
+    async def _observe(self, stage, subject, fn, filehandle, *args, **kwargs):
+        "Awaits fn through _call, reporting it to the listeners if there are any."
+        if not self._listeners:
+            return await self._call(fn, *args)
+
+        span = _Span(self._listeners, stage, subject, filehandle, **kwargs)
+        try:
+            result = await self._call(fn, *args)
+        except Exception as e:
+            span.fail(e)
+            raise
+        span.finish('rejected' if stage == 'validator' and not result else 'ok')
+        return result
+
+    async def _validate(self, filehandle, metadata, catch_all_errors=False):
+        "Asynchronous version of Transfer._validate, without the scheduler."
+        errors = []
+
+        for validator in self._validators:
+            try:
+                if not await self._observe('validator', validator, validator, filehandle,
+                                           filehandle, metadata):
+                    raise _falsey_validator_error(validator, filehandle, metadata)
+            except UploadError as e:
+                if catch_all_errors:
+                    errors.append(e)
+                else:
+                    raise
+
+        if errors:
+            raise UploadError(errors=errors, reason='multiple',
+                              filename=getattr(filehandle, 'filename', None))
+
+    async def _preprocess(self, filehandle, metadata):
+        "Asynchronous version of Transfer._preprocess"
+        for process in self._preprocessors:
+            filehandle = await self._observe('preprocessor', process, process, filehandle,
+                                             filehandle, metadata)
+        return filehandle
+
+    async def _postprocess(self, filehandle, metadata):
+        "Asynchronous version of Transfer._postprocess"
+        for process in self._postprocessors:
+            filehandle = await self._observe('postprocessor', process, process, filehandle,
+                                             filehandle, metadata)
+        return filehandle
+
+    async def save(self, filehandle, destination=None, metadata=None,
+                   validate=True, catch_all_errors=False, *args, **kwargs):
+        """Asynchronous version of Transfer.save, see it for the arguments.
+        Must be awaited.
+        """
+        destination = self._resolve_destination(destination)
+
+        if metadata is None:
+            metadata = {}
+
+        if not self._listeners:
+            return await self._save(filehandle, destination, metadata, validate)
+
+        span = _Span(self._listeners, 'save', 'save', filehandle)
+        try:
+            filehandle = await self._save(filehandle, destination, metadata, validate)
+        except Exception as e:
+            span.fail(e)
+            raise
+        span.finish('ok')
+        return filehandle
+
+    async def save_many(self, filehandles, destination=None, metadata=None,
+                        validate=True, catch_all_errors=False, max_workers=4):
+        """Asynchronous version of Transfer.save_many, see it for the
+        arguments. Every file goes through `save`, at most `max_workers` at
+        once, so each is validated just before it's saved rather than the
+        whole batch up front. A destination's bulk `save_many` hook isn't
+        used. Must be awaited.
+        """
+        destination = self._resolve_destination(destination)
+        filehandles = list(filehandles)
+        metadatas = [{} if metadata is None else copy(metadata) for _ in filehandles]
+        semaphore = asyncio.Semaphore(max_workers)
+
+        async def save_one(filehandle, meta):
+            async with semaphore:
+                return await self.save(filehandle, destination, meta, validate,
+                                       catch_all_errors)
+
+        outcomes = await asyncio.gather(*[save_one(fh, meta)
+                                          for fh, meta in zip(filehandles, metadatas)],
+                                        return_exceptions=True)
+        results = []
+        for filehandle, meta, outcome in zip(filehandles, metadatas, outcomes):
+            if isinstance(outcome, Exception):
+                results.append(SaveResult(filehandle, meta, outcome))
+            elif isinstance(outcome, BaseException):
+                raise outcome
+            else:
+                results.append(SaveResult(outcome, meta, None))
+        return results
+
+    async def _stage(self, stage, coro, filehandle, count_bytes=False):
+        "Awaits the coroutine as stage, reporting it to the listeners."
+        if not self._listeners:
+            return await coro
+
+        span = _Span(self._listeners, stage, stage, filehandle, count_bytes=count_bytes)
+        try:
+            result = await coro
+        except Exception as e:
+            span.fail(e)
+            raise
+        span.finish('ok')
+        return result
+
+    async def _acquire(self, filehandle):
+        """Waits for a slot from the limiter on the event loop, rather than
+        holding up an executor thread that the saves ahead of it need.
+        """
+        limiter = self._limiter
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: granted.done() or granted.set_result(True))
+
+        slot = limiter.request(filehandle, wake)
+        if slot.granted:
+            return slot
+        try:
+            await asyncio.wait_for(asyncio.shield(granted), limiter.timeout)
+        except asyncio.TimeoutError:
+            if slot.cancel():
+                raise TransferBusy(retry_after=limiter.retry_after)
+        except asyncio.CancelledError:
+            if not slot.cancel():
+                slot.release()
+            raise
+        return slot
+
+    async def _save(self, filehandle, destination, metadata, validate):
+        if validate:
+            await self._stage('validate', self._validate(filehandle, metadata), filehandle)
+
+        slot = None
+        if self._limiter is not None:
+            slot = await self._stage('queue', self._acquire(filehandle), filehandle)
+        try:
+            filehandle = await self._stage('preprocess',
+                                           self._preprocess(filehandle, metadata),
+                                           filehandle)
+            pending = await self._stage('write',
+                                        self._write_async(filehandle, destination, metadata),
+                                        filehandle, count_bytes=True)
+
+            try:
+                filehandle = await self._stage('postprocess',
+                                               self._postprocess(filehandle, metadata),
+                                               filehandle)
+            except Exception:
+                await self._call(_rollback, pending)
+                raise
+
+            await self._stage('commit', self._call(_commit, pending), filehandle)
+        finally:
+            if slot is not None:
+                slot.release()
+        return await self._call(self._defer, filehandle, metadata)
+
+    async def _write_async(self, filehandle, destination, metadata):
+        "Asynchronous version of Transfer._write"
+        pipeline = self._open_stream(filehandle, metadata)
+
+        try:
+            pending = await self._call(destination, filehandle, metadata)
+        except Exception:
+            self._close_stream(filehandle, pipeline, drain=False)
+            raise
+
+        try:
+            # draining reads the rest of the upload, keep it off the loop
+            await self._call(self._close_stream, filehandle, pipeline)
+        except Exception:
+            await self._call(_rollback, pending)
+            raise
+        return pending
@@ -0,0 +1,217 @@
+"""
+    flask_transfer.buffering
+    ~~~~~~~~~~~~~~~~~~~~~~~~
+    Picks the buffer size used to copy an upload to its destination.
+"""
+import os
+import threading
+import time
+
+from flask import current_app, has_app_context
+
+from .streaming import DEFAULT_CHUNK_SIZE, known_size
+
+__all__ = ['BufferTuner', 'buffer_size_for', 'buffered_copy', 'block_size',
+           'MIN_BUFFER_SIZE', 'MAX_BUFFER_SIZE']
+
+
+MIN_BUFFER_SIZE = 4096
+MAX_BUFFER_SIZE = 1024 * 1024
+
+_timer = getattr(time, 'perf_counter', time.time)
+
+
+def _config(key, default=None):
+    "Looks up key in the current app's config, if there is an app."
+    if has_app_context():
+        return current_app.config.get(key, default)
+    return default
+
+
+def _round_up(size, multiple):
+    return -(-size // multiple) * multiple
+
+
+def block_size(path):
+    """Returns the preferred I/O size of the filesystem path is on (or will
+    be on, the nearest existing parent is used). Falls back to
+    MIN_BUFFER_SIZE.
+    """
+    path = os.path.abspath(path)
+    while True:
+        try:
+            return os.stat(path).st_blksize or MIN_BUFFER_SIZE
+        except (AttributeError, OSError):
+            parent = os.path.dirname(path)
+            if parent == path:
+                return MIN_BUFFER_SIZE
+            path = parent
+
+
+def _upload_size(filehandle):
+    size = known_size(filehandle)
+    if size is None:
+        size = getattr(filehandle, 'content_length', None) or None
+    return size
+
+
+class BufferTuner(object):
+    """Learns the buffer size that gives the best throughput, separately for
+    each order of magnitude of upload size. It hill climbs: most saves use the
+    best size seen so far, but every so often one tries half or double that,
+    and the measured throughputs (exponentially weighted moving averages)
+    decide which is kept.
+
+    Turn it on for an app with ``TRANSFER_BUFFER_AUTOTUNE = True``, which
+    shares one tuner between every Transfer in the app, or set
+    ``TRANSFER_BUFFER_TUNER`` to your own instance.
+
+    :param minimum: Smallest buffer size to try.
+    :param maximum: Largest buffer size to try.
+    :param explore_every: Try a neighbouring size once every this many saves.
+    :param decay: Weight given to the newest throughput measurement.
+    """
+    def __init__(self, minimum=MIN_BUFFER_SIZE, maximum=MAX_BUFFER_SIZE * 4,
+                 explore_every=8, decay=0.3):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.explore_every = explore_every
+        self.decay = decay
+        self._best = {}
+        self._throughput = {}
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return 'BufferTuner(minimum={0}, maximum={1})'.format(self.minimum, self.maximum)
+
+    @staticmethod
+    def size_class(size):
+        "Groups uploads by the order of magnitude of their size."
+        return len(str(int(size))) if size else 0
+
+    def best(self, size, default):
+        "Returns the best known buffer size for uploads of this size."
+        return self._best.get(self.size_class(size), default)
+
+    def suggest(self, size, default):
+        """Returns the buffer size to use for the next save of an upload of
+        this size, default being the starting point for a new size class.
+        """
+        cls = self.size_class(size)
+        with self._lock:
+            best = self._best.setdefault(cls, default)
+            calls = self._calls[cls] = self._calls.get(cls, 0) + 1
+        if calls % self.explore_every:
+            return best
+        # alternate between trying the next size up and down
+        if (calls // self.explore_every) % 2:
+            return min(best * 2, self.maximum)
+        return max(best // 2, self.minimum)
+
+    def record(self, size, buffer_size, nbytes, elapsed):
+        "Records the throughput of a save done with buffer_size."
+        if nbytes <= 0 or elapsed <= 0:
+            return
+        cls = self.size_class(size)
+        key = (cls, buffer_size)
+        rate = float(nbytes) / elapsed
+        with self._lock:
+            previous = self._throughput.get(key)
+            if previous is not None:
+                rate = previous + self.decay * (rate - previous)
+            self._throughput[key] = rate
+            best = self._best.get(cls, buffer_size)
+            if rate > self._throughput.get((cls, best), 0):
+                self._best[cls] = buffer_size
+
+    def timed(self, size, buffer_size):
+        "Returns a callable that records the throughput when passed nbytes."
+        start = _timer()
+
+        def done(nbytes):
+            self.record(size, buffer_size, nbytes, _timer() - start)
+        return done
+
+
+def _tuner():
+    "Returns the current app's BufferTuner, if autotuning is on."
+    if not has_app_context():
+        return None
+    config = current_app.config
+    tuner = config.get('TRANSFER_BUFFER_TUNER')
+    if tuner is None and config.get('TRANSFER_BUFFER_AUTOTUNE'):
+        tuner = config.setdefault('TRANSFER_BUFFER_TUNER', BufferTuner())
+    return tuner
+
+
+def _choose(filehandle, metadata, path):
+    "Returns the buffer size and the tuner it came from, if it did."
+    if hasattr(metadata, 'get') and 'buffer_size' in metadata:
+        return metadata['buffer_size'], None
+
+    configured = _config('TRANSFER_BUFFER_SIZE')
+    if configured:
+        return configured, None
+
+    size = _upload_size(filehandle)
+    if size is not None and size <= MIN_BUFFER_SIZE:
+        # a single read of any block will do, don't bother stat'ing
+        block = MIN_BUFFER_SIZE
+    elif path:
+        block = block_size(os.path.dirname(path) or '.')
+    else:
+        block = MIN_BUFFER_SIZE
+    if size is None:
+        computed = _round_up(DEFAULT_CHUNK_SIZE, block)
+    else:
+        computed = min(max(_round_up(size, block), block), MAX_BUFFER_SIZE)
+
+    tuner = _tuner()
+    if tuner is not None:
+        return tuner.suggest(size, computed), tuner
+    return computed, None
+
+
+def buffer_size_for(filehandle, metadata, path=None):
+    """Returns the buffer size to copy filehandle with, using the first of:
+
+        * `buffer_size` in the metadata.
+        * ``TRANSFER_BUFFER_SIZE`` in the current app's config.
+        * The app's BufferTuner, if autotuning is on.
+        * The upload's size rounded up to the destination's block size,
+          capped at MAX_BUFFER_SIZE, so tiny uploads get a small buffer and
+          large ones a large one. When the size can't be learned,
+          DEFAULT_CHUNK_SIZE rounded up to the block size is used.
+
+    :param path: Where the upload is headed, used to find the block size.
+    """
+    return _choose(filehandle, metadata, path)[0]
+
+
+def _position(stream):
+    try:
+        return stream.tell()
+    except (AttributeError, IOError, OSError, ValueError):
+        return None
+
+
+def buffered_copy(filehandle, metadata, copy, path=None):
+    """Calls copy with the buffer size from `buffer_size_for` and returns its
+    result. When the size came from a BufferTuner, the throughput of the copy
+    is reported back to it.
+    """
+    buffer_size, tuner = _choose(filehandle, metadata, path)
+    if tuner is None:
+        return copy(buffer_size)
+
+    size = _upload_size(filehandle)
+    before = _position(filehandle.stream)
+    done = tuner.timed(size, buffer_size)
+    result = copy(buffer_size)
+    after = _position(filehandle.stream)
+    if before is not None and after is not None:
+        done(after - before)
+    elif size:
+        done(size)
+    return result
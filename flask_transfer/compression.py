@@ -0,0 +1,370 @@
+"""
+    flask_transfer.compression
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~
+    Compresses uploads as they're written and decompresses them as they're
+    read back, a chunk at a time, so neither holds the whole file in memory.
+"""
+from collections import OrderedDict
+import mimetypes
+import zlib
+
+from werkzeug._compat import string_types
+
+from .buffering import _upload_size
+from .streaming import PeekableStream, _seekable, peek
+from .transfer import _make_destination_callable
+from .validators import sniff_type
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+__all__ = ['Codec', 'CODECS', 'available_codecs', 'get_codec', 'choose_level',
+           'CompressingStream', 'DecompressingStream', 'CompressingDestination',
+           'decompress_stream', 'open_compressed']
+
+
+class Codec(object):
+    """A streaming compression format. `compressor` is called with a level and
+    returns an object with `compress(data)` and `flush()` methods,
+    `decompressor` returns one with a `decompress(data)` method. `levels` are
+    the codec's fast, default and best levels.
+    """
+    def __init__(self, name, extension, magic, levels, compressor, decompressor):
+        self.name = name
+        self.extension = extension
+        self.magic = magic
+        self.fast, self.default, self.best = levels
+        self.compressor = compressor
+        self.decompressor = decompressor
+
+    def __repr__(self):
+        return 'Codec({0!r})'.format(self.name)
+
+
+class _LZ4Compressor(object):
+    "Gives lz4's frame compressor the same interface as zlib's."
+    def __init__(self, level):
+        self._compressor = lz4.frame.LZ4FrameCompressor(compression_level=level)
+        self._header = self._compressor.begin()
+
+    def compress(self, data):
+        header, self._header = self._header, b''
+        return header + self._compressor.compress(data)
+
+    def flush(self):
+        header, self._header = self._header, b''
+        return header + self._compressor.flush()
+
+
+#: Codecs that can be used, in order of preference. gzip is always there,
+#: zstd and lz4 when the zstandard and lz4 packages are installed.
+CODECS = OrderedDict()
+
+if zstandard is not None:
+    CODECS['zstd'] = Codec('zstd', '.zst', b'\x28\xb5\x2f\xfd', (1, 3, 19),
+                           lambda level: zstandard.ZstdCompressor(level=level).compressobj(),
+                           lambda: zstandard.ZstdDecompressor().decompressobj())
+
+CODECS['gzip'] = Codec('gzip', '.gz', b'\x1f\x8b', (1, 6, 9),
+                       lambda level: zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS),
+                       lambda: zlib.decompressobj(16 + zlib.MAX_WBITS))
+
+if lz4 is not None:
+    CODECS['lz4'] = Codec('lz4', '.lz4', b'\x04\x22\x4d\x18', (0, 0, 9),
+                          _LZ4Compressor, lambda: lz4.frame.LZ4FrameDecompressor())
+
+
+def available_codecs():
+    "Names of the codecs that can be used, in order of preference."
+    return list(CODECS)
+
+
+def get_codec(codec):
+    """Returns the Codec named codec. A list of names picks the first one
+    that's available. Raises ValueError if none are.
+    """
+    if isinstance(codec, Codec):
+        return codec
+    names = [codec] if isinstance(codec, string_types) else list(codec)
+    for name in names:
+        if name in CODECS:
+            return CODECS[name]
+    raise ValueError('None of {0} are available, only {1}'.format(
+        ', '.join(names), ', '.join(CODECS)))
+
+
+#: Uploads at least this large are compressed at the codec's fast level.
+LARGE_UPLOAD = 64 * 1024 * 1024
+
+#: Text uploads smaller than this are compressed at the codec's best level.
+SMALL_UPLOAD = 1024 * 1024
+
+_COMPRESSED_TYPES = frozenset([
+    'application/zip', 'application/gzip', 'application/x-gzip', 'application/x-bzip2',
+    'application/x-xz', 'application/x-7z-compressed', 'application/x-rar-compressed',
+    'application/zstd', 'application/pdf'])
+
+_TEXT_TYPES = frozenset([
+    'application/json', 'application/xml', 'application/javascript', 'application/csv',
+    'application/x-ndjson', 'application/x-yaml', 'application/sql'])
+
+
+def _mimetype(filehandle):
+    "The upload's sniffed type, else the client's, else a guess from its name."
+    return (sniff_type(peek(filehandle, 32)) or
+            getattr(filehandle, 'mimetype', None) or
+            mimetypes.guess_type(filehandle.filename or '')[0])
+
+
+def _already_compressed(mimetype):
+    if mimetype.endswith('+xml'):
+        return False
+    return (mimetype in _COMPRESSED_TYPES or
+            mimetype.split('/')[0] in ('image', 'video', 'audio'))
+
+
+def _is_text(mimetype):
+    return (mimetype.startswith('text/') or mimetype in _TEXT_TYPES or
+            mimetype.endswith(('+xml', '+json')))
+
+
+def choose_level(filehandle, metadata, codec):
+    """Picks a compression level from the upload's type and size:
+
+        * None -- store it as is -- for types that are already compressed,
+          like images, video, audio and archives.
+        * the codec's fast level for uploads of LARGE_UPLOAD or more.
+        * its best level for text smaller than SMALL_UPLOAD.
+        * its default level otherwise.
+    """
+    mimetype = _mimetype(filehandle)
+    if mimetype and _already_compressed(mimetype):
+        return None
+    size = _upload_size(filehandle)
+    if size is not None and size >= LARGE_UPLOAD:
+        return codec.fast
+    if mimetype and _is_text(mimetype) and size is not None and size < SMALL_UPLOAD:
+        return codec.best
+    return codec.default
+
+
+class CompressingStream(object):
+    """Read only file-like object that reads the wrapped stream a chunk at a
+    time and returns it compressed. Tracks the bytes read and returned in
+    `bytes_in` and `bytes_out`.
+    """
+    def __init__(self, stream, compressor, chunk_size=64 * 1024):
+        self.source = stream
+        self.chunk_size = chunk_size
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._compressor = compressor
+        self._buffer = b''
+        self._finished = False
+
+    def _next_chunk(self):
+        data = self.source.read(self.chunk_size)
+        self.bytes_in += len(data)
+        if data:
+            return self._compressor.compress(data)
+        self._finished = True
+        return self._compressor.flush()
+
+    def read(self, size=-1):
+        everything = size is None or size < 0
+        chunks, have = [self._buffer], len(self._buffer)
+        while (everything or have < size) and not self._finished:
+            chunk = self._next_chunk()
+            chunks.append(chunk)
+            have += len(chunk)
+
+        data = b''.join(chunks)
+        if everything or have <= size:
+            self._buffer = b''
+        else:
+            data, self._buffer = data[:size], data[size:]
+        self.bytes_out += len(data)
+        return data
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+
+class DecompressingStream(object):
+    """Read only file-like object that decompresses the wrapped stream a
+    chunk at a time. Closing it closes the wrapped stream.
+    """
+    def __init__(self, stream, codec, chunk_size=64 * 1024):
+        self.source = stream
+        self.codec = get_codec(codec)
+        self.chunk_size = chunk_size
+        self._decompressor = self.codec.decompressor()
+        self._buffer = b''
+        self._finished = False
+
+    def _next_chunk(self):
+        data = self.source.read(self.chunk_size)
+        if not data:
+            self._finished = True
+            flush = getattr(self._decompressor, 'flush', None)
+            return flush() if flush is not None else b''
+
+        chunk = self._decompressor.decompress(data)
+        unused = getattr(self._decompressor, 'unused_data', b'')
+        if getattr(self._decompressor, 'eof', False) and unused:
+            # concatenated frames or gzip members
+            self._decompressor = self.codec.decompressor()
+            chunk += self._decompressor.decompress(unused)
+        return chunk
+
+    def read(self, size=-1):
+        everything = size is None or size < 0
+        chunks, have = [self._buffer], len(self._buffer)
+        while (everything or have < size) and not self._finished:
+            chunk = self._next_chunk()
+            chunks.append(chunk)
+            have += len(chunk)
+
+        data = b''.join(chunks)
+        if everything or have <= size:
+            self._buffer = b''
+        else:
+            data, self._buffer = data[:size], data[size:]
+        return data
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    def close(self):
+        self.source.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __iter__(self):
+        return iter(lambda: self.read(self.chunk_size), b'')
+
+
+def _detect(stream):
+    "Returns the codec stream starts with, and a stream to read from the start."
+    if _seekable(stream):
+        position = stream.tell()
+        header = stream.read(4)
+        stream.seek(position)
+    else:
+        stream = PeekableStream(stream)
+        header = stream.peek(4)
+    for codec in CODECS.values():
+        if header.startswith(codec.magic):
+            return codec, stream
+    raise ValueError('Unrecognized compression format')
+
+
+def decompress_stream(stream, codec='auto', chunk_size=64 * 1024):
+    """Wraps stream so reading it returns decompressed data. codec is the
+    name recorded in the metadata's `codec` when the upload was saved; None
+    means it was stored as is and stream is returned untouched. `auto`
+    detects the codec from the stream's magic number, but a file stored as
+    is that happens to be compressed is indistinguishable, so prefer the
+    recorded name.
+    """
+    if codec is None:
+        return stream
+    if codec == 'auto':
+        codec, stream = _detect(stream)
+    return DecompressingStream(stream, codec, chunk_size)
+
+
+def open_compressed(path, codec='auto', chunk_size=64 * 1024):
+    """Opens a file saved by CompressingDestination for reading, see
+    `decompress_stream`.
+
+    .. code-block:: python
+
+        with open_compressed(metadata['path'], metadata['codec']) as fh:
+            for chunk in fh:
+                ...
+    """
+    return decompress_stream(open(path, 'rb'), codec, chunk_size)
+
+
+class CompressingDestination(object):
+    """Wraps a destination so the upload is compressed on its way to it, a
+    chunk at a time. Where it's stored is still up to the wrapped
+    destination -- a path, a writable, `AtomicFileDestination`, anything a
+    Transfer accepts -- and pending writes it returns are passed along.
+
+    The level is picked per upload, by `choose_level` unless told
+    otherwise, and uploads that are already compressed are stored as is.
+    The metadata records what happened:
+
+        * `codec`: the codec's name, None if the upload was stored as is.
+        * `compression_level`: the level used.
+        * `original_size` and `compressed_size`: bytes in and out.
+
+    .. code-block:: python
+
+        CSVTransfer = Transfer(destination=CompressingDestination(
+            AtomicFileDestination('archive'), codec=('zstd', 'gzip')))
+
+    Read it back with `open_compressed(metadata['path'], metadata['codec'])`.
+
+    :param destination: Destination the compressed upload is handed to.
+    :param codec: Codec name, or list of names to use the first available
+        of. Defaults to the best codec installed.
+    :param level: Compression level, or a callable that's passed the
+        filehandle, metadata and Codec and returns one (None to skip
+        compression).
+    :param suffix: Append the codec's extension, e.g. `.gz`, to the
+        filehandle's filename.
+    :param chunk_size: Size of the chunks read from the upload.
+    """
+    def __init__(self, destination, codec=None, level=choose_level, suffix=True,
+                 chunk_size=64 * 1024):
+        self.destination = _make_destination_callable(destination)
+        self.codec = get_codec(codec or available_codecs())
+        self.level = level
+        self.suffix = suffix
+        self.chunk_size = chunk_size
+
+    def __repr__(self):
+        return 'CompressingDestination({0!r}, codec={1!r})'.format(self.destination,
+                                                                   self.codec.name)
+
+    def __call__(self, filehandle, metadata):
+        level = self.level
+        if callable(level):
+            level = level(filehandle, metadata, self.codec)
+        if level is None:
+            metadata['codec'] = None
+            return self.destination(filehandle, metadata)
+
+        stream = filehandle.stream
+        compressing = CompressingStream(stream, self.codec.compressor(level), self.chunk_size)
+        filehandle.stream = compressing
+        if self.suffix and filehandle.filename:
+            filehandle.filename += self.codec.extension
+        metadata['codec'] = self.codec.name
+        metadata['compression_level'] = level
+        try:
+            return self.destination(filehandle, metadata)
+        finally:
+            filehandle.stream = stream
+            metadata['original_size'] = compressing.bytes_in
+            metadata['compressed_size'] = compressing.bytes_out
@@ -0,0 +1,479 @@
+"""
+    flask_transfer.deferred
+    ~~~~~~~~~~~~~~~~~~~~~~~
+    Queues that run postprocessors after the request is done with, rather
+    than while the client waits.
+"""
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import importlib
+import json
+import sqlite3
+import threading
+import time
+
+from .exc import _validator_name
+
+__all__ = ['SavedFile', 'TaskStatus', 'DeferredQueue', 'ThreadQueue',
+           'ProcessQueue', 'SQLiteQueue']
+
+
+class SavedFile(namedtuple('SavedFile', ['filename', 'content_type', 'path'])):
+    """What deferred postprocessors get instead of the filehandle, since the
+    upload's stream is long gone by the time they run. `path` is where the
+    destination saved the upload -- path destinations record it in the
+    metadata as `path`, custom destinations should do the same -- and is
+    None if that's unknown.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_filehandle(cls, filehandle, metadata):
+        return cls(getattr(filehandle, 'filename', None),
+                   getattr(filehandle, 'content_type', None),
+                   metadata.get('path'))
+
+    @property
+    def stream(self):
+        "Opens the saved file for reading. Close it when done."
+        if self.path is None:
+            raise IOError('Location of {0} is unknown'.format(self.filename))
+        return open(self.path, 'rb')
+
+
+class TaskStatus(namedtuple('TaskStatus', ['upload_id', 'name', 'state', 'attempts',
+                                           'error'])):
+    """Where a single deferred postprocessor is at. `state` is one of
+    `pending`, `running`, `retrying`, `done`, `failed` or `skipped` (an
+    earlier step failed). `error` is the repr of the last exception raised.
+    """
+    __slots__ = ()
+
+
+def _delay(attempts, backoff, max_backoff):
+    "Exponential backoff before retry number attempts."
+    return min(backoff * 2 ** (attempts - 1), max_backoff)
+
+
+def _run_steps(steps, saved, metadata, retries, backoff, max_backoff, report=None):
+    """Runs steps in order, retrying each up to retries times. Once a step
+    gives up, the rest are skipped. Returns (state, attempts, error) for each
+    step, report is also called with (position, state, attempts, error)
+    whenever a step changes state.
+    """
+    report = report or (lambda *a: None)
+    results = []
+    for position, step in enumerate(steps):
+        if results and results[-1][0] in ('failed', 'skipped'):
+            results.append(('skipped', 0, None))
+            report(position, 'skipped', 0, None)
+            continue
+
+        attempts = 0
+        while True:
+            attempts += 1
+            report(position, 'running', attempts, None)
+            try:
+                step(saved, metadata)
+            except Exception as e:
+                error = repr(e)
+                if attempts > retries:
+                    results.append(('failed', attempts, error))
+                    report(position, 'failed', attempts, error)
+                    break
+                report(position, 'retrying', attempts, error)
+                time.sleep(_delay(attempts, backoff, max_backoff))
+            else:
+                results.append(('done', attempts, None))
+                report(position, 'done', attempts, None)
+                break
+    return results
+
+
+class DeferredQueue(object):
+    """Base deferred postprocessing queue for flask_transfer. Subclasses need
+    to implement `submit` and `status`.
+
+    :param retries: Times a failing postprocessor is retried before giving up.
+    :param backoff: Seconds before the first retry, doubled on each one after.
+    :param max_backoff: Upper limit of the delay between retries.
+    """
+    def __init__(self, retries=3, backoff=1.0, max_backoff=60.0):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def __repr__(self):
+        return self.__class__.__name__
+
+    def submit(self, upload_id, steps, saved, metadata):
+        """Queues the steps -- deferred postprocessors -- to be called in order
+        with the SavedFile and a copy of the metadata.
+        """
+        raise NotImplementedError("submit not implemented")
+
+    def status(self, upload_id):
+        "Returns a TaskStatus for every step queued for upload_id."
+        raise NotImplementedError("status not implemented")
+
+    def forget(self, upload_id):
+        "Drops the statuses kept for upload_id."
+        raise NotImplementedError("forget not implemented")
+
+    def shutdown(self, wait=True):
+        pass
+
+
+_FINISHED = frozenset(['done', 'failed', 'skipped'])
+
+
+class _MemoryStatuses(object):
+    """Statuses of the uploads submitted to an in process queue. Only the
+    `keep_finished` most recently finished uploads are kept, older ones are
+    forgotten.
+    """
+    def __init__(self, keep_finished=1000):
+        self.keep_finished = keep_finished
+        self._statuses = {}
+        self._finished = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, upload_id, steps):
+        with self._lock:
+            self._finished.pop(upload_id, None)
+            statuses = self._statuses.setdefault(upload_id, [])
+            offset = len(statuses)
+            statuses.extend(TaskStatus(upload_id, _validator_name(step), 'pending', 0, None)
+                            for step in steps)
+        return offset
+
+    def update(self, upload_id, position, state, attempts, error):
+        with self._lock:
+            statuses = self._statuses.get(upload_id)
+            if statuses is None:
+                return
+            statuses[position] = statuses[position]._replace(
+                state=state, attempts=attempts, error=error)
+            if all(status.state in _FINISHED for status in statuses):
+                self._finished[upload_id] = True
+                while len(self._finished) > self.keep_finished:
+                    finished, _ = self._finished.popitem(last=False)
+                    del self._statuses[finished]
+
+    def get(self, upload_id):
+        with self._lock:
+            return list(self._statuses.get(upload_id, []))
+
+    def forget(self, upload_id):
+        with self._lock:
+            self._statuses.pop(upload_id, None)
+            self._finished.pop(upload_id, None)
+
+
+class ThreadQueue(DeferredQueue):
+    """Runs deferred postprocessors in a thread pool in this process. Nothing
+    survives a restart, use SQLiteQueue if that matters. A postprocessor
+    being retried holds on to its worker while it waits.
+
+    :param max_workers: Size of the thread pool.
+    :param keep_finished: Finished uploads whose statuses are kept, the
+        oldest are forgotten first.
+
+    Retry arguments are the same as DeferredQueue.
+    """
+    def __init__(self, max_workers=2, keep_finished=1000, **kwargs):
+        super(ThreadQueue, self).__init__(**kwargs)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._statuses = _MemoryStatuses(keep_finished)
+
+    def submit(self, upload_id, steps, saved, metadata):
+        offset = self._statuses.add(upload_id, steps)
+
+        def report(position, state, attempts, error):
+            self._statuses.update(upload_id, offset + position, state, attempts, error)
+
+        return self._executor.submit(_run_steps, list(steps), saved, dict(metadata),
+                                     self.retries, self.backoff, self.max_backoff,
+                                     report)
+
+    def status(self, upload_id):
+        return self._statuses.get(upload_id)
+
+    def forget(self, upload_id):
+        self._statuses.forget(upload_id)
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+
+class ProcessQueue(DeferredQueue):
+    """Runs deferred postprocessors in a process pool, for CPU heavy work
+    like image resizing. The postprocessors and metadata must be picklable,
+    so use module level functions. Statuses only change once every step for
+    an upload is finished, since the workers can't report back mid way.
+
+    :param max_workers: Size of the process pool, None for one per CPU.
+    :param keep_finished: Finished uploads whose statuses are kept, the
+        oldest are forgotten first.
+
+    Retry arguments are the same as DeferredQueue.
+    """
+    def __init__(self, max_workers=None, keep_finished=1000, **kwargs):
+        super(ProcessQueue, self).__init__(**kwargs)
+        self._executor = ProcessPoolExecutor(max_workers=max_workers)
+        self._statuses = _MemoryStatuses(keep_finished)
+
+    def submit(self, upload_id, steps, saved, metadata):
+        offset = self._statuses.add(upload_id, steps)
+        future = self._executor.submit(_run_steps, list(steps), saved, dict(metadata),
+                                       self.retries, self.backoff, self.max_backoff)
+
+        def finished(future):
+            try:
+                results = future.result()
+            except Exception as e:
+                results = [('failed', 0, repr(e))] * len(steps)
+            for position, (state, attempts, error) in enumerate(results):
+                self._statuses.update(upload_id, offset + position, state, attempts, error)
+
+        future.add_done_callback(finished)
+        return future
+
+    def status(self, upload_id):
+        return self._statuses.get(upload_id)
+
+    def forget(self, upload_id):
+        self._statuses.forget(upload_id)
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+
+def _reference(fn):
+    "Returns the importable 'module:name' of fn, or raises ValueError."
+    name = getattr(fn, '__qualname__', None) or getattr(fn, '__name__', None)
+    module = getattr(fn, '__module__', None)
+    if not name or not module or '<' in name or _resolve('{0}:{1}'.format(module, name)) is not fn:
+        raise ValueError('{0!r} must be a module level function to be queued'.format(fn))
+    return '{0}:{1}'.format(module, name)
+
+
+def _resolve(reference):
+    module, name = reference.split(':', 1)
+    obj = importlib.import_module(module)
+    for attr in name.split('.'):
+        obj = getattr(obj, attr, None)
+    return obj
+
+
+class SQLiteQueue(DeferredQueue):
+    """Keeps deferred postprocessors in a SQLite database, so they survive
+    restarts and can be shared by every process pointed at the same file.
+    Postprocessors are stored by import path and so must be module level
+    functions, and the metadata must be JSON serializable -- if it isn't,
+    the steps are queued as failed rather than failing the save. Changes a
+    step makes to the metadata are passed along to the steps after it.
+
+    Workers claim a step by leasing it; a step whose worker died mid way is
+    picked up again once its lease runs out.
+
+    .. code-block:: python
+
+        queue = SQLiteQueue('deferred.db')
+        queue.start()
+        ImageTransfer = Transfer(deferred_queue=queue)
+
+        @ImageTransfer.postprocessor(deferred=True)
+        def thumbnailify(saved, metadata):
+            ...
+
+        # later, e.g. from a status endpoint
+        queue.status(upload_id)
+
+    :param path: Path to the database, created if needed.
+    :param workers: Number of worker threads started by `start`.
+    :param poll_interval: Seconds idle workers wait before checking for work.
+    :param lease: Seconds a worker may hold a step before it's retried.
+    :param timeout: Seconds to wait on a locked database.
+
+    Retry arguments are the same as DeferredQueue.
+    """
+    def __init__(self, path, workers=1, poll_interval=1.0, lease=300.0, timeout=5.0,
+                 **kwargs):
+        super(SQLiteQueue, self).__init__(**kwargs)
+        self.path = path
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.timeout = timeout
+        self._local = threading.local()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+        self._connection().execute(
+            'CREATE TABLE IF NOT EXISTS deferred ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, upload_id TEXT NOT NULL, '
+            'position INTEGER NOT NULL, step TEXT NOT NULL, saved TEXT NOT NULL, '
+            'metadata TEXT NOT NULL, state TEXT NOT NULL, attempts INTEGER NOT NULL, '
+            'run_at REAL NOT NULL, error TEXT)')
+        self._connection().execute(
+            'CREATE INDEX IF NOT EXISTS deferred_upload ON deferred (upload_id, position)')
+
+    def __repr__(self):
+        return 'SQLiteQueue({0!r})'.format(self.path)
+
+    def _connection(self):
+        # sqlite connections can't be shared between threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=self.timeout,
+                                                      isolation_level=None)
+        return conn
+
+    def submit(self, upload_id, steps, saved, metadata):
+        references = [_reference(step) for step in steps]
+        states, error = ['pending'] * len(references), None
+        try:
+            saved, metadata = json.dumps(list(saved)), json.dumps(dict(metadata))
+        except (TypeError, ValueError) as e:
+            # the upload is already saved, so rather than failing the save
+            # the steps are queued as failed, for status to report
+            saved, metadata = json.dumps([None] * len(SavedFile._fields)), '{}'
+            states = ['failed'] + ['skipped'] * (len(references) - 1)
+            error = repr(e)
+
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT COALESCE(MAX(position) + 1, 0) FROM deferred '
+                               'WHERE upload_id = ?', (upload_id,)).fetchone()
+            conn.executemany(
+                'INSERT INTO deferred (upload_id, position, step, saved, metadata, state, '
+                'attempts, run_at, error) VALUES (?, ?, ?, ?, ?, ?, 0, ?, ?)',
+                [(upload_id, row[0] + i, reference, saved, metadata, state, time.time(),
+                  error if state == 'failed' else None)
+                 for i, (reference, state) in enumerate(zip(references, states))])
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+        self._wake.set()
+
+    def _claim(self):
+        """Leases the next runnable step, returning its row or None. Every
+        lease counts as an attempt, so a step whose leases keep running out
+        -- say, because it crashes its worker -- fails once it's out of
+        retries instead of being picked up forever.
+        """
+        conn = self._connection()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            while True:
+                row = conn.execute(
+                    "SELECT id, upload_id, position, step, saved, metadata, attempts "
+                    "FROM deferred AS d WHERE d.state IN ('pending', 'retrying', 'running') "
+                    "AND d.run_at <= ? AND NOT EXISTS (SELECT 1 FROM deferred AS e "
+                    "WHERE e.upload_id = d.upload_id AND e.position < d.position "
+                    "AND e.state != 'done') ORDER BY d.run_at LIMIT 1", (now,)).fetchone()
+                if row is None or row[6] <= self.retries:
+                    break
+                conn.execute("UPDATE deferred SET state = 'failed', error = ? WHERE id = ?",
+                             ('Lease ran out after {0} attempts'.format(row[6]), row[0]))
+                conn.execute("UPDATE deferred SET state = 'skipped' WHERE upload_id = ? "
+                             "AND position > ?", (row[1], row[2]))
+            if row is not None:
+                conn.execute("UPDATE deferred SET state = 'running', attempts = attempts + 1, "
+                             "run_at = ? WHERE id = ?", (now + self.lease, row[0]))
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+        return row
+
+    def process_once(self):
+        """Runs a single attempt of the next runnable step. Returns False if
+        there was nothing to do.
+        """
+        row = self._claim()
+        if row is None:
+            return False
+
+        task_id, upload_id, position, reference, saved, metadata, attempts = row
+        attempts += 1
+        metadata = json.loads(metadata)
+        try:
+            _resolve(reference)(SavedFile(*json.loads(saved)), metadata)
+            # a step that leaves the metadata unserializable fails like any other
+            metadata = json.dumps(metadata)
+        except Exception as e:
+            if attempts > self.retries:
+                self._update(
+                    ("UPDATE deferred SET state = 'failed', error = ? WHERE id = ?",
+                     (repr(e), task_id)),
+                    ("UPDATE deferred SET state = 'skipped' WHERE upload_id = ? "
+                     "AND position > ?", (upload_id, position)))
+            else:
+                run_at = time.time() + _delay(attempts, self.backoff, self.max_backoff)
+                self._update(("UPDATE deferred SET state = 'retrying', error = ?, run_at = ? "
+                              "WHERE id = ?", (repr(e), run_at, task_id)))
+            return True
+
+        self._update(
+            ("UPDATE deferred SET state = 'done', error = NULL WHERE id = ?", (task_id,)),
+            ('UPDATE deferred SET metadata = ? WHERE upload_id = ? AND position > ?',
+             (metadata, upload_id, position)))
+        return True
+
+    def _update(self, *statements):
+        "Runs each (sql, parameters) in statements in a single transaction."
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for sql, parameters in statements:
+                conn.execute(sql, parameters)
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def status(self, upload_id):
+        rows = self._connection().execute(
+            'SELECT step, state, attempts, error FROM deferred WHERE upload_id = ? '
+            'ORDER BY position', (upload_id,)).fetchall()
+        return [TaskStatus(upload_id, step.split(':', 1)[1].rsplit('.', 1)[-1],
+                           state, attempts, error)
+                for step, state, attempts, error in rows]
+
+    def forget(self, upload_id):
+        self._connection().execute('DELETE FROM deferred WHERE upload_id = ?', (upload_id,))
+
+    def _run(self):
+        while not self._stop.is_set():
+            if not self.process_once():
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+
+    def start(self):
+        "Starts the worker threads, as daemons."
+        self._stop.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run,
+                                      name='flask-transfer-deferred-{0}'.format(i))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def shutdown(self, wait=True):
+        if wait:
+            self.stop()
+        else:
+            self._stop.set()
+            self._wake.set()
@@ -0,0 +1,516 @@
+"""
+    flask_transfer.destinations
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    Ready made destinations for persisting uploads.
+"""
+from functools import partial
+import errno
+import hashlib
+import os
+import stat
+import tempfile
+import threading
+import time
+
+from werkzeug._compat import string_types
+from werkzeug.utils import secure_filename
+
+from .buffering import buffer_size_for
+from .streaming import DEFAULT_CHUNK_SIZE
+
+__all__ = ['ContentAddressedDestination', 'AtomicFileDestination', 'GroupCommit',
+           'copy_to_file', 'copy_to_path']
+
+
+# errors meaning the kernel can't do this particular copy, try the next way
+_UNSUPPORTED = frozenset([errno.EXDEV, errno.ENOSYS, errno.EINVAL,
+                          errno.EOPNOTSUPP, errno.EBADF, errno.EPERM])
+
+
+def _source_fd(stream):
+    """Returns the descriptor backing stream if it's a regular file, without
+    forcing a SpooledTemporaryFile to disk. Otherwise returns None.
+    """
+    if not getattr(stream, '_rolled', True):
+        return None
+    try:
+        fd = stream.fileno()
+        mode = os.fstat(fd).st_mode
+    except (AttributeError, IOError, OSError, ValueError):
+        return None
+    return fd if stat.S_ISREG(mode) else None
+
+
+def _copy_file_range(src, dst, offset, count):
+    return os.copy_file_range(src, dst, count, offset)
+
+
+def _sendfile(src, dst, offset, count):
+    return os.sendfile(dst, src, offset, count)
+
+
+def _pread_write(src, dst, offset, count):
+    data = os.pread(src, min(count, 1024 * 1024), offset)
+    view, written = memoryview(data), 0
+    while written < len(data):
+        written += os.write(dst, view[written:])
+    return len(data)
+
+
+_KERNEL_COPIES = [fn for name, fn in [('copy_file_range', _copy_file_range),
+                                      ('sendfile', _sendfile),
+                                      ('pread', _pread_write)]
+                  if hasattr(os, name)]
+
+
+def _kernel_copy(src, dst, offset, count):
+    """Copies count bytes from offset in src to the current position of dst,
+    using the cheapest way the kernel supports. Returns the bytes copied.
+    """
+    copied = 0
+    copies = list(_KERNEL_COPIES)
+    while copied < count and copies:
+        try:
+            done = copies[0](src, dst, offset + copied, count - copied)
+        except OSError as e:
+            if e.errno not in _UNSUPPORTED or len(copies) == 1:
+                raise
+            copies.pop(0)
+            continue
+        if not done:
+            break
+        copied += done
+    return copied
+
+
+def copy_to_file(stream, out):
+    """Copies the rest of stream into the writable file object out without
+    pulling the bytes through Python, if both are backed by real files. The
+    stream is left at its end, as if it had been read. Returns False, having
+    done nothing, if that's not possible.
+    """
+    src = _source_fd(stream)
+    if src is None or not _KERNEL_COPIES:
+        return False
+    try:
+        dst = out.fileno()
+    except (AttributeError, IOError, OSError, ValueError):
+        return False
+
+    # pending buffered writes would be missed by the kernel
+    stream.flush()
+    out.flush()
+    offset = stream.tell()
+    count = max(os.fstat(src).st_size - offset, 0)
+    copied = _kernel_copy(src, dst, offset, count)
+    stream.seek(offset + copied)
+    try:
+        # resync the file object with what the kernel wrote behind its back
+        out.seek(0, os.SEEK_CUR)
+    except (IOError, OSError, ValueError):
+        pass
+    return True
+
+
+def copy_to_path(stream, path, hardlink=False):
+    """Copies the rest of stream to a new file at path, the same as
+    `copy_to_file`. When hardlink is on and the stream is a named file that's
+    being copied from the start, the file is hard linked into place instead,
+    so no data is copied at all; the two paths then share their contents.
+    Returns False if the stream isn't backed by a regular file.
+    """
+    if _source_fd(stream) is None:
+        return False
+
+    name = getattr(stream, 'name', None)
+    if hardlink and isinstance(name, string_types) and stream.tell() == 0:
+        try:
+            if os.path.samestat(os.stat(name), os.fstat(stream.fileno())):
+                _replace_link(name, path)
+                stream.seek(0, os.SEEK_END)
+                return True
+        except OSError:
+            # different filesystems, or linking isn't supported, so copy
+            pass
+
+    with open(path, 'wb') as out:
+        return copy_to_file(stream, out)
+
+
+def _makedirs(path):
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+def _umask():
+    # there's no reading the umask without setting it, so it's read once,
+    # before any threads are around to create files under a zero umask
+    mask = os.umask(0)
+    os.umask(mask)
+    return mask
+
+
+_UMASK = _umask()
+
+
+def _publish_mode(path):
+    """Gives a file from mkstemp, which is only readable by its owner, the
+    permissions a plain open would have.
+    """
+    os.chmod(path, 0o666 & ~_UMASK)
+
+
+def _replace_link(source, link):
+    "Atomically points link at the same inode as source."
+    # unique per thread, so only a crashed save can have left it behind
+    tmp = '{0}.{1}.{2}.tmp'.format(link, os.getpid(), threading.current_thread().ident)
+    try:
+        os.link(source, tmp)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+        os.remove(tmp)
+        os.link(source, tmp)
+    os.rename(tmp, link)
+
+
+class ContentAddressedDestination(object):
+    """Stores every upload once, under the digest of its contents. The stream
+    is hashed while it's written to a temporary file next to the blobs, so
+    nothing is read twice. If a blob with the same digest already exists the
+    temporary file is thrown away instead of being kept as another copy.
+
+    After saving, the metadata holds:
+
+        * `digest`: hex digest of the upload.
+        * `path`: path of the blob.
+        * `duplicate`: whether the blob already existed.
+
+    If `names` is provided, a hard link named after the filehandle's filename
+    -- passed through `secure_filename` -- is placed in it, pointing at the
+    blob. Duplicates then cost a directory entry rather than a copy, and the
+    blob's link count doubles as its reference count -- see `release`. A
+    name saved again with other contents is pointed at the new blob, and
+    the old one is deleted if nothing else links to it.
+
+    When `trust_client_digest` is on and the metadata has an
+    `expected_digest` that's already stored, the write is skipped entirely.
+    Only turn this on if clients are trusted to send the right digest, since
+    it's never checked against the upload.
+
+    .. code-block:: python
+
+        Documents = Transfer(destination=ContentAddressedDestination(
+            'uploads/blobs', names='uploads/by-name'))
+
+    :param root: Directory the blobs are stored in.
+    :param algorithm: Name of a hashlib algorithm.
+    :param names: Optional directory to place named hard links in.
+    :param trust_client_digest: Skip writes of already stored digests that
+        the client supplied as `expected_digest`.
+    :param buffer_size: Size of the chunks read from the stream, picked
+        per upload by `buffering.buffer_size_for` if not given.
+    """
+    def __init__(self, root, algorithm='sha256', names=None,
+                 trust_client_digest=False, buffer_size=None):
+        self.root = root
+        self.algorithm = algorithm
+        self.names = names
+        self.trust_client_digest = trust_client_digest
+        self.buffer_size = buffer_size
+        _makedirs(root)
+        if names is not None:
+            _makedirs(names)
+
+    def __repr__(self):
+        return 'ContentAddressedDestination({0!r})'.format(self.root)
+
+    def path_for(self, digest):
+        "Returns the path of the blob for digest, fanned out by its first byte."
+        return os.path.join(self.root, digest[:2], digest[2:])
+
+    def has(self, digest):
+        return os.path.exists(self.path_for(digest))
+
+    def refcount(self, digest):
+        "Returns the number of named links to the blob, if names are kept."
+        try:
+            return os.stat(self.path_for(digest)).st_nlink - 1
+        except OSError:
+            return 0
+
+    def _linked_digest(self, link):
+        "Returns the digest of the blob link points at, None if there's no link."
+        hasher = hashlib.new(self.algorithm)
+        try:
+            with open(link, 'rb') as fh:
+                for chunk in iter(partial(fh.read, DEFAULT_CHUNK_SIZE), b''):
+                    hasher.update(chunk)
+        except (IOError, OSError):
+            return None
+        return hasher.hexdigest()
+
+    def _link_name(self, blob, name):
+        """Points the named link at blob. If it pointed at another blob, that
+        blob loses a reference and is deleted once nothing links to it.
+        """
+        link = os.path.join(self.names, secure_filename(name))
+        try:
+            replaced = not os.path.samefile(link, blob)
+        except OSError:
+            replaced = False
+        # the link's contents are the old blob's, hashing them finds it
+        previous = self._linked_digest(link) if replaced else None
+        _replace_link(blob, link)
+        if previous is not None:
+            self.release(previous)
+
+    def release(self, digest, name=None):
+        """Removes the named link (if given, and only if it still points at
+        the blob) and deletes the blob once nothing else links to it. Returns
+        True if the blob was deleted.
+        """
+        if name is not None:
+            link = os.path.join(self.names, secure_filename(name))
+            try:
+                if os.path.samefile(link, self.path_for(digest)):
+                    os.remove(link)
+            except OSError:
+                pass
+        if self.refcount(digest) == 0:
+            try:
+                os.remove(self.path_for(digest))
+                return True
+            except OSError:
+                pass
+        return False
+
+    def _write(self, stream, buffer_size):
+        "Copies stream into a temporary file, returning its path and digest."
+        hasher = hashlib.new(self.algorithm)
+        fd, tmp = tempfile.mkstemp(dir=self.root, suffix='.tmp')
+        try:
+            _publish_mode(tmp)
+            with os.fdopen(fd, 'wb') as fh:
+                while True:
+                    chunk = stream.read(buffer_size)
+                    if not chunk:
+                        break
+                    hasher.update(chunk)
+                    fh.write(chunk)
+        except Exception:
+            os.remove(tmp)
+            raise
+        return tmp, hasher.hexdigest()
+
+    def __call__(self, filehandle, metadata):
+        expected = metadata.get('expected_digest')
+        if self.trust_client_digest and expected and self.has(expected):
+            digest, duplicate = expected, True
+        else:
+            buffer_size = (self.buffer_size or
+                           buffer_size_for(filehandle, metadata, self.root + os.sep) or
+                           DEFAULT_CHUNK_SIZE)
+            tmp, digest = self._write(filehandle.stream, buffer_size)
+            blob = self.path_for(digest)
+            duplicate = os.path.exists(blob)
+            if duplicate:
+                os.remove(tmp)
+            else:
+                _makedirs(os.path.dirname(blob))
+                # if another worker beat us here, it wrote the same bytes
+                os.rename(tmp, blob)
+
+        metadata['digest'] = digest
+        metadata['path'] = self.path_for(digest)
+        metadata['duplicate'] = duplicate
+
+        if self.names is not None:
+            self._link_name(metadata['path'], filehandle.filename)
+        return filehandle
+
+
+def _fsync_directory(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class GroupCommit(object):
+    """Batches fsyncs from concurrent saves. The first caller to arrive waits
+    `window` seconds for others to join, then syncs everything that was
+    queued in the meantime while the rest wait for it. Each directory is
+    synced once per batch no matter how many files were renamed into it.
+    Every caller still only returns once its own data is durable, and sees
+    the error if syncing its batch failed.
+
+    :param window: Seconds the leader waits for more work to join its batch.
+    """
+    def __init__(self, window=0.002):
+        self.window = window
+        self._cond = threading.Condition()
+        self._files = []
+        self._directories = set()
+        self._batch = 0
+        self._done = 0
+        self._leading = False
+        self._failures = {}
+        self._waiting = {}
+
+    def _flush(self, files, directories):
+        for fd in files:
+            os.fsync(fd)
+        for directory in directories:
+            _fsync_directory(directory)
+
+    def sync(self, files=(), directories=()):
+        """Blocks until every file descriptor in files and every directory in
+        directories has been synced.
+        """
+        with self._cond:
+            batch = self._batch
+            self._waiting[batch] = self._waiting.get(batch, 0) + 1
+            self._files.extend(files)
+            self._directories.update(directories)
+
+            while self._done <= batch:
+                if self._leading:
+                    self._cond.wait()
+                    continue
+
+                self._leading = True
+                self._cond.release()
+                try:
+                    time.sleep(self.window)
+                finally:
+                    self._cond.acquire()
+
+                current, self._batch = self._batch, self._batch + 1
+                files, self._files = self._files, []
+                directories, self._directories = self._directories, set()
+
+                error = None
+                self._cond.release()
+                try:
+                    self._flush(files, directories)
+                except Exception as e:
+                    error = e
+                finally:
+                    self._cond.acquire()
+                    if error is not None:
+                        self._failures[current] = error
+                    self._done = current + 1
+                    self._leading = False
+                    self._cond.notify_all()
+
+            # every caller in the batch sees its error, the last one clears it
+            self._waiting[batch] -= 1
+            if self._waiting[batch]:
+                error = self._failures.get(batch)
+            else:
+                del self._waiting[batch]
+                error = self._failures.pop(batch, None)
+        if error is not None:
+            raise error
+
+
+class _PendingWrite(object):
+    "A finished write to a temporary file, waiting to be renamed into place."
+    def __init__(self, destination, tmp, path):
+        self.destination = destination
+        self.tmp = tmp
+        self.path = path
+
+    def commit(self):
+        os.rename(self.tmp, self.path)
+        if self.destination.fsync:
+            self.destination._sync(directories=[os.path.dirname(self.path) or '.'])
+
+    def rollback(self):
+        try:
+            os.remove(self.tmp)
+        except OSError:
+            pass
+
+    def __repr__(self):
+        return '_PendingWrite({0!r})'.format(self.path)
+
+
+class AtomicFileDestination(object):
+    """Writes uploads to a temporary file in the same directory as their final
+    path and only renames them into place once postprocessing has succeeded.
+    Readers never see a half written file, and a failure anywhere after the
+    write (a postprocessor, a consumer rejecting the upload) removes the
+    temporary file instead. This relies on Transfer committing or rolling
+    back the pending write the destination returns.
+
+    When `fsync` is on, the file is synced before the rename and its
+    directory after it, so a committed upload survives a crash. Pass a
+    GroupCommit as `group_commit` to batch those syncs across concurrent
+    saves rather than paying for them on every upload.
+
+    .. code-block:: python
+
+        Reports = Transfer(destination=AtomicFileDestination(
+            'uploads/reports', group_commit=GroupCommit()))
+
+    :param path: Path to save to. If it's a directory, the filehandle's
+        filename -- passed through `secure_filename` -- is saved inside
+        it. May also be a callable that's passed the filehandle and metadata
+        and returns the path.
+    :param fsync: Toggle syncing the file and its directory.
+    :param group_commit: Optional GroupCommit shared by concurrent saves.
+    :param buffer_size: Size of the chunks read from the stream, picked
+        per upload by `buffering.buffer_size_for` if not given.
+    """
+    def __init__(self, path, fsync=True, group_commit=None, buffer_size=None):
+        self._path = path
+        self.fsync = fsync
+        self.group_commit = group_commit
+        self.buffer_size = buffer_size
+
+    def __repr__(self):
+        return 'AtomicFileDestination({0!r})'.format(self._path)
+
+    def path(self, filehandle, metadata):
+        path = self._path(filehandle, metadata) if callable(self._path) else self._path
+        if os.path.isdir(path):
+            path = os.path.join(path, secure_filename(filehandle.filename))
+        return path
+
+    def _sync(self, files=(), directories=()):
+        if self.group_commit is not None:
+            self.group_commit.sync(files, directories)
+            return
+        for fd in files:
+            os.fsync(fd)
+        for directory in directories:
+            _fsync_directory(directory)
+
+    def __call__(self, filehandle, metadata):
+        path = metadata['path'] = self.path(filehandle, metadata)
+        directory, name = os.path.split(path)
+        fd, tmp = tempfile.mkstemp(dir=directory or '.', prefix='.' + name, suffix='.tmp')
+        buffer_size = (self.buffer_size or buffer_size_for(filehandle, metadata, path) or
+                       DEFAULT_CHUNK_SIZE)
+        try:
+            _publish_mode(tmp)
+            with os.fdopen(fd, 'wb') as fh:
+                if not copy_to_file(filehandle.stream, fh):
+                    while True:
+                        chunk = filehandle.stream.read(buffer_size)
+                        if not chunk:
+                            break
+                        fh.write(chunk)
+                if self.fsync:
+                    fh.flush()
+                    self._sync(files=[fh.fileno()])
+        except Exception:
+            os.remove(tmp)
+            raise
+        return _PendingWrite(self, tmp, path)
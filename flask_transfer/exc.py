@@ -1,2 +1,92 @@
+import math
+
+from werkzeug.exceptions import ServiceUnavailable
+
+
+def _validator_name(validator):
+    "Cheap, non-recursive name for a validator."
+    return getattr(validator, '__name__', None) or validator.__class__.__name__
+
+
 class UploadError(Exception):
-    "Base exception for Flask-Transfer"
+    """Base exception for Flask-Transfer
+
+    Along with a human readable message, an UploadError carries structured
+    information about the failure, so views can react to it without parsing
+    strings:
+
+        * `reason`: short code for the failure, e.g. `invalid_extension`,
+          `returned_false` or `too_large`. None if not provided.
+        * `validator`: the validator that failed, if known.
+        * `filename`: the name of the rejected file, if known.
+        * `errors`: the nested UploadErrors when several failures are being
+          reported at once.
+
+    The message may be a callable, in which case it's only called the first
+    time the message is needed. This keeps rejecting uploads cheap when the
+    message involves repr-ing large objects and is never looked at. When no
+    message is given but `errors` is, the message is the list of the nested
+    errors' messages.
+
+    .. code-block:: python
+
+        @app.errorhandler(UploadError)
+        def rejected(error):
+            return jsonify(error.to_dict()), 400
+    """
+    def __init__(self, message=None, reason=None, validator=None, filename=None,
+                 errors=None):
+        super(UploadError, self).__init__()
+        self._message = message
+        self.reason = reason
+        self.validator = validator
+        self.filename = filename
+        self.errors = list(errors) if errors else []
+
+    @property
+    def message(self):
+        if callable(self._message):
+            self._message = self._message()
+        if self._message is None and self.errors:
+            return [error.message for error in self.errors]
+        return self._message
+
+    @property
+    def args(self):
+        return (self.message,)
+
+    def __str__(self):
+        message = self.message
+        return '' if message is None else str(message)
+
+    def __repr__(self):
+        return '{0}({1!r})'.format(self.__class__.__name__, self.message)
+
+    def to_dict(self):
+        "Returns the error as a dictionary of plain, serializable values."
+        return {
+            'reason': self.reason,
+            'filename': self.filename,
+            'validator': None if self.validator is None else _validator_name(self.validator),
+            'message': str(self),
+            'errors': [error.to_dict() for error in self.errors],
+        }
+
+
+class TransferBusy(ServiceUnavailable):
+    """Raised when there's no capacity to take on another upload right now,
+    rather than queueing it indefinitely. It's a werkzeug HTTPException, so
+    unless it's handled Flask answers with a 503 and, when `retry_after` is
+    known, a Retry-After header.
+    """
+    description = 'Too many uploads are being processed, try again shortly.'
+
+    def __init__(self, description=None, retry_after=None):
+        super(TransferBusy, self).__init__(description)
+        self.retry_after = retry_after
+
+    def get_headers(self, *args, **kwargs):
+        headers = super(TransferBusy, self).get_headers(*args, **kwargs)
+        if self.retry_after is not None:
+            headers.append(('Retry-After', str(int(math.ceil(self.retry_after)))))
+        return headers
@@ -0,0 +1,146 @@
+"""
+    flask_transfer.hashing
+    ~~~~~~~~~~~~~~~~~~~~~~
+    Checksums computed while the destination writes the upload, instead of
+    by reading the saved file back afterwards.
+"""
+from base64 import b64decode
+from functools import partial
+import binascii
+import hashlib
+
+from flask import has_request_context, request
+
+from .exc import UploadError
+
+__all__ = ['Digests', 'expected_digests']
+
+
+# HTTP digest algorithm tokens (RFC 3230, RFC 9530) to hashlib names
+_HTTP_ALGORITHMS = {'md5': 'md5', 'sha': 'sha1', 'sha-1': 'sha1',
+                    'sha-256': 'sha256', 'sha-384': 'sha384', 'sha-512': 'sha512'}
+
+_DIGEST_HEADERS = ('Content-Digest', 'Repr-Digest', 'Digest')
+
+
+def _decode(value):
+    value = value.strip()
+    if len(value) > 1 and value[0] == value[-1] == ':':
+        # RFC 9530 byte sequences are wrapped in colons
+        value = value[1:-1]
+    try:
+        return binascii.hexlify(b64decode(value)).decode('ascii')
+    except (binascii.Error, TypeError, ValueError):
+        return None
+
+
+def _from_headers(headers):
+    expected = {}
+    for name in _DIGEST_HEADERS:
+        for pair in (headers.get(name) or '').split(','):
+            token, _, value = pair.partition('=')
+            algorithm = _HTTP_ALGORITHMS.get(token.strip().lower())
+            digest = _decode(value) if algorithm else None
+            if digest:
+                expected.setdefault(algorithm, digest)
+    md5 = headers.get('Content-MD5')
+    if md5 and _decode(md5):
+        expected.setdefault('md5', _decode(md5))
+    return expected
+
+
+def _body_is_upload(filehandle):
+    "Guesses whether the request's body is the upload, so its headers describe it."
+    if not has_request_context() or request.mimetype.startswith('multipart/'):
+        return False
+    length = getattr(filehandle, 'content_length', None)
+    return not length or length == request.content_length
+
+
+def expected_digests(filehandle, metadata):
+    """Finds the digests the client says the upload has, as a dictionary of
+    hashlib names to hex digests. Looked for, in order, in:
+
+        * the metadata's `expected_digests`, already in that form.
+        * the filehandle's own headers, e.g. a part of a multipart form.
+        * the request's headers, if the request body is the upload rather
+          than a form holding it (or one chunk of it).
+
+    ``Content-MD5`` and the ``Digest``, ``Content-Digest`` and
+    ``Repr-Digest`` headers are understood.
+    """
+    expected = dict(metadata.get('expected_digests') or {})
+    for algorithm, digest in _from_headers(getattr(filehandle, 'headers', None) or {}).items():
+        expected.setdefault(algorithm, digest)
+    if _body_is_upload(filehandle):
+        for algorithm, digest in _from_headers(request.headers).items():
+            expected.setdefault(algorithm, digest)
+    return dict((algorithm, digest.lower()) for algorithm, digest in expected.items())
+
+
+class Digests(object):
+    """Chunk consumer factory that hashes the upload as the destination
+    reads it, so a checksum costs no extra pass over the file. When the
+    upload ends, the hex digests are put in the metadata's `digests` as a
+    dictionary keyed by algorithm, where postprocessors can find them.
+
+    With `verify` on, the digests the client sent (see `expected_digests`)
+    are computed as well and checked once the upload ends; a mismatch
+    raises UploadError, aborting the save. Since the destination has seen
+    every byte by then, pair it with a destination that can roll back, like
+    `AtomicFileDestination`, so a corrupt upload never lands.
+
+    .. code-block:: python
+
+        ImageTransfer = Transfer(consumers=[Digests('md5', 'sha256', verify=True)])
+
+    Hashing needs the bytes to pass through Python, so the kernel copy and
+    hardlink shortcuts for uploads already on disk are skipped.
+
+    :param algorithms: Names of hashlib algorithms, sha256 if none.
+    :param verify: Check the digests the client sent.
+    :param key: Metadata key the digests are placed under.
+    """
+    def __init__(self, *algorithms, **kwargs):
+        self.algorithms = tuple(algorithms) or ('sha256',)
+        self.verify = kwargs.pop('verify', False)
+        self.key = kwargs.pop('key', 'digests')
+        if kwargs:
+            raise TypeError('Unexpected arguments: {0}'.format(', '.join(kwargs)))
+        for algorithm in self.algorithms:
+            # fail now, not in the middle of an upload
+            hashlib.new(algorithm)
+
+    def __repr__(self):
+        return 'Digests({0})'.format(', '.join(self.algorithms))
+
+    def _mismatch(self, filehandle, algorithm):
+        msg = '{0} does not match its {1} digest'
+        return UploadError(partial(msg.format, filehandle.filename, algorithm),
+                           reason='digest_mismatch', validator=self,
+                           filename=filehandle.filename)
+
+    def __call__(self, filehandle, metadata):
+        expected = expected_digests(filehandle, metadata) if self.verify else {}
+        hashers = {}
+        for algorithm in self.algorithms + tuple(sorted(expected)):
+            if algorithm not in hashers:
+                try:
+                    hashers[algorithm] = hashlib.new(algorithm)
+                except ValueError:
+                    # can't check what we can't compute
+                    expected.pop(algorithm, None)
+        updates = [hasher.update for hasher in hashers.values()]
+
+        def consume(chunk):
+            if chunk:
+                for update in updates:
+                    update(chunk)
+                return
+
+            digests = dict((name, hasher.hexdigest()) for name, hasher in hashers.items())
+            metadata[self.key] = digests
+            for algorithm, digest in expected.items():
+                if digests[algorithm] != digest:
+                    raise self._mismatch(filehandle, algorithm)
+        return consume
@@ -0,0 +1,289 @@
+"""
+    flask_transfer.limits
+    ~~~~~~~~~~~~~~~~~~~~~
+    Limits on how many uploads are saved at once, and how many bytes they
+    add up to, so a traffic spike queues up or is turned away instead of
+    every save fighting over the same disk.
+"""
+from collections import deque
+import threading
+
+from .buffering import _upload_size
+from .exc import TransferBusy
+from .transfer import _make_destination_callable
+
+__all__ = ['ConcurrencyLimiter', 'LimitedDestination', 'Slot']
+
+
+class Slot(object):
+    """A save's place in a ConcurrencyLimiter, either granted or waiting its
+    turn. Releasing a granted slot lets the next save in; it's also a
+    context manager that releases on exit.
+    """
+    __slots__ = ('limiter', 'size', 'large', 'granted', 'released', '_event', '_callback')
+
+    def __init__(self, limiter, size, large, callback=None):
+        self.limiter = limiter
+        self.size = size
+        self.large = large
+        self.granted = False
+        self.released = False
+        self._event = None
+        self._callback = callback
+
+    def __repr__(self):
+        state = 'granted' if self.granted else 'waiting'
+        return '<Slot {0} bytes, {1}>'.format(self.size, state)
+
+    def _wake(self):
+        "Tells the waiter it's been granted, outside of the limiter's lock."
+        if self._event is not None:
+            self._event.set()
+        if self._callback is not None:
+            self._callback()
+
+    def wait(self, timeout=None):
+        "Waits up to timeout seconds to be granted, returning whether it was."
+        return self.granted or self._event.wait(timeout)
+
+    def cancel(self):
+        """Gives up waiting. Returns True if the slot was withdrawn, False if
+        it had already been granted -- and so still has to be released.
+        """
+        return self.limiter._cancel(self)
+
+    def release(self):
+        if self.granted and not self.released:
+            self.released = True
+            self.limiter._release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class ConcurrencyLimiter(object):
+    """Limits the saves in flight at once, by count and by the bytes they
+    add up to. Saves past the limits queue for their turn -- or, once
+    `max_queue` are waiting or after waiting `timeout` seconds, are turned
+    away with TransferBusy, which Flask answers with a 503 and a
+    Retry-After header.
+
+    Small and large uploads queue separately, so a burst of big uploads
+    doesn't hold up the small ones behind them: small uploads go first,
+    but after `large_every` of them in a row a waiting large upload gets
+    its turn, and nothing more is let in until it fits. Uploads of unknown
+    size queue as large and don't count towards `max_bytes`. A single
+    upload larger than `max_bytes` is let in when nothing else is in
+    flight.
+
+    Give a Transfer one to limit its saves, share one between Transfers
+    for a global limit, or wrap a destination in a LimitedDestination to
+    limit just the writes to it:
+
+    .. code-block:: python
+
+        limiter = ConcurrencyLimiter(max_saves=8, max_bytes=512 * 1024 * 1024,
+                                     timeout=5, collector=collector)
+        ImageTransfer = Transfer(limiter=limiter)
+
+    With a `collector` (such as `metrics.HistogramCollector`), the queue
+    depth for small and large uploads, the saves and bytes in flight and
+    the number of saves turned away are published as gauges labeled with
+    the limiter's `name`, ready to autoscale on.
+
+    :param max_saves: Saves allowed in flight at once, None for no limit.
+    :param max_bytes: Bytes allowed in flight at once, None for no limit.
+    :param max_queue: Saves allowed to wait, None for no limit.
+    :param timeout: Seconds a save waits before it's turned away, None to
+        wait as long as it takes and 0 to turn it away instead of waiting.
+    :param retry_after: Seconds clients are told to wait before retrying,
+        defaults to timeout, or 1.
+    :param small_upload: Uploads of up to this many bytes are small.
+    :param large_every: Small uploads let in ahead of a waiting large one.
+    :param collector: Optional object with a `set_gauge(name, value,
+        **labels)` method that queue depths are published to.
+    :param name: Label for the published gauges.
+    """
+    def __init__(self, max_saves=None, max_bytes=None, max_queue=None, timeout=None,
+                 retry_after=None, small_upload=1024 * 1024, large_every=4,
+                 collector=None, name='transfer'):
+        self.max_saves = max_saves
+        self.max_bytes = max_bytes
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.retry_after = retry_after or timeout or 1
+        self.small_upload = small_upload
+        self.large_every = large_every
+        self.collector = collector
+        self.name = name
+        self.in_flight = 0
+        self.bytes_in_flight = 0
+        self.rejected = 0
+        self._small = deque()
+        self._large = deque()
+        self._small_streak = 0
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return 'ConcurrencyLimiter(max_saves={0!r}, max_bytes={1!r})'.format(
+            self.max_saves, self.max_bytes)
+
+    @property
+    def queued(self):
+        return len(self._small) + len(self._large)
+
+    def _fits(self, slot):
+        if self.max_saves is not None and self.in_flight >= self.max_saves:
+            return False
+        if self.max_bytes is None or not self.in_flight:
+            return True
+        return self.bytes_in_flight + slot.size <= self.max_bytes
+
+    def _next(self):
+        "Picks the next waiting slot to let in, if any fits."
+        small, large = self._small, self._large
+        if large and (not small or self._small_streak >= self.large_every):
+            order = (large, small)
+        else:
+            order = (small, large)
+
+        for queue in order:
+            if queue and self._fits(queue[0]):
+                return queue.popleft()
+            if queue is large and queue:
+                # it's the large upload's turn, hold everything else back
+                # until it fits so it isn't starved
+                return None
+        return None
+
+    def _take(self, slot):
+        self.in_flight += 1
+        self.bytes_in_flight += slot.size
+        self._small_streak = 0 if slot.large else self._small_streak + 1
+        # granted under the lock, so a cancel that finds it gone from the
+        # queue always sees it granted
+        slot.granted = True
+
+    def _dispatch(self):
+        granted = []
+        while True:
+            slot = self._next()
+            if slot is None:
+                break
+            self._take(slot)
+            granted.append(slot)
+        return granted
+
+    def _publish(self):
+        if self.collector is None:
+            return
+        gauge = self.collector.set_gauge
+        gauge('limiter_queue_depth', len(self._small), limiter=self.name, size='small')
+        gauge('limiter_queue_depth', len(self._large), limiter=self.name, size='large')
+        gauge('limiter_saves_in_flight', self.in_flight, limiter=self.name)
+        gauge('limiter_bytes_in_flight', self.bytes_in_flight, limiter=self.name)
+        gauge('limiter_rejected', self.rejected, limiter=self.name)
+
+    def _busy(self):
+        self.rejected += 1
+        return TransferBusy(retry_after=self.retry_after)
+
+    def _slot(self, filehandle, callback=None):
+        size = _upload_size(filehandle)
+        large = size is None or size > self.small_upload
+        return Slot(self, size or 0, large, callback)
+
+    def try_acquire(self, filehandle):
+        """Returns a granted slot for the filehandle if one is free and no
+        other save is waiting for it, otherwise None. Never waits or queues.
+        """
+        slot = self._slot(filehandle)
+        with self._lock:
+            if self.queued or not self._fits(slot):
+                return None
+            self._take(slot)
+            self._publish()
+        return slot
+
+    def request(self, filehandle, callback=None):
+        """Asks for a slot for the filehandle. The slot returned is either
+        granted already or waiting, in which case callback -- if given -- is
+        called from whichever thread grants it. Raises TransferBusy if it
+        can't be granted and isn't allowed to wait.
+        """
+        slot = self._slot(filehandle, callback)
+        large = slot.large
+        if callback is None:
+            slot._event = threading.Event()
+
+        with self._lock:
+            (self._large if large else self._small).append(slot)
+            granted = self._dispatch()
+            if not slot.granted:
+                too_many = self.max_queue is not None and self.queued > self.max_queue
+                if self.timeout == 0 or too_many:
+                    (self._large if large else self._small).remove(slot)
+                    error = self._busy()
+                    self._publish()
+                    raise error
+            self._publish()
+
+        for other in granted:
+            other._wake()
+        return slot
+
+    def acquire(self, filehandle):
+        """Waits for a slot for the filehandle and returns it, granted.
+        Raises TransferBusy if it can't wait, or waits longer than timeout.
+        """
+        slot = self.request(filehandle)
+        if not slot.wait(self.timeout) and slot.cancel():
+            raise TransferBusy(retry_after=self.retry_after)
+        return slot
+
+    def _cancel(self, slot):
+        with self._lock:
+            queue = self._large if slot.large else self._small
+            if slot.granted or slot not in queue:
+                return False
+            queue.remove(slot)
+            self.rejected += 1
+            # the slot may have been holding back everything behind it
+            granted = self._dispatch()
+            self._publish()
+        for other in granted:
+            other._wake()
+        return True
+
+    def _release(self, slot):
+        with self._lock:
+            self.in_flight -= 1
+            self.bytes_in_flight -= slot.size
+            granted = self._dispatch()
+            self._publish()
+        for other in granted:
+            other._wake()
+
+
+class LimitedDestination(object):
+    """Wraps a destination so only as many writes to it as the limiter
+    allows happen at once, e.g. to keep a slow disk from thrashing while
+    everything else about saving runs at full speed.
+
+    .. code-block:: python
+
+        archive = LimitedDestination('/mnt/archive', ConcurrencyLimiter(max_saves=2))
+    """
+    def __init__(self, destination, limiter):
+        self.destination = _make_destination_callable(destination)
+        self.limiter = limiter
+
+    def __repr__(self):
+        return 'LimitedDestination({0!r}, {1!r})'.format(self.destination, self.limiter)
+
+    def __call__(self, filehandle, metadata):
+        with self.limiter.acquire(filehandle):
+            return self.destination(filehandle, metadata)
@@ -0,0 +1,271 @@
+"""
+    flask_transfer.metrics
+    ~~~~~~~~~~~~~~~~~~~~~~
+    Timing of every stage of saving an upload, reported to pluggable
+    listeners, along with an in memory histogram collector and a Prometheus
+    text exporter for it.
+"""
+from collections import namedtuple
+import bisect
+import threading
+import time
+
+from flask import Response
+from werkzeug._compat import string_types
+
+from .exc import UploadError, _validator_name
+
+__all__ = ['TransferEvent', 'HistogramCollector', 'prometheus_text',
+           'metrics_view', 'DEFAULT_BUCKETS']
+
+
+_timer = getattr(time, 'perf_counter', time.time)
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class TransferEvent(namedtuple('TransferEvent', ['phase', 'stage', 'name', 'filename',
+                                                 'elapsed', 'nbytes', 'outcome',
+                                                 'error'])):
+    """Reported to listeners when a stage starts and stops.
+
+        * `phase`: `start` or `stop`.
+        * `stage`: one of the pipeline's stages -- `save`, `validate`,
+          `queue`, `preprocess`, `write`, `postprocess`, `commit` -- or, for a single
+          callable, `validator`, `preprocessor` or `postprocessor`.
+        * `name`: the stage again, or the name of the validator or processor.
+        * `filename`: the upload's filename.
+        * `elapsed`: seconds the stage took. None on start.
+        * `nbytes`: bytes read from the upload during the `write` stage.
+          None otherwise.
+        * `outcome`: `ok`, `rejected` (an UploadError, or a validator
+          returning False) or `error` (anything else). None on start.
+        * `error`: the exception the stage raised, if any.
+    """
+    __slots__ = ()
+
+
+def _position(filehandle):
+    try:
+        return filehandle.stream.tell()
+    except (AttributeError, IOError, OSError, ValueError):
+        return None
+
+
+class _Span(object):
+    """A stage that's been started. Sends the start event when it's created,
+    `finish` sends the stop event.
+    """
+    __slots__ = ('listeners', 'stage', 'name', 'filehandle', 'filename',
+                 'started', 'position')
+
+    def __init__(self, listeners, stage, subject, filehandle, count_bytes=False):
+        self.listeners = listeners
+        self.stage = stage
+        self.name = subject if isinstance(subject, string_types) else _validator_name(subject)
+        self.filehandle = filehandle
+        self.filename = getattr(filehandle, 'filename', None)
+        self.position = _position(filehandle) if count_bytes else None
+        _emit(listeners, TransferEvent('start', stage, self.name, self.filename,
+                                       None, None, None, None))
+        self.started = _timer()
+
+    def finish(self, outcome, error=None):
+        elapsed = _timer() - self.started
+        nbytes = None
+        if self.position is not None:
+            after = _position(self.filehandle)
+            if after is not None:
+                nbytes = after - self.position
+        _emit(self.listeners, TransferEvent('stop', self.stage, self.name, self.filename,
+                                            elapsed, nbytes, outcome, error))
+
+    def fail(self, error):
+        self.finish('rejected' if isinstance(error, UploadError) else 'error', error)
+
+
+def _emit(listeners, event):
+    for listener in listeners:
+        listener(event)
+
+
+def _observe(listeners, stage, subject, filehandle, fn, *args, **kwargs):
+    """Calls fn, reporting it to listeners as stage. A falsey result from a
+    validator counts as rejected.
+    """
+    span = _Span(listeners, stage, subject, filehandle,
+                 count_bytes=kwargs.pop('count_bytes', False))
+    try:
+        result = fn(*args)
+    except Exception as e:
+        span.fail(e)
+        raise
+    span.finish('rejected' if stage == 'validator' and not result else 'ok')
+    return result
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(pairs):
+    return ','.join('{0}="{1}"'.format(key, _escape(value)) for key, value in pairs)
+
+
+def _format_float(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class _Histogram(object):
+    __slots__ = ('counts', 'count', 'total')
+
+    def __init__(self, size):
+        self.counts = [0] * size
+        self.count = 0
+        self.total = 0.0
+
+
+class HistogramCollector(object):
+    """Listener that keeps a histogram of how long each stage, validator and
+    processor took, per outcome, plus the total bytes written. Everything is
+    kept in memory, so it's per process.
+
+    .. code-block:: python
+
+        collector = HistogramCollector()
+        ImageTransfer = Transfer(validators=[AllowedExts('png', 'jpg')],
+                                 listeners=[collector])
+
+        app.add_url_rule('/metrics', 'metrics', metrics_view(collector))
+
+    :param buckets: Upper bounds, in seconds, of the histogram buckets.
+    """
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._histograms = {}
+        self._bytes = {}
+        self._gauges = {}
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return 'HistogramCollector(buckets={0!r})'.format(self.buckets)
+
+    def __call__(self, event):
+        if event.phase != 'stop':
+            return
+        key = (event.stage, event.name, event.outcome)
+        index = bisect.bisect_left(self.buckets, event.elapsed)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = _Histogram(len(self.buckets) + 1)
+            histogram.counts[index] += 1
+            histogram.count += 1
+            histogram.total += event.elapsed
+            if event.nbytes:
+                bytes_key = (event.stage, event.name)
+                self._bytes[bytes_key] = self._bytes.get(bytes_key, 0) + event.nbytes
+
+    def set_gauge(self, name, value, **labels):
+        "Records the current value of something, e.g. a queue's depth."
+        with self._lock:
+            self._gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def count(self, stage, name=None, outcome=None):
+        "Number of times stage (and optionally name and outcome) finished."
+        return sum(h.count for (s, n, o), h in self._histograms.items()
+                   if s == stage and name in (None, n) and outcome in (None, o))
+
+    def total_bytes(self, stage='write', name=None):
+        return self._bytes.get((stage, name or stage), 0)
+
+    def quantile(self, stage, q, name=None):
+        """Estimates a quantile of stage's duration from the histogram,
+        returning the upper bound of the bucket it falls in.
+        """
+        with self._lock:
+            counts = [0] * (len(self.buckets) + 1)
+            for (s, n, _), histogram in self._histograms.items():
+                if s == stage and (name or stage) == n:
+                    counts = [a + b for a, b in zip(counts, histogram.counts)]
+        total = sum(counts)
+        if not total:
+            return None
+        running = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            running += count
+            if running >= q * total:
+                return bound
+        return float('inf')
+
+    def snapshot(self):
+        """Returns a copy of everything collected: histograms keyed by
+        (stage, name, outcome) as (cumulative bucket counts, count, sum),
+        bytes keyed by (stage, name) and gauges keyed by (name, labels).
+        """
+        with self._lock:
+            histograms = {}
+            for key, histogram in self._histograms.items():
+                cumulative, running = [], 0
+                for count in histogram.counts:
+                    running += count
+                    cumulative.append(running)
+                histograms[key] = (cumulative, histogram.count, histogram.total)
+            return histograms, dict(self._bytes), dict(self._gauges)
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._bytes.clear()
+            self._gauges.clear()
+
+
+def prometheus_text(collector, prefix='flask_transfer'):
+    "Renders a HistogramCollector in the Prometheus text exposition format."
+    histograms, nbytes, gauges = collector.snapshot()
+    bounds = collector.buckets + (float('inf'),)
+    lines = []
+
+    metric = prefix + '_stage_duration_seconds'
+    lines.append('# HELP {0} Time spent in each stage of saving uploads.'.format(metric))
+    lines.append('# TYPE {0} histogram'.format(metric))
+    for (stage, name, outcome), (cumulative, count, total) in sorted(histograms.items()):
+        labels = [('stage', stage), ('name', name), ('outcome', outcome)]
+        for bound, running in zip(bounds, cumulative):
+            lines.append('{0}_bucket{{{1}}} {2}'.format(
+                metric, _labels(labels + [('le', _format_float(bound))]), running))
+        lines.append('{0}_sum{{{1}}} {2}'.format(metric, _labels(labels), repr(total)))
+        lines.append('{0}_count{{{1}}} {2}'.format(metric, _labels(labels), count))
+
+    metric = prefix + '_bytes_total'
+    lines.append('# HELP {0} Bytes read from uploads.'.format(metric))
+    lines.append('# TYPE {0} counter'.format(metric))
+    for (stage, name), total in sorted(nbytes.items()):
+        lines.append('{0}{{{1}}} {2}'.format(
+            metric, _labels([('stage', stage), ('name', name)]), total))
+
+    for name in sorted(set(name for name, _ in gauges)):
+        metric = '{0}_{1}'.format(prefix, name)
+        lines.append('# TYPE {0} gauge'.format(metric))
+        for (gauge, labels), value in sorted(gauges.items()):
+            if gauge == name:
+                lines.append('{0}{{{1}}} {2}'.format(metric, _labels(labels), value))
+
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(collector, prefix='flask_transfer'):
+    """Creates a Flask view function serving the collector's metrics to
+    Prometheus.
+
+    .. code-block:: python
+
+        app.add_url_rule('/metrics', 'metrics', metrics_view(collector))
+    """
+    def view():
+        return Response(prometheus_text(collector, prefix),
+                        mimetype='text/plain; version=0.0.4')
+    return view
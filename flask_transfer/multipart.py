@@ -0,0 +1,402 @@
+"""
+    flask_transfer.multipart
+    ~~~~~~~~~~~~~~~~~~~~~~~~
+    Multipart uploads: a big file is split into numbered parts that clients
+    send in parallel, over as many connections as they like. Each part is
+    written straight to its place in the assembled file, so completing the
+    upload doesn't copy or concatenate anything.
+"""
+from contextlib import contextmanager
+import json
+import os
+import shutil
+import time
+import uuid
+
+from flask import Blueprint, jsonify, request, url_for
+
+from .exc import UploadError
+from .resumable import (UploadLocked, check_partial, _exclusive, _filehandle, _ID,
+                        _STATUS_FOR_REASON, _unshare)
+from .streaming import DEFAULT_CHUNK_SIZE
+
+__all__ = ['MultipartUpload', 'MultipartUploadStore', 'MultipartUploads',
+           'DEFAULT_PART_SIZE']
+
+
+DEFAULT_PART_SIZE = 8 * 1024 * 1024
+
+
+class MultipartUpload(object):
+    """An upload of `length` bytes arriving as parts of `part_size` bytes,
+    numbered from 1. The last part holds whatever is left over. `metadata`
+    is what the client sent along with it, untrusted.
+    """
+    __slots__ = ('id', 'length', 'part_size', 'filename', 'content_type', 'metadata',
+                 'created')
+
+    def __init__(self, id, length, part_size, filename=None, content_type=None,
+                 metadata=None, created=None):
+        self.id = id
+        self.length = length
+        self.part_size = part_size
+        self.filename = filename
+        self.content_type = content_type
+        self.metadata = metadata or {}
+        self.created = time.time() if created is None else created
+
+    def __repr__(self):
+        return 'MultipartUpload({0!r}, length={1}, part_size={2})'.format(
+            self.id, self.length, self.part_size)
+
+    @property
+    def part_count(self):
+        return max(-(-self.length // self.part_size), 1)
+
+    def part_range(self, number):
+        "Returns the (offset, size) of part number, ValueError if there's none."
+        if not 1 <= number <= self.part_count:
+            raise ValueError('{0!r} has no part {1}'.format(self, number))
+        offset = (number - 1) * self.part_size
+        return offset, min(self.part_size, self.length - offset)
+
+    def to_dict(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+
+class MultipartUploadStore(object):
+    """Keeps multipart uploads in a directory. Each upload gets a data file
+    the size of the whole upload, created sparse so it takes no space until
+    parts arrive, and a marker file for every part that's been received.
+
+    Parts are written through their own file descriptors at their own
+    offsets and only take a shared lock on the upload, so any number of them
+    can be written at once, from any number of processes -- just not while
+    the upload is being completed.
+
+    :param directory: Where uploads are kept, created if needed.
+    :param fsync: Toggle syncing each part before marking it received.
+    :param preallocate: Reserve the upload's disk space up front rather than
+        creating a sparse file, where the platform supports it.
+    """
+    def __init__(self, directory, fsync=True, preallocate=False):
+        self.directory = directory
+        self.fsync = fsync
+        self.preallocate = preallocate
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def __repr__(self):
+        return 'MultipartUploadStore({0!r})'.format(self.directory)
+
+    def _path(self, upload_id, *parts):
+        return os.path.join(self.directory, upload_id, *parts)
+
+    def data_path(self, upload):
+        return self._path(upload.id, 'data')
+
+    def create(self, length, part_size=DEFAULT_PART_SIZE, filename=None,
+               content_type=None, metadata=None):
+        "Starts a new multipart upload of length bytes."
+        upload = MultipartUpload(uuid.uuid4().hex, length, part_size, filename=filename,
+                                 content_type=content_type, metadata=metadata)
+        os.makedirs(self._path(upload.id, 'parts'))
+        with open(self.data_path(upload), 'wb') as fh:
+            if self.preallocate and length and hasattr(os, 'posix_fallocate'):
+                os.posix_fallocate(fh.fileno(), 0, length)
+            else:
+                fh.truncate(length)
+        # written last: an upload without info doesn't exist yet
+        info = self._path(upload.id, 'info.json')
+        with open(info + '.tmp', 'w') as fh:
+            json.dump(upload.to_dict(), fh)
+        os.rename(info + '.tmp', info)
+        return upload
+
+    def get(self, upload_id):
+        "Returns the MultipartUpload for upload_id, None if there isn't one."
+        if not _ID.match(upload_id or ''):
+            return None
+        try:
+            with open(self._path(upload_id, 'info.json')) as fh:
+                return MultipartUpload(**json.load(fh))
+        except (IOError, OSError, ValueError):
+            return None
+
+    def write_part(self, upload, number, stream, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Writes part number from stream into place and marks it received.
+        Raises ValueError, leaving the part unreceived, if the stream doesn't
+        hold exactly the part's size, and UploadLocked if the upload is being
+        completed. Sending a part again replaces it.
+        """
+        offset, size = upload.part_range(number)
+        marker = self._path(upload.id, 'parts', str(number))
+
+        with self.lock(upload, shared=True):
+            if os.path.exists(marker):
+                os.remove(marker)
+
+            written = 0
+            with open(self.data_path(upload), 'r+b') as fh:
+                fh.seek(offset)
+                while written < size:
+                    chunk = stream.read(min(chunk_size, size - written))
+                    if not chunk:
+                        break
+                    fh.write(chunk)
+                    written += len(chunk)
+                if written < size or stream.read(1):
+                    raise ValueError('Part {0} of {1!r} should be {2} bytes'.format(
+                        number, upload, size))
+                fh.flush()
+                if self.fsync:
+                    os.fsync(fh.fileno())
+            open(marker, 'w').close()
+        return written
+
+    def parts(self, upload):
+        "Sorted numbers of the parts that have been received."
+        try:
+            names = os.listdir(self._path(upload.id, 'parts'))
+        except OSError:
+            return []
+        return sorted(int(name) for name in names if name.isdigit())
+
+    def missing(self, upload):
+        "Sorted numbers of the parts that haven't been received yet."
+        received = set(self.parts(upload))
+        return [n for n in range(1, upload.part_count + 1) if n not in received]
+
+    def lock(self, upload, shared=False):
+        """Exclusive lock on the upload, raises UploadLocked if someone else
+        has it. Shared locks, held while parts are written, only exclude an
+        exclusive one.
+        """
+        return _exclusive(self._path(upload.id, 'lock'), upload.id, shared)
+
+    def open(self, upload):
+        "Opens the upload's data for reading."
+        return open(self.data_path(upload), 'rb')
+
+    @contextmanager
+    def assembled(self, upload):
+        """Moves the upload's data out of the way of part writes and opens it
+        for reading, so nothing sent afterwards can change what's saved --
+        or, once it's hard linked into place, the saved file itself. The
+        data is moved back, unlinked from anything the block linked it to,
+        if the block raises.
+        """
+        path = self._path(upload.id, 'assembled')
+        os.rename(self.data_path(upload), path)
+        try:
+            with open(path, 'rb') as stream:
+                yield stream
+        except Exception:
+            # the failed save may have linked it into place, and parts sent
+            # again are written over it
+            _unshare(path)
+            os.rename(path, self.data_path(upload))
+            raise
+
+    def delete(self, upload):
+        shutil.rmtree(self._path(upload.id), ignore_errors=True)
+
+    def purge(self, max_age):
+        """Deletes uploads created more than max_age seconds ago, i.e. ones
+        clients never completed or aborted. Returns how many.
+        """
+        cutoff = time.time() - max_age
+        purged = 0
+        for name in os.listdir(self.directory):
+            upload = self.get(name)
+            if upload is not None and upload.created < cutoff:
+                self.delete(upload)
+                purged += 1
+        return purged
+
+
+class MultipartUploads(object):
+    """Multipart uploads for a Transfer, served by a blueprint:
+
+        * ``POST /`` with a JSON body holding the upload's `length`, and
+          optionally a `part_size`, `filename`, `content_type` and
+          `metadata`, initiates an upload. The response says how many parts
+          to send and how big they are.
+        * ``PUT /<id>/parts/<n>`` with the part as its body sends part n.
+          Parts can be sent in any order, at the same time, and again if
+          sending them failed.
+        * ``GET /<id>`` lists the parts received and missing.
+        * ``POST /<id>/complete`` saves the upload once every part is in.
+        * ``DELETE /<id>`` aborts it.
+
+    As with resumable uploads, validators that can judge an upload from its
+    name, declared length or first few bytes run when it's initiated and
+    when its first part arrives. Completing the upload saves the assembled
+    file with the Transfer as usual -- every validator and processor runs on
+    it -- and path destinations link it into place rather than copying it.
+
+    .. code-block:: python
+
+        uploads = MultipartUploads(VideoTransfer, MultipartUploadStore('parts'),
+                                   destination='videos/latest.mp4')
+        app.register_blueprint(uploads.blueprint(), url_prefix='/multipart')
+
+    Metadata for the save holds the client's metadata as `upload_metadata`
+    and the upload's id as `upload_id`.
+
+    :param transfer: Transfer that validates, processes and saves uploads.
+    :param store: MultipartUploadStore holding the parts.
+    :param destination: Destination to save to, the Transfer's if None.
+    :param max_size: Largest upload that may be initiated, in bytes.
+    :param part_size: Part size used when the client doesn't ask for one.
+    :param min_part_size: Smallest part size a client may ask for.
+    :param max_parts: Most parts an upload may be split into.
+    :param chunk_size: Size of the chunks read from each request.
+    :param metadata: Optional callable that's passed the MultipartUpload and
+        returns more metadata for the save, e.g. the current user.
+    """
+    def __init__(self, transfer, store, destination=None, max_size=None,
+                 part_size=DEFAULT_PART_SIZE, min_part_size=64 * 1024, max_parts=10000,
+                 chunk_size=DEFAULT_CHUNK_SIZE, metadata=None):
+        self.transfer = transfer
+        self.store = store
+        self.destination = destination
+        self.max_size = max_size
+        self.part_size = part_size
+        self.min_part_size = min_part_size
+        self.max_parts = max_parts
+        self.chunk_size = chunk_size
+        self.metadata = metadata
+
+    def __repr__(self):
+        return 'MultipartUploads({0!r}, {1!r})'.format(self.transfer, self.store)
+
+    def complete(self, upload):
+        """Saves the assembled upload with the Transfer and returns the
+        filehandle. Hold the store's lock on the upload while it runs.
+        """
+        metadata = {'upload_id': upload.id, 'upload_metadata': dict(upload.metadata),
+                    'hardlink': True}
+        if self.metadata is not None:
+            metadata.update(self.metadata(upload))
+        with self.store.assembled(upload) as stream:
+            filehandle = self.transfer.save(_filehandle(upload, stream),
+                                            destination=self.destination,
+                                            metadata=metadata)
+        self.store.delete(upload)
+        return filehandle
+
+    def _status(self, upload, status=200):
+        response = jsonify({
+            'upload_id': upload.id,
+            'length': upload.length,
+            'part_size': upload.part_size,
+            'part_count': upload.part_count,
+            'received': self.store.parts(upload),
+            'missing': self.store.missing(upload),
+            'location': url_for('.upload', upload_id=upload.id, _external=True),
+        })
+        response.status_code = status
+        return response
+
+    def _error(self, status, message, **extra):
+        response = jsonify(dict(extra, message=message))
+        response.status_code = status
+        return response
+
+    def _rejected(self, upload, error):
+        self.store.delete(upload)
+        response = jsonify(error.to_dict())
+        response.status_code = _STATUS_FOR_REASON.get(error.reason, 400)
+        return response
+
+    def _initiate(self):
+        body = request.get_json(silent=True)
+        if not isinstance(body, dict):
+            return self._error(400, 'Expected a JSON object')
+        try:
+            length = int(body['length'])
+            part_size = int(body.get('part_size') or self.part_size)
+        except (KeyError, TypeError, ValueError):
+            return self._error(400, 'length and part_size must be integers')
+        metadata = body.get('metadata') or {}
+        if length < 0 or not isinstance(metadata, dict):
+            return self._error(400, 'Invalid upload')
+        if self.max_size is not None and length > self.max_size:
+            return self._error(413, 'Uploads may be at most {0} bytes'.format(self.max_size))
+        if part_size < self.min_part_size:
+            return self._error(400, 'Parts must be at least {0} bytes'.format(
+                self.min_part_size))
+        # grow the parts rather than refuse the upload
+        part_size = max(part_size, -(-length // self.max_parts))
+
+        upload = self.store.create(length, part_size, filename=body.get('filename'),
+                                   content_type=body.get('content_type'),
+                                   metadata=metadata)
+        try:
+            check_partial(self.transfer, upload, self.store.open, -1, 0)
+        except UploadError as e:
+            return self._rejected(upload, e)
+        return self._status(upload, 201)
+
+    def _upload_part(self, upload, number):
+        try:
+            offset, size = upload.part_range(number)
+            with self.store.lock(upload, shared=True):
+                self.store.write_part(upload, number, request.stream, self.chunk_size)
+                # the first part is where type validators find what they need
+                if offset == 0:
+                    check_partial(self.transfer, upload, self.store.open, 0, size)
+        except ValueError as e:
+            return self._error(400, str(e), part=number)
+        except UploadLocked:
+            return self._error(409, 'Upload is being completed', part=number)
+        except (IOError, OSError):
+            # completed or aborted while the part was on its way
+            if self.store.get(upload.id) is None:
+                return self._error(404, 'No such upload')
+            raise
+        except UploadError as e:
+            return self._rejected(upload, e)
+        return self._status(upload)
+
+    def _complete(self, upload):
+        try:
+            with self.store.lock(upload):
+                missing = self.store.missing(upload)
+                if missing:
+                    return self._error(409, 'Parts are missing', missing=missing)
+                filehandle = self.complete(upload)
+        except UploadLocked:
+            return self._error(409, 'Upload is busy, parts are being written or it is '
+                               'already being completed')
+        except UploadError as e:
+            return self._rejected(upload, e)
+        return jsonify({'upload_id': upload.id, 'filename': filehandle.filename})
+
+    def _abort(self, upload):
+        self.store.delete(upload)
+        return '', 204
+
+    def _upload(self, upload_id, number=None, action=None):
+        upload = self.store.get(upload_id)
+        if upload is None:
+            return self._error(404, 'No such upload')
+        if number is not None:
+            return self._upload_part(upload, number)
+        if action is not None:
+            return self._complete(upload)
+        if request.method == 'DELETE':
+            return self._abort(upload)
+        return self._status(upload)
+
+    def blueprint(self, name='multipart', import_name=__name__, **kwargs):
+        "Creates a blueprint serving the uploads, register it with the app."
+        bp = Blueprint(name, import_name, **kwargs)
+        bp.add_url_rule('/', 'initiate', self._initiate, methods=['POST'])
+        bp.add_url_rule('/<upload_id>', 'upload', self._upload, methods=['GET', 'DELETE'])
+        bp.add_url_rule('/<upload_id>/parts/<int:number>', 'part', self._upload,
+                        methods=['PUT'])
+        bp.add_url_rule('/<upload_id>/complete', 'complete', self._upload,
+                        methods=['POST'], defaults={'action': 'complete'})
+        return bp
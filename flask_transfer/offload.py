@@ -0,0 +1,219 @@
+"""
+    flask_transfer.offload
+    ~~~~~~~~~~~~~~~~~~~~~~
+    Runs CPU heavy preprocessors in a process pool, so they don't hold the
+    GIL in the request worker.
+"""
+from concurrent.futures import ProcessPoolExecutor
+import os
+import shutil
+import tempfile
+import threading
+
+from flask import current_app, has_app_context
+from werkzeug.datastructures import FileStorage
+
+from . import spooling
+from .destinations import copy_to_file
+from .exc import TransferBusy
+
+__all__ = ['CPUPool', 'CPUBound', 'cpu_pool']
+
+
+def _copy(stream, out):
+    if not copy_to_file(stream, out):
+        shutil.copyfileobj(stream, out, 1024 * 1024)
+
+
+def _run_preprocessor(fn, source, target, filename, content_type, metadata,
+                      spool_settings=None):
+    """Runs in the worker process: calls the preprocessor on a FileStorage
+    reading source and writes the stream it leaves behind to target. Returns
+    what the parent needs to put back on its FileStorage.
+    """
+    if spool_settings is not None:
+        spooling.configure(*spool_settings)
+    with open(source, 'rb') as stream:
+        filehandle = FileStorage(stream=stream, filename=filename,
+                                 content_type=content_type)
+        filehandle = fn(filehandle, metadata)
+        with open(target, 'wb') as out:
+            _copy(filehandle.stream, out)
+    return filehandle.filename, filehandle.content_type, metadata
+
+
+class CPUPool(object):
+    """Process pool for CPU bound preprocessors, with backpressure: at most
+    `max_workers + max_pending` preprocessors are running or waiting at once.
+    When it's full, submitting waits up to `timeout` seconds for room and
+    then raises TransferBusy, which Flask turns into a 503, rather than
+    letting requests pile up behind a saturated pool.
+
+    The pool's processes are started the first time they're needed.
+
+    :param max_workers: Number of processes, None for one per CPU.
+    :param max_pending: Preprocessors allowed to wait for a free process,
+        defaults to max_workers.
+    :param timeout: Seconds to wait for room in the pool, None to wait as
+        long as it takes.
+    """
+    def __init__(self, max_workers=None, max_pending=None, timeout=None):
+        if max_workers is None:
+            max_workers = getattr(os, 'cpu_count', lambda: None)() or 1
+        self.max_workers = max_workers
+        self.max_pending = self.max_workers if max_pending is None else max_pending
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(self.max_workers + self.max_pending)
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def __repr__(self):
+        return 'CPUPool(max_workers={0}, max_pending={1})'.format(
+            self.max_workers, self.max_pending)
+
+    @property
+    def in_flight(self):
+        "Number of preprocessors running or waiting in the pool."
+        return self._in_flight
+
+    def _release(self, future):
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    def submit(self, fn, *args):
+        "Submits fn to the pool, raising TransferBusy if the pool stays full."
+        if self.timeout is None:
+            acquired = self._slots.acquire()
+        else:
+            acquired = self._slots.acquire(True, self.timeout)
+        if not acquired:
+            raise TransferBusy(retry_after=self.timeout or 1)
+
+        try:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+                self._in_flight += 1
+            future = self._executor.submit(fn, *args)
+        except Exception:
+            self._release(None)
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+
+_default_pool = None
+_default_lock = threading.Lock()
+
+
+def cpu_pool():
+    """Returns the CPUPool for the current app, creating it from the app's
+    config the first time:
+
+        * ``TRANSFER_CPU_WORKERS``: number of processes.
+        * ``TRANSFER_CPU_MAX_PENDING``: preprocessors allowed to wait.
+        * ``TRANSFER_CPU_TIMEOUT``: seconds to wait for room before raising
+          TransferBusy.
+
+    Outside of an app context, a pool shared by the whole process is used.
+    """
+    global _default_pool
+    if has_app_context():
+        extensions = current_app.extensions
+        pool = extensions.get('flask_transfer.cpu_pool')
+        if pool is None:
+            config = current_app.config
+            with _default_lock:
+                pool = extensions.setdefault('flask_transfer.cpu_pool', CPUPool(
+                    config.get('TRANSFER_CPU_WORKERS'),
+                    config.get('TRANSFER_CPU_MAX_PENDING'),
+                    config.get('TRANSFER_CPU_TIMEOUT')))
+        return pool
+
+    with _default_lock:
+        if _default_pool is None:
+            _default_pool = CPUPool()
+    return _default_pool
+
+
+class CPUBound(object):
+    """Wraps a preprocessor so it runs in a CPUPool. The upload is spooled to
+    a temporary file that the worker reads, and the worker writes the stream
+    the preprocessor leaves behind to another, which becomes the
+    filehandle's stream. Nothing bigger than the metadata is pickled.
+
+    The preprocessor and metadata have to be picklable, so the preprocessor
+    must be a module level function. Changes it makes to the filehandle's
+    filename, content type and stream, and to the metadata, are copied back.
+
+    Usually created through `Transfer.preprocessor`:
+
+    .. code-block:: python
+
+        @PDFTransfer.preprocessor(cpu_bound=True)
+        def pdftojpg(filehandle, meta):
+            ...
+
+    :param fn: The preprocessor.
+    :param pool: CPUPool to use, the current app's if None.
+    :param tmpdir: Directory for the temporary files, the system's if None.
+    """
+    def __init__(self, fn, pool=None, tmpdir=None):
+        self.fn = fn
+        self.pool = pool
+        self.tmpdir = tmpdir
+        self.__name__ = getattr(fn, '__name__', self.__class__.__name__)
+
+    def __repr__(self):
+        return 'CPUBound({0!r})'.format(self.fn)
+
+    def _tempfile(self):
+        fd, path = tempfile.mkstemp(dir=self.tmpdir, prefix='flask-transfer-', suffix='.tmp')
+        return os.fdopen(fd, 'wb'), path
+
+    def __call__(self, filehandle, metadata):
+        pool = self.pool or cpu_pool()
+        out, source = self._tempfile()
+        target = None
+        try:
+            with out:
+                _copy(filehandle.stream, out)
+            placeholder, target = self._tempfile()
+            placeholder.close()
+
+            future = pool.submit(_run_preprocessor, self.fn, source, target,
+                                 filehandle.filename, filehandle.content_type,
+                                 dict(metadata), spooling.settings())
+            filename, content_type, changed = future.result()
+            stream = open(target, 'rb')
+        except BaseException:
+            if target is not None:
+                _remove(target)
+            raise
+        finally:
+            _remove(source)
+
+        # the open stream keeps the file around until it's closed
+        _remove(target)
+        filehandle.stream = stream
+        filehandle.filename = filename
+        if content_type and content_type != filehandle.content_type:
+            filehandle.headers['Content-Type'] = content_type
+        metadata.update(changed)
+        return filehandle
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        # windows won't remove open files
+        pass
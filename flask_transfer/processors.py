@@ -0,0 +1,125 @@
+"""
+    flask_transfer.processors
+    ~~~~~~~~~~~~~~~~~~~~~~~~~
+    Ready made pre and postprocessors.
+"""
+from collections import OrderedDict
+import errno
+import os
+import threading
+
+from werkzeug.utils import secure_filename
+
+__all__ = ['UniqueFilename']
+
+
+class UniqueFilename(object):
+    """Preprocessor that renames the filehandle until its name is unused in
+    the upload directory, e.g. `report.pdf`, `report_1.pdf`, `report_2.pdf`.
+    The name is passed through `secure_filename` first, so it can't point
+    outside the directory.
+
+    Rather than checking `os.path.exists` with an ever increasing counter,
+    names are claimed by atomically creating an empty placeholder file
+    (`O_CREAT | O_EXCL`), so two workers -- threads or processes -- can never
+    be handed the same name. The destination then overwrites the placeholder.
+    The next counter to try is cached for the `cache_size` most recently
+    used names, and on a cache miss it's found with a galloping search, so
+    finding a free name costs O(log N) filesystem calls at worst instead of
+    O(N).
+
+    .. code-block:: python
+
+        PDFTransfer = Transfer(destination=save_to_upload_dir,
+                               preprocessors=[UniqueFilename('static/pdf')])
+
+    If the save fails after the name is claimed, the empty placeholder is
+    left behind.
+
+    :param directory: Directory the filehandle will be saved to, or a
+        callable that's passed the filehandle and metadata and returns it.
+    :param template: Format string used to build the alternate names, it's
+        passed the `name`, `counter` and `ext` (which includes the dot).
+    :param cache_size: Names whose next counter is remembered, least
+        recently used ones are forgotten first.
+    """
+    def __init__(self, directory, template='{name}_{counter}{ext}', cache_size=1024):
+        self._directory = directory
+        self.template = template
+        self.cache_size = cache_size
+        self._next = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return 'UniqueFilename({0!r})'.format(self._directory)
+
+    def directory(self, filehandle, metadata):
+        if callable(self._directory):
+            return self._directory(filehandle, metadata)
+        return self._directory
+
+    def _candidate(self, filename, counter):
+        if not counter:
+            return filename
+        name, ext = os.path.splitext(filename)
+        return self.template.format(name=name, counter=counter, ext=ext)
+
+    def _claim(self, path):
+        "Atomically creates a placeholder at path, False if it already exists."
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except OSError as e:
+            if e.errno == errno.EEXIST:
+                return False
+            raise
+        os.close(fd)
+        return True
+
+    def _search(self, directory, filename):
+        """Finds a counter that's probably free, assuming the names in use are
+        mostly contiguous: gallop until a free name is found, then binary
+        search back to the first one.
+        """
+        def taken(counter):
+            return os.path.exists(os.path.join(directory, self._candidate(filename, counter)))
+
+        if not taken(0):
+            return 0
+
+        low, high = 0, 1
+        while taken(high):
+            low, high = high, high * 2
+
+        while high - low > 1:
+            middle = (low + high) // 2
+            if taken(middle):
+                low = middle
+            else:
+                high = middle
+        return high
+
+    def __call__(self, filehandle, metadata):
+        directory = self.directory(filehandle, metadata)
+        filename = secure_filename(filehandle.filename)
+        key = (directory, filename)
+
+        with self._lock:
+            counter = self._next.pop(key, None)
+            if counter is not None:
+                self._next[key] = counter
+        if counter is None:
+            counter = self._search(directory, filename)
+
+        while True:
+            candidate = self._candidate(filename, counter)
+            if self._claim(os.path.join(directory, candidate)):
+                break
+            counter += 1
+
+        with self._lock:
+            self._next[key] = max(self._next.pop(key, 0), counter + 1)
+            while len(self._next) > self.cache_size:
+                self._next.popitem(last=False)
+
+        filehandle.filename = candidate
+        return filehandle
@@ -0,0 +1,354 @@
+"""
+    flask_transfer.quota
+    ~~~~~~~~~~~~~~~~~~~~
+    Disk quotas backed by an incrementally updated usage index, rather than
+    scanning the upload directory on every upload.
+"""
+from functools import partial
+import json
+import os
+import sqlite3
+import threading
+import weakref
+
+from .exc import UploadError
+from .streaming import CountingStream, known_size
+from .validators import BaseValidator
+
+__all__ = ['UsageStore', 'MemoryUsageStore', 'SQLiteUsageStore',
+           'JSONUsageStore', 'QuotaValidator', 'Reconciler', 'directory_usage']
+
+
+def directory_usage(path):
+    "Walks a directory and totals the size of every file in it."
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                # removed out from under us
+                pass
+    return total
+
+
+class UsageStore(object):
+    """Base usage store for flask_transfer. Keeps a running total of bytes
+    used for each key (a user, a directory, whatever makes sense). Subclasses
+    need to implement `usage`, `add`, `reserve` and `set`; `add` and
+    `reserve` must be atomic.
+    """
+    def usage(self, key):
+        "Returns the bytes used by key, 0 if it's never been seen."
+        raise NotImplementedError("usage not implemented")
+
+    def add(self, key, amount):
+        "Adds amount (which may be negative) to key's usage and returns it."
+        raise NotImplementedError("add not implemented")
+
+    def reserve(self, key, amount, limit):
+        """Adds amount to key's usage if that keeps it within limit. Returns
+        whether it did.
+        """
+        raise NotImplementedError("reserve not implemented")
+
+    def set(self, key, amount):
+        "Overwrites key's usage, used when reconciling."
+        raise NotImplementedError("set not implemented")
+
+    def __repr__(self):
+        return self.__class__.__name__
+
+
+class MemoryUsageStore(UsageStore):
+    """Keeps usage in a dictionary. Usage is lost when the process exits and
+    isn't shared between processes, so pair it with a Reconciler.
+    """
+    def __init__(self):
+        self._usage = {}
+        self._lock = threading.Lock()
+
+    def usage(self, key):
+        return self._usage.get(key, 0)
+
+    def add(self, key, amount):
+        with self._lock:
+            total = self._usage[key] = self._usage.get(key, 0) + amount
+        return total
+
+    def reserve(self, key, amount, limit):
+        with self._lock:
+            total = self._usage.get(key, 0) + amount
+            if total > limit:
+                return False
+            self._usage[key] = total
+        return True
+
+    def set(self, key, amount):
+        with self._lock:
+            self._usage[key] = amount
+
+
+class SQLiteUsageStore(UsageStore):
+    """Keeps usage in a SQLite database, which makes it durable and shared
+    between every process pointed at the same file.
+
+    :param path: Path to the database, created if needed.
+    :param timeout: Seconds to wait on a locked database.
+    """
+    def __init__(self, path, timeout=5.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS usage '
+                         '(key TEXT PRIMARY KEY, bytes INTEGER NOT NULL)')
+
+    def _connection(self):
+        # sqlite connections can't be shared between threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=self.timeout)
+        return conn
+
+    def usage(self, key):
+        row = self._connection().execute(
+            'SELECT bytes FROM usage WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else 0
+
+    def add(self, key, amount):
+        with self._connection() as conn:
+            conn.execute('INSERT OR IGNORE INTO usage (key, bytes) VALUES (?, 0)', (key,))
+            conn.execute('UPDATE usage SET bytes = bytes + ? WHERE key = ?', (amount, key))
+            return conn.execute('SELECT bytes FROM usage WHERE key = ?', (key,)).fetchone()[0]
+
+    def reserve(self, key, amount, limit):
+        with self._connection() as conn:
+            conn.execute('INSERT OR IGNORE INTO usage (key, bytes) VALUES (?, 0)', (key,))
+            # checked and added in one statement, so it's atomic
+            cursor = conn.execute('UPDATE usage SET bytes = bytes + ? '
+                                  'WHERE key = ? AND bytes + ? <= ?',
+                                  (amount, key, amount, limit))
+            return cursor.rowcount == 1
+
+    def set(self, key, amount):
+        with self._connection() as conn:
+            conn.execute('INSERT OR REPLACE INTO usage (key, bytes) VALUES (?, ?)',
+                         (key, amount))
+
+    def __repr__(self):
+        return 'SQLiteUsageStore({0!r})'.format(self.path)
+
+
+class JSONUsageStore(MemoryUsageStore):
+    """Keeps usage in memory and mirrors it to a JSON file that sits beside the
+    uploads, so it survives restarts. The file is rewritten atomically on
+    every change. Suited to a single process, use SQLiteUsageStore when
+    several processes handle uploads.
+
+    :param path: Path to the JSON file, created if needed.
+    """
+    def __init__(self, path):
+        super(JSONUsageStore, self).__init__()
+        self.path = path
+        if os.path.exists(path):
+            with open(path) as fh:
+                self._usage = json.load(fh)
+
+    def _flush(self):
+        tmp = '{0}.{1}.tmp'.format(self.path, os.getpid())
+        with open(tmp, 'w') as fh:
+            json.dump(self._usage, fh)
+        os.rename(tmp, self.path)
+
+    def add(self, key, amount):
+        with self._lock:
+            total = self._usage[key] = self._usage.get(key, 0) + amount
+            self._flush()
+        return total
+
+    def reserve(self, key, amount, limit):
+        with self._lock:
+            total = self._usage.get(key, 0) + amount
+            if total > limit:
+                return False
+            self._usage[key] = total
+            self._flush()
+        return True
+
+    def set(self, key, amount):
+        with self._lock:
+            self._usage[key] = amount
+            self._flush()
+
+    def __repr__(self):
+        return 'JSONUsageStore({0!r})'.format(self.path)
+
+
+class QuotaValidator(BaseValidator):
+    """Rejects uploads that would push a key's usage over its limit. Checking
+    is a single lookup in the usage store rather than a walk of the upload
+    directory.
+
+    The size of the upload is found the same way as `MaxSize`: stat'ed when
+    the upload is a real file, trusted from the client when it's declared
+    too large, and otherwise enforced while the destination reads it.
+
+    Usage isn't updated by validating, since the upload may still fail later
+    on. Register `record` as a postprocessor to count successful saves, and
+    call `release` when files are deleted. Two uploads saved at once may
+    both pass validation, but `record` checks and adds atomically, so the
+    one that would go over the quota is rejected there -- and rolled back,
+    with a destination that returns a pending write such as
+    `AtomicFileDestination`:
+
+    .. code-block:: python
+
+        store = SQLiteUsageStore('usage.db')
+        quota = QuotaValidator(store, limit=20 * 1024,
+                               key=lambda fh, meta: meta['username'])
+        UserUpload = Transfer(validators=[quota], postprocessors=[quota.record])
+
+    :param store: UsageStore to check and update.
+    :param limit: Maximum bytes per key, or a callable that's passed the key
+        and returns its limit.
+    :param key: Key to account usage against, or a callable that's passed the
+        filehandle and metadata and returns the key.
+    """
+    def __init__(self, store, limit, key='default'):
+        self.store = store
+        self._limit = limit
+        self._key = key
+        # the streams counting uploads whose size wasn't known up front
+        self._counters = weakref.WeakKeyDictionary()
+
+    def __repr__(self):
+        return 'QuotaValidator({0!r})'.format(self.store)
+
+    def key(self, filehandle, metadata):
+        if callable(self._key):
+            return self._key(filehandle, metadata)
+        return self._key
+
+    def limit(self, key):
+        if callable(self._limit):
+            return self._limit(key)
+        return self._limit
+
+    def _fail(self, filehandle):
+        msg = '{0} exceeds the upload allotment.'
+        raise UploadError(partial(msg.format, filehandle.filename),
+                          reason='quota_exceeded', validator=self,
+                          filename=filehandle.filename)
+
+    def _validate(self, filehandle, metadata):
+        key = self.key(filehandle, metadata)
+        remaining = self.limit(key) - self.store.usage(key)
+
+        size = known_size(filehandle)
+        if size is None:
+            size = getattr(filehandle, 'content_length', None) or None
+            if size is not None and size <= remaining:
+                # the client may have lied, keep counting
+                size = None
+
+        if size is not None:
+            if size > remaining:
+                self._fail(filehandle)
+            return True
+
+        def check(count, finished):
+            if count > remaining:
+                self._fail(filehandle)
+
+        counter = CountingStream(filehandle.stream, check, limit=max(remaining, 0))
+        filehandle.stream = self._counters[filehandle] = counter
+        return True
+
+    def _saved_size(self, filehandle):
+        """The size of the saved upload: the position of the stream once the
+        destination is done with it, which accounts for preprocessors
+        replacing the stream, or else the bytes counted while it was read.
+        The size the client declared is never trusted.
+        """
+        try:
+            return filehandle.stream.tell()
+        except (AttributeError, IOError, OSError, ValueError):
+            pass
+        stream = filehandle.stream
+        while stream is not None:
+            if isinstance(stream, CountingStream):
+                return stream.count
+            stream = getattr(stream, 'source', None)
+        counter = self._counters.get(filehandle)
+        return counter.count if counter is not None else 0
+
+    def record(self, filehandle, metadata):
+        """Postprocessor that adds the saved upload to its key's usage. It's
+        checked against the limit again as it's added, atomically, and
+        rejected with an UploadError if another save got there first.
+        """
+        key = self.key(filehandle, metadata)
+        if not self.store.reserve(key, self._saved_size(filehandle), self.limit(key)):
+            self._fail(filehandle)
+        return filehandle
+
+    def release(self, key, size):
+        "Removes size bytes from key's usage, e.g. after deleting a file."
+        return self.store.add(key, -size)
+
+    def delete(self, key, path):
+        "Deletes the file at path and releases its size from key's usage."
+        size = os.path.getsize(path)
+        os.remove(path)
+        return self.release(key, size)
+
+
+class Reconciler(object):
+    """Corrects drift between a usage store and what's actually on disk --
+    files changed by something other than Flask-Transfer, a crash between
+    saving and recording, etc. -- by periodically walking directories and
+    overwriting the stored usage.
+
+    .. code-block:: python
+
+        reconciler = Reconciler(store, lambda: {'default': app.config['UPLOAD_PATH']},
+                                interval=600)
+        reconciler.start()
+
+    :param store: UsageStore to correct.
+    :param paths: Mapping of key to directory, or a callable returning one.
+    :param interval: Seconds between scans when run in the background.
+    """
+    def __init__(self, store, paths, interval=300):
+        self.store = store
+        self.interval = interval
+        self._paths = paths
+        self._stop = threading.Event()
+        self._thread = None
+
+    def reconcile(self):
+        "Scans every directory once, returning the usage found for each key."
+        paths = self._paths() if callable(self._paths) else self._paths
+        found = {}
+        for key, path in paths.items():
+            found[key] = directory_usage(path)
+            self.store.set(key, found[key])
+        return found
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.reconcile()
+
+    def start(self):
+        "Starts scanning in a background daemon thread."
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='flask-transfer-reconciler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,312 @@
+"""
+    flask_transfer.ratelimit
+    ~~~~~~~~~~~~~~~~~~~~~~~~
+    Per client rate limits on uploads, counted in a sliding window that
+    costs a handful of numbers per client to keep.
+"""
+from collections import namedtuple
+from functools import partial
+import sqlite3
+import threading
+import time
+
+from flask import has_request_context, request
+
+from .exc import UploadError
+from .streaming import CountingStream, known_size
+from .validators import BaseValidator
+
+__all__ = ['RateLimitResult', 'RateLimitStore', 'MemoryRateLimitStore',
+           'SQLiteRateLimitStore', 'RateLimited', 'RateLimit']
+
+
+class RateLimitResult(namedtuple('RateLimitResult', ['allowed', 'count', 'nbytes',
+                                                     'retry_after'])):
+    """The outcome of a hit: whether it was allowed, the uploads and bytes
+    counted in the window -- including the hit, if it was allowed -- and, if
+    it wasn't, the seconds until it would be.
+    """
+    __slots__ = ()
+
+
+def _roll(state, window, now):
+    """Moves a key's (start, previous count, previous bytes, count, bytes)
+    forward to the window that now falls in.
+    """
+    start = now - now % window
+    if state is None or state[0] < start - window:
+        return (start, 0, 0, 0, 0)
+    if state[0] < start:
+        return (start, state[3], state[4], 0, 0)
+    return state
+
+
+def _wait(previous, current, amount, limit, elapsed, window):
+    """Seconds until amount more fits under limit. Within this window, that's
+    when the previous window's shrinking share leaves room, at the latest
+    when its weight reaches zero at the window's end. Otherwise it's in the
+    next window, once what's counted now -- by then the previous window --
+    has shrunk enough, at the latest when that weight reaches zero too.
+    """
+    remaining = window - elapsed
+    room = limit - current - amount
+    if room >= 0:
+        if not previous:
+            return 0.0
+        return min(max(window * (1 - float(room) / previous) - elapsed, 0.0), remaining)
+    room = max(limit - amount, 0)
+    if not current:
+        return remaining
+    return remaining + min(window * (1 - float(room) / current), window)
+
+
+def _apply(state, window, count, nbytes, max_count, max_bytes, now):
+    """Adds count and nbytes to the key's state if the sliding window
+    estimate -- the current window plus the part of the previous one the
+    sliding window still overlaps -- stays within max_count and max_bytes.
+    Returns the new state and a RateLimitResult.
+    """
+    start, prev_count, prev_bytes, cur_count, cur_bytes = _roll(state, window, now)
+    elapsed = now - start
+    weight = 1 - float(elapsed) / window
+    est_count = prev_count * weight + cur_count
+    est_bytes = prev_bytes * weight + cur_bytes
+
+    waits = []
+    if max_count is not None and est_count + count > max_count:
+        waits.append(_wait(prev_count, cur_count, count, max_count, elapsed, window))
+    if max_bytes is not None and est_bytes + nbytes > max_bytes:
+        waits.append(_wait(prev_bytes, cur_bytes, nbytes, max_bytes, elapsed, window))
+    if waits:
+        state = (start, prev_count, prev_bytes, cur_count, cur_bytes)
+        return state, RateLimitResult(False, est_count, est_bytes, max(waits))
+
+    state = (start, prev_count, prev_bytes, cur_count + count, cur_bytes + nbytes)
+    return state, RateLimitResult(True, est_count + count, est_bytes + nbytes, 0.0)
+
+
+class RateLimitStore(object):
+    """Base rate limit store for flask_transfer. Keeps a sliding window
+    counter of uploads and bytes for each key: the totals for the current
+    and the previous fixed window, with the previous one weighted by how
+    much of it the sliding window still covers. Subclasses need to
+    implement `hit`, which must be atomic.
+    """
+    def hit(self, key, window, count=1, nbytes=0, max_count=None, max_bytes=None, now=None):
+        """Counts count uploads and nbytes bytes against key, in windows of
+        window seconds, unless that would take it past max_count or
+        max_bytes. Returns a RateLimitResult.
+        """
+        raise NotImplementedError("hit not implemented")
+
+    def __repr__(self):
+        return self.__class__.__name__
+
+
+class MemoryRateLimitStore(RateLimitStore):
+    """Keeps the counters in a dictionary, swept of keys that have gone
+    quiet for two windows. The counts aren't shared between processes, so
+    each worker enforces the limit on its own.
+    """
+    def __init__(self):
+        self._windows = {}
+        self._next_sweep = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._windows)
+
+    def _sweep(self, now):
+        for key, state in list(self._windows.items()):
+            if state[0] + 2 * state[5] <= now:
+                del self._windows[key]
+
+    def hit(self, key, window, count=1, nbytes=0, max_count=None, max_bytes=None, now=None):
+        if now is None:
+            now = time.time()
+        with self._lock:
+            if now >= self._next_sweep:
+                self._sweep(now)
+                self._next_sweep = now + window
+            state = self._windows.get(key)
+            state, result = _apply(state and state[:5], window, count, nbytes,
+                                   max_count, max_bytes, now)
+            self._windows[key] = state + (window,)
+        return result
+
+
+class SQLiteRateLimitStore(RateLimitStore):
+    """Keeps the counters in a SQLite database, so every process pointed at
+    the same file -- say, all of gunicorn's workers -- enforces one limit
+    between them. Each hit is a single short write transaction.
+
+    :param path: Path to the database, created if needed.
+    :param timeout: Seconds to wait on a locked database.
+    """
+    def __init__(self, path, timeout=5.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._next_sweep = 0
+        conn = self._connection()
+        # readers don't block the writer, or each other
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('CREATE TABLE IF NOT EXISTS rate_limits '
+                     '(key TEXT PRIMARY KEY, start REAL NOT NULL, '
+                     'prev_count INTEGER NOT NULL, prev_bytes INTEGER NOT NULL, '
+                     'count INTEGER NOT NULL, bytes INTEGER NOT NULL, '
+                     'expires REAL NOT NULL)')
+
+    def _connection(self):
+        # sqlite connections can't be shared between threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=self.timeout,
+                                                      isolation_level=None)
+        return conn
+
+    def hit(self, key, window, count=1, nbytes=0, max_count=None, max_bytes=None, now=None):
+        if now is None:
+            now = time.time()
+        conn = self._connection()
+        # take the write lock up front so the read and the update are atomic
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if now >= self._next_sweep:
+                conn.execute('DELETE FROM rate_limits WHERE expires <= ?', (now,))
+                self._next_sweep = now + window
+            state = conn.execute('SELECT start, prev_count, prev_bytes, count, bytes '
+                                 'FROM rate_limits WHERE key = ?', (key,)).fetchone()
+            state, result = _apply(state, window, count, nbytes, max_count, max_bytes, now)
+            if result.allowed:
+                conn.execute('INSERT OR REPLACE INTO rate_limits VALUES (?, ?, ?, ?, ?, ?, ?)',
+                             (key,) + state + (state[0] + 2 * window,))
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+        return result
+
+    def __repr__(self):
+        return 'SQLiteRateLimitStore({0!r})'.format(self.path)
+
+
+class RateLimited(UploadError):
+    """Raised by RateLimit when a client has uploaded too much, too often.
+    `retry_after` is the number of seconds until it's allowed again.
+    """
+    def __init__(self, message=None, retry_after=None, **kwargs):
+        kwargs.setdefault('reason', 'rate_limited')
+        super(RateLimited, self).__init__(message, **kwargs)
+        self.retry_after = retry_after
+
+    def to_dict(self):
+        error = super(RateLimited, self).to_dict()
+        error['retry_after'] = self.retry_after
+        return error
+
+
+def _remote_addr():
+    if has_request_context():
+        return request.remote_addr or 'unknown'
+    return 'unknown'
+
+
+_KEYS = {
+    'ip': lambda filehandle, metadata: _remote_addr(),
+    'user': lambda filehandle, metadata: metadata.get('user') or _remote_addr(),
+}
+
+
+class RateLimit(BaseValidator):
+    """Rejects uploads from clients that have sent more than `count` uploads,
+    or more than `nbytes` bytes, in the last `window` seconds. Checking is a
+    single hit on the store, which is counted if it's allowed, so it's cheap
+    enough to go first in any Transfer's validators and turn abusive clients
+    away before anything else is done with their uploads.
+
+    .. code-block:: python
+
+        per_minute = RateLimit(count=30, nbytes=100 * 1024 * 1024, window=60,
+                               store=SQLiteRateLimitStore('/run/app/limits.db'))
+        ImageTransfer = Transfer(validators=[per_minute, AllowedExts('png', 'jpg')])
+
+    Clients are told apart by `key`: ``'ip'`` for the request's remote
+    address (put the app behind ``ProxyFix`` if it's proxied), ``'user'``
+    for the metadata's `user`, falling back to the address, or a callable
+    that's passed the filehandle and metadata and returns the key.
+
+    The upload's size is counted when the validator runs, stat'ed if it's a
+    real file and taken from the client's declared size otherwise. An upload
+    whose size isn't known is counted as it's read instead, and cut off with
+    RateLimited once it goes past what's left of the limit.
+
+    Rejected uploads raise RateLimited, an UploadError with a `retry_after`
+    to pass along in a 429's Retry-After header. They aren't counted.
+
+    :param count: Uploads allowed per window, None for no limit.
+    :param nbytes: Bytes allowed per window, None for no limit.
+    :param window: Length of the window in seconds.
+    :param key: ``'ip'``, ``'user'`` or a callable returning the client's key.
+    :param store: RateLimitStore to count in. Defaults to a
+        MemoryRateLimitStore, use SQLiteRateLimitStore to share the limit
+        between processes.
+    :param name: Prefixed to keys, so limits that share a store don't share
+        their counts.
+    :param clock: Callable returning the current time in seconds.
+    """
+    def __init__(self, count=None, nbytes=None, window=60, key='ip', store=None,
+                 name='uploads', clock=time.time):
+        self.count = count
+        self.nbytes = nbytes
+        self.window = window
+        self.store = store if store is not None else MemoryRateLimitStore()
+        self.name = name
+        self.clock = clock
+        self._key = _KEYS.get(key, key)
+
+    def __repr__(self):
+        return 'RateLimit(count={0!r}, nbytes={1!r}, window={2!r})'.format(
+            self.count, self.nbytes, self.window)
+
+    def key(self, filehandle, metadata):
+        return '{0}:{1}'.format(self.name, self._key(filehandle, metadata))
+
+    def _fail(self, filehandle, retry_after):
+        msg = '{0} rejected, too many uploads. Try again in {1:.0f} seconds.'
+        raise RateLimited(partial(msg.format, filehandle.filename, retry_after),
+                          retry_after=retry_after, validator=self,
+                          filename=filehandle.filename)
+
+    def _validate(self, filehandle, metadata):
+        key = self.key(filehandle, metadata)
+        size = known_size(filehandle)
+        trusted = size is not None
+        if not trusted:
+            size = getattr(filehandle, 'content_length', None) or 0
+
+        result = self.store.hit(key, self.window, 1, size, self.count, self.nbytes,
+                                self.clock())
+        if not result.allowed:
+            self._fail(filehandle, result.retry_after)
+        if trusted or self.nbytes is None:
+            return True
+
+        # only the declared size has been counted, count the rest as it's read
+        state = {'counted': size, 'allowance': size + max(int(self.nbytes - result.nbytes), 0)}
+
+        def check(count, finished):
+            extra = count - state['counted']
+            if count > state['allowance']:
+                result = self.store.hit(key, self.window, 0, extra, None, self.nbytes,
+                                        self.clock())
+                if not result.allowed:
+                    self._fail(filehandle, result.retry_after)
+                state['counted'] = count
+                state['allowance'] = count + max(int(self.nbytes - result.nbytes), 0)
+            elif finished and extra > 0:
+                self.store.hit(key, self.window, 0, extra, now=self.clock())
+                state['counted'] = count
+
+        filehandle.stream = CountingStream(filehandle.stream, check)
+        return True
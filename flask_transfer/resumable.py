@@ -0,0 +1,473 @@
+"""
+    flask_transfer.resumable
+    ~~~~~~~~~~~~~~~~~~~~~~~~
+    Resumable uploads, following the core of the tus protocol: the client
+    creates an upload, PATCHes it a chunk at a time and can ask how much
+    arrived after a disconnect. Once every byte is in, the upload is saved
+    with a Transfer like any other.
+"""
+from base64 import b64decode
+from contextlib import contextmanager
+from functools import partial
+from io import BytesIO
+import binascii
+import json
+import os
+import re
+import shutil
+import time
+import uuid
+
+from flask import Blueprint, jsonify, request, url_for, make_response
+from werkzeug.datastructures import FileStorage
+
+from .exc import UploadError
+from .streaming import DEFAULT_CHUNK_SIZE
+
+try:
+    import fcntl
+except ImportError:  # windows
+    fcntl = None
+
+__all__ = ['PartialUpload', 'PartialUploadStore', 'ResumableUploads', 'UploadLocked',
+           'TUS_VERSION']
+
+
+TUS_VERSION = '1.0.0'
+
+_ID = re.compile(r'^[0-9a-f]{32}$')
+
+_STATUS_FOR_REASON = {'too_large': 413, 'quota_exceeded': 413, 'invalid_type': 415}
+
+
+class UploadLocked(Exception):
+    "Raised when another request is already writing to a partial upload."
+
+
+class PartialUpload(object):
+    """State of an upload that's still arriving. `offset` is how many bytes
+    have been safely stored, `length` how many the client said it would send.
+    `metadata` is what the client sent along with it, untrusted.
+    """
+    __slots__ = ('id', 'length', 'offset', 'filename', 'content_type', 'metadata',
+                 'created', 'complete')
+
+    def __init__(self, id, length, offset=0, filename=None, content_type=None,
+                 metadata=None, created=None, complete=False):
+        self.id = id
+        self.length = length
+        self.offset = offset
+        self.filename = filename
+        self.content_type = content_type
+        self.metadata = metadata or {}
+        self.created = time.time() if created is None else created
+        self.complete = complete
+
+    def __repr__(self):
+        return 'PartialUpload({0!r}, offset={1}, length={2})'.format(
+            self.id, self.offset, self.length)
+
+    def to_dict(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+
+class PartialUploadStore(object):
+    """Keeps partial uploads in a directory, each as a data file that chunks
+    are appended to and a small JSON file holding its state. The offset is
+    only recorded once the chunk it covers is synced to disk, so after a
+    crash or restart the client resumes from bytes that are really there;
+    anything written past the recorded offset is truncated on the next
+    append.
+
+    :param directory: Where partial uploads are kept, created if needed.
+    :param fsync: Toggle syncing chunks before recording the new offset.
+    """
+    def __init__(self, directory, fsync=True):
+        self.directory = directory
+        self.fsync = fsync
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def __repr__(self):
+        return 'PartialUploadStore({0!r})'.format(self.directory)
+
+    def _path(self, upload_id, ext):
+        return os.path.join(self.directory, upload_id + ext)
+
+    def data_path(self, upload):
+        return self._path(upload.id, '.part')
+
+    def create(self, length, filename=None, content_type=None, metadata=None):
+        "Starts a new, empty partial upload of length bytes."
+        upload = PartialUpload(uuid.uuid4().hex, length, filename=filename,
+                               content_type=content_type, metadata=metadata)
+        open(self.data_path(upload), 'wb').close()
+        self.save(upload)
+        return upload
+
+    def get(self, upload_id):
+        "Returns the PartialUpload for upload_id, None if there isn't one."
+        if not _ID.match(upload_id or ''):
+            return None
+        try:
+            with open(self._path(upload_id, '.json')) as fh:
+                return PartialUpload(**json.load(fh))
+        except (IOError, OSError, ValueError):
+            return None
+
+    def save(self, upload):
+        "Atomically records the upload's state."
+        path = self._path(upload.id, '.json')
+        tmp = '{0}.{1}.tmp'.format(path, os.getpid())
+        with open(tmp, 'w') as fh:
+            json.dump(upload.to_dict(), fh)
+            if self.fsync:
+                fh.flush()
+                os.fsync(fh.fileno())
+        os.rename(tmp, path)
+
+    @contextmanager
+    def lock(self, upload):
+        """Holds an exclusive lock on the upload, raising UploadLocked if
+        someone else has it. The lock goes away with the process holding it.
+        """
+        with _exclusive(self._path(upload.id, '.lock'), upload.id):
+            yield upload
+
+    def append(self, upload, stream, chunk_size=DEFAULT_CHUNK_SIZE, check=None):
+        """Appends stream to the upload, stopping at its declared length, and
+        records the new offset. check, if given, is called with the upload and
+        the offset after every chunk, and may raise to stop the append.
+        Returns the number of bytes appended.
+        """
+        written = 0
+        with open(self.data_path(upload), 'r+b') as fh:
+            # throw away anything written after the last recorded offset
+            fh.truncate(upload.offset)
+            fh.seek(upload.offset)
+            try:
+                while upload.offset + written < upload.length:
+                    chunk = stream.read(min(chunk_size, upload.length - upload.offset - written))
+                    if not chunk:
+                        break
+                    fh.write(chunk)
+                    written += len(chunk)
+                    if check is not None:
+                        fh.flush()
+                        check(upload, upload.offset + written)
+            finally:
+                fh.flush()
+                if self.fsync:
+                    os.fsync(fh.fileno())
+                upload.offset += written
+                self.save(upload)
+        return written
+
+    def open(self, upload):
+        "Opens the upload's data for reading."
+        return open(self.data_path(upload), 'rb')
+
+    def finish(self, upload):
+        """Marks the upload as complete and removes its data, which by now has
+        been saved (or linked) somewhere else.
+        """
+        upload.complete = True
+        self.save(upload)
+        _remove(self.data_path(upload))
+
+    def delete(self, upload):
+        for ext in ('.part', '.json', '.lock'):
+            _remove(self._path(upload.id, ext))
+
+    def purge(self, max_age):
+        """Deletes uploads created more than max_age seconds ago, whether the
+        client gave up on them or they're complete. Returns how many.
+        """
+        cutoff = time.time() - max_age
+        purged = 0
+        for name in os.listdir(self.directory):
+            upload_id, ext = os.path.splitext(name)
+            if ext != '.json':
+                continue
+            upload = self.get(upload_id)
+            if upload is not None and upload.created < cutoff:
+                self.delete(upload)
+                purged += 1
+        return purged
+
+
+def _unshare(path):
+    """Gives the file at path an inode of its own if it's hard linked
+    elsewhere -- into a destination by a save that then failed, say -- so
+    writing to it can't change the other file.
+    """
+    if os.stat(path).st_nlink < 2:
+        return
+    tmp = '{0}.{1}.tmp'.format(path, os.getpid())
+    shutil.copyfile(path, tmp)
+    os.rename(tmp, path)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+@contextmanager
+def _exclusive(path, upload_id, shared=False):
+    """Holds an exclusive lock on the file at path, or raises UploadLocked.
+    A shared lock only excludes exclusive ones.
+    """
+    with open(path, 'a') as fh:
+        if fcntl is not None:
+            try:
+                mode = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+                fcntl.flock(fh.fileno(), mode | fcntl.LOCK_NB)
+            except (IOError, OSError):
+                raise UploadLocked(upload_id)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
+
+
+def _parse_metadata(header):
+    "Parses tus' Upload-Metadata header: comma separated `key base64value` pairs."
+    metadata = {}
+    for pair in filter(None, (p.strip() for p in (header or '').split(','))):
+        key, _, value = pair.partition(' ')
+        try:
+            metadata[key] = b64decode(value).decode('utf-8') if value else ''
+        except (binascii.Error, TypeError, UnicodeDecodeError):
+            raise ValueError('Invalid Upload-Metadata')
+    return metadata
+
+
+def _incremental_validators(transfer):
+    return [(v, v.incremental_bytes) for v in transfer._validators
+            if getattr(v, 'incremental_bytes', None) is not None]
+
+
+def _filehandle(upload, stream):
+    return FileStorage(stream=stream, filename=upload.filename,
+                       content_type=upload.content_type, content_length=upload.length)
+
+
+def check_partial(transfer, upload, opener, previous, offset):
+    """Runs the transfer's incremental validators that can first judge the
+    upload now that its leading offset bytes have arrived, having already
+    run for previous bytes. opener is called with the upload to read them.
+    """
+    due = [(validator, needed) for validator, needed in _incremental_validators(transfer)
+           if previous < min(needed, upload.length) <= offset]
+    if not due:
+        return
+    # validators only see the bytes they asked for, and the declared
+    # length, rather than a file that's still growing
+    with opener(upload) as stream:
+        header = stream.read(min(max(needed for _, needed in due), offset))
+    for validator, _ in due:
+        if not validator(_filehandle(upload, BytesIO(header)), upload.metadata):
+            raise UploadError(partial('{0!r} rejected {1}'.format, validator, upload.filename),
+                              reason='returned_false', validator=validator,
+                              filename=upload.filename)
+
+
+class ResumableUploads(object):
+    """Resumable uploads for a Transfer, served by a blueprint that speaks
+    the core tus protocol (plus its creation and termination extensions):
+
+        * ``POST /`` with an ``Upload-Length`` header creates an upload and
+          answers with its URL in ``Location``. ``Upload-Metadata`` may
+          carry a `filename` and `filetype`.
+        * ``HEAD /<id>`` answers with the ``Upload-Offset`` to resume from.
+        * ``PATCH /<id>`` with a matching ``Upload-Offset`` appends the
+          request body.
+        * ``DELETE /<id>`` throws the upload away.
+
+    Validators that can judge a partial upload -- extension, type and size
+    validators, see `BaseValidator.incremental_bytes` -- are run as soon as
+    enough of the upload has arrived to do so, so a bad upload is turned
+    away after its first chunk instead of after its last. Once every byte is
+    in, the Transfer saves the assembled file as usual: every validator and
+    processor runs on it, and path destinations link it into place rather
+    than copying it.
+
+    .. code-block:: python
+
+        uploads = ResumableUploads(ImageTransfer, PartialUploadStore('partial'),
+                                   destination=save_image, max_size=2 ** 30)
+        app.register_blueprint(uploads.blueprint(), url_prefix='/uploads')
+
+    Metadata for the save holds the client's metadata as `upload_metadata`
+    and the upload's id as `upload_id`.
+
+    :param transfer: Transfer that validates, processes and saves uploads.
+    :param store: PartialUploadStore holding uploads as they arrive.
+    :param destination: Destination to save to, the Transfer's if None.
+    :param max_size: Largest upload that may be created, in bytes.
+    :param chunk_size: Size of the chunks read from each request.
+    :param metadata: Optional callable that's passed the PartialUpload and
+        returns more metadata for the save, e.g. the current user.
+    """
+    def __init__(self, transfer, store, destination=None, max_size=None,
+                 chunk_size=DEFAULT_CHUNK_SIZE, metadata=None):
+        self.transfer = transfer
+        self.store = store
+        self.destination = destination
+        self.max_size = max_size
+        self.chunk_size = chunk_size
+        self.metadata = metadata
+
+    def __repr__(self):
+        return 'ResumableUploads({0!r}, {1!r})'.format(self.transfer, self.store)
+
+    def check(self, upload, offset, previous=-1):
+        """Runs the incremental validators that can first judge the upload
+        now that offset bytes have arrived (having run for previous bytes).
+        """
+        check_partial(self.transfer, upload, self.store.open, previous, offset)
+
+    def complete(self, upload):
+        """Saves the assembled upload with the Transfer and returns the
+        filehandle. If the save fails with anything but an UploadError, the
+        upload is left a byte short, so the client resumes and resends it
+        and the save is tried again rather than the upload looking finished.
+        """
+        metadata = {'upload_id': upload.id, 'upload_metadata': dict(upload.metadata),
+                    'hardlink': True}
+        try:
+            if self.metadata is not None:
+                metadata.update(self.metadata(upload))
+            with self.store.open(upload) as stream:
+                filehandle = self.transfer.save(_filehandle(upload, stream),
+                                                destination=self.destination,
+                                                metadata=metadata)
+        except UploadError:
+            raise
+        except Exception:
+            if upload.length:
+                # the failed save may have linked the data into place, and
+                # resuming truncates and rewrites it
+                _unshare(self.store.data_path(upload))
+                upload.offset = upload.length - 1
+                self.store.save(upload)
+            raise
+        self.store.finish(upload)
+        return filehandle
+
+    def _response(self, status, **headers):
+        response = make_response('', status)
+        response.headers['Tus-Resumable'] = TUS_VERSION
+        for name, value in headers.items():
+            response.headers[name.replace('_', '-')] = str(value)
+        return response
+
+    def _rejected(self, upload, error):
+        self.store.delete(upload)
+        response = jsonify(error.to_dict())
+        response.status_code = _STATUS_FOR_REASON.get(error.reason, 400)
+        response.headers['Tus-Resumable'] = TUS_VERSION
+        return response
+
+    def _options(self):
+        headers = {'Tus-Version': TUS_VERSION, 'Tus-Extension': 'creation,termination'}
+        if self.max_size is not None:
+            headers['Tus-Max-Size'] = self.max_size
+        return self._response(204, **headers)
+
+    def _create(self):
+        try:
+            length = int(request.headers['Upload-Length'])
+            metadata = _parse_metadata(request.headers.get('Upload-Metadata'))
+        except (KeyError, ValueError):
+            return self._response(400)
+        if length < 0:
+            return self._response(400)
+        if self.max_size is not None and length > self.max_size:
+            return self._response(413)
+
+        upload = self.store.create(length, filename=metadata.get('filename'),
+                                   content_type=metadata.get('filetype'),
+                                   metadata=metadata)
+        try:
+            self.check(upload, 0)
+            if length == 0:
+                self.complete(upload)
+        except UploadError as e:
+            return self._rejected(upload, e)
+        return self._response(201, Location=url_for('.upload', upload_id=upload.id,
+                                                    _external=True),
+                              Upload_Offset=upload.offset)
+
+    def _head(self, upload):
+        return self._response(200, Upload_Offset=upload.offset,
+                              Upload_Length=upload.length, Cache_Control='no-store')
+
+    def _patch(self, upload):
+        if request.mimetype != 'application/offset+octet-stream':
+            return self._response(415)
+        try:
+            offset = int(request.headers['Upload-Offset'])
+        except (KeyError, ValueError):
+            return self._response(400)
+
+        try:
+            with self.store.lock(upload):
+                # re-read, another request may have moved it along
+                current = self.store.get(upload.id)
+                if current is None:
+                    # deleted or purged while we waited for the lock
+                    return self._response(404)
+                upload = current
+                if upload.complete or offset != upload.offset:
+                    return self._response(409, Upload_Offset=upload.offset)
+                previous = [upload.offset]
+
+                def check(upload, offset):
+                    self.check(upload, offset, previous[0])
+                    previous[0] = offset
+
+                self.store.append(upload, request.stream, self.chunk_size, check)
+                if upload.offset == upload.length:
+                    self.complete(upload)
+        except UploadLocked:
+            return self._response(423)
+        except UploadError as e:
+            return self._rejected(upload, e)
+        return self._response(204, Upload_Offset=upload.offset)
+
+    def _delete(self, upload):
+        try:
+            with self.store.lock(upload):
+                self.store.delete(upload)
+        except UploadLocked:
+            return self._response(423)
+        return self._response(204)
+
+    def _uploads(self):
+        if request.method == 'OPTIONS':
+            return self._options()
+        return self._create()
+
+    def _upload(self, upload_id):
+        upload = self.store.get(upload_id)
+        if upload is None:
+            return self._response(404)
+        if request.method == 'HEAD':
+            return self._head(upload)
+        if request.method == 'PATCH':
+            return self._patch(upload)
+        return self._delete(upload)
+
+    def blueprint(self, name='resumable', import_name=__name__, **kwargs):
+        "Creates a blueprint serving the uploads, register it with the app."
+        bp = Blueprint(name, import_name, **kwargs)
+        bp.add_url_rule('/', 'create', self._uploads, methods=['POST', 'OPTIONS'],
+                        provide_automatic_options=False)
+        bp.add_url_rule('/<upload_id>', 'upload', self._upload,
+                        methods=['HEAD', 'PATCH', 'DELETE'])
+        return bp
@@ -0,0 +1,203 @@
+"""
+    flask_transfer.scheduling
+    ~~~~~~~~~~~~~~~~~~~~~~~~~
+    Cost aware, concurrent validator execution.
+"""
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import threading
+import time
+
+from .exc import UploadError
+from .metrics import _observe
+from .transfer import _falsey_validator_error, _in_context
+
+__all__ = ['ValidatorScheduler', 'ValidatorStats', 'independent']
+
+
+_timer = getattr(time, 'perf_counter', time.time)
+
+
+def independent(fn):
+    """Marks a validator as safe to run at the same time as other validators.
+    Only do this for validators that don't touch the filehandle's stream (or
+    anything else shared), as the stream's position can't be shared between
+    threads.
+
+    .. code-block:: python
+
+        @independent
+        def short_filename(filehandle, metadata):
+            return len(filehandle.filename) < 64
+    """
+    fn.independent = True
+    return fn
+
+
+class ValidatorStats(object):
+    """Running cost and rejection rate of a single validator. Cost is an
+    exponentially weighted moving average of the wall time of each call.
+    """
+    __slots__ = ('calls', 'failures', 'cost')
+
+    def __init__(self):
+        self.calls = 0
+        self.failures = 0
+        self.cost = 0.0
+
+    def record(self, elapsed, failed, decay):
+        if self.calls:
+            self.cost += decay * (elapsed - self.cost)
+        else:
+            self.cost = elapsed
+        self.calls += 1
+        self.failures += bool(failed)
+
+    @property
+    def rejection_rate(self):
+        # smoothed so an unseen failure doesn't mean a rate of zero
+        return (self.failures + 1.0) / (self.calls + 2.0)
+
+    @property
+    def priority(self):
+        "Expected cost of finding a failure with this validator, lower first."
+        return self.cost / self.rejection_rate
+
+    def __repr__(self):
+        return 'ValidatorStats(calls={0}, failures={1}, cost={2:.6f})'.format(
+            self.calls, self.failures, self.cost)
+
+
+class ValidatorScheduler(object):
+    """Runs a Transfer's validators cheapest and most likely to fail first,
+    running the ones marked as independent concurrently in a thread pool.
+    As soon as any validator fails, validators that haven't started yet are
+    cancelled -- unless every error is being collected with
+    `catch_all_errors`. Validators already running can't be interrupted, but
+    their result is ignored.
+
+    Validators are independent if they have a truthy `independent` attribute,
+    either through the `independent` decorator or as a class attribute (the
+    extension validators are independent, for example). Everything else is
+    run one at a time, in a single worker, since they likely share the
+    filehandle's stream.
+
+    .. code-block:: python
+
+        ImageTransfer = Transfer(validators=[AllowedExts('png', 'jpg')],
+                                 scheduler=ValidatorScheduler(max_workers=4))
+
+    Error reporting is unchanged: with `catch_all_errors` the collected
+    messages are in registration order rather than execution order. Listener
+    events are reported for every validator as they are without a scheduler,
+    and validators run in the pool get a copy of the current request
+    context.
+
+    :param max_workers: Size of the thread pool shared by every validation
+        run through this scheduler.
+    :param decay: Weight given to the newest timing in each validator's
+        moving average cost.
+    """
+    def __init__(self, max_workers=4, decay=0.2):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._decay = decay
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def stats(self, validator):
+        "Returns the ValidatorStats for a validator, creating it if needed."
+        try:
+            return self._stats[validator]
+        except KeyError:
+            with self._lock:
+                return self._stats.setdefault(validator, ValidatorStats())
+
+    def order(self, validators):
+        """Returns (position, validator) pairs in the order they should be run.
+        The sort is stable, so validators never measured keep their
+        registration order and go first to get measured.
+        """
+        indexed = list(enumerate(validators))
+        return sorted(indexed, key=lambda pair: self.stats(pair[1]).priority)
+
+    def _run(self, validator, filehandle, metadata, listeners=None):
+        "Runs a single validator, returning the UploadError it failed with."
+        error = None
+        start = _timer()
+        try:
+            if listeners:
+                valid = _observe(listeners, 'validator', validator, filehandle,
+                                 validator, filehandle, metadata)
+            else:
+                valid = validator(filehandle, metadata)
+            if not valid:
+                error = _falsey_validator_error(validator, filehandle, metadata)
+        except UploadError as e:
+            error = e
+        self.stats(validator).record(_timer() - start, error, self._decay)
+        return error
+
+    def _run_chain(self, chain, filehandle, metadata, stop, catch_all_errors,
+                   listeners=None):
+        "Runs validators one after another until one fails or stop is set."
+        results = []
+        for position, validator in chain:
+            if stop.is_set():
+                break
+            error = self._run(validator, filehandle, metadata, listeners)
+            results.append((position, error))
+            if error is not None and not catch_all_errors:
+                break
+        return results
+
+    def __call__(self, validators, filehandle, metadata, catch_all_errors=False,
+                 listeners=None):
+        ordered = self.order(validators)
+        chain = [p for p in ordered if not getattr(p[1], 'independent', False)]
+        concurrent = [p for p in ordered if getattr(p[1], 'independent', False)]
+        stop = threading.Event()
+
+        if not concurrent:
+            results = [self._run_chain(chain, filehandle, metadata, stop,
+                                       catch_all_errors, listeners)]
+            return self._report(results, catch_all_errors,
+                                getattr(filehandle, 'filename', None))
+
+        def submit(pairs):
+            # each worker needs its own copy of the request context
+            return self._executor.submit(_in_context(self._run_chain), pairs, filehandle,
+                                         metadata, stop, catch_all_errors, listeners)
+
+        pending = set(submit([pair]) for pair in concurrent)
+        if chain:
+            pending.add(submit(chain))
+        results = []
+        try:
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    results.append(future.result())
+                    if not catch_all_errors:
+                        # bail out before waiting on anything else
+                        self._report(results, catch_all_errors)
+        finally:
+            stop.set()
+            for future in pending:
+                future.cancel()
+
+        return self._report(results, catch_all_errors,
+                            getattr(filehandle, 'filename', None))
+
+    @staticmethod
+    def _report(results, catch_all_errors, filename=None):
+        errors = sorted((position, error) for result in results
+                        for position, error in result if error is not None)
+        if not errors:
+            return None
+        if not catch_all_errors:
+            raise errors[0][1]
+        raise UploadError(errors=[error for _, error in errors], reason='multiple',
+                          filename=filename)
+
+    def shutdown(self, wait=True):
+        "Shuts down the thread pool."
+        self._executor.shutdown(wait=wait)
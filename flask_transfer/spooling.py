@@ -0,0 +1,186 @@
+"""
+    flask_transfer.spooling
+    ~~~~~~~~~~~~~~~~~~~~~~~
+    Output streams for processors that replace the upload's stream. They
+    stay in memory while they're small and move to disk once they grow past
+    a threshold or the process' memory budget for them runs out.
+"""
+import tempfile
+import threading
+
+from flask import current_app, has_app_context
+
+__all__ = ['MemoryBudget', 'ManagedSpool', 'spool', 'spool_budget', 'settings', 'configure',
+           'DEFAULT_SPOOL_THRESHOLD', 'DEFAULT_SPOOL_BUDGET']
+
+
+DEFAULT_SPOOL_THRESHOLD = 1024 * 1024
+DEFAULT_SPOOL_BUDGET = 64 * 1024 * 1024
+
+
+class MemoryBudget(object):
+    """Bytes that spools may keep in memory between them. Spools reserve
+    room before they grow and give it back when they move to disk or are
+    closed; a spool that can't reserve room moves to disk instead.
+
+    :param limit: Bytes available, None for no limit.
+    """
+    def __init__(self, limit):
+        self.limit = limit
+        self._in_use = 0
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return 'MemoryBudget({0!r})'.format(self.limit)
+
+    @property
+    def in_use(self):
+        return self._in_use
+
+    def reserve(self, amount):
+        "Reserves amount bytes, returning False if they aren't available."
+        with self._lock:
+            if self.limit is not None and self._in_use + amount > self.limit:
+                return False
+            self._in_use += amount
+            return True
+
+    def release(self, amount):
+        with self._lock:
+            self._in_use -= amount
+
+
+class ManagedSpool(tempfile.SpooledTemporaryFile):
+    """SpooledTemporaryFile that also answers to a MemoryBudget. It's held in
+    memory until a write would take it past `max_size` or beyond what the
+    budget has left, and then it's moved to a temporary file on disk before
+    the write happens. Room is reserved before it's used, so the budget is
+    never overdrawn.
+
+    Usually created with `spool`.
+
+    :param max_size: Bytes that may be held in memory, 0 for no limit other
+        than the budget's.
+    :param budget: MemoryBudget shared with other spools, None for none.
+    """
+    def __init__(self, max_size=DEFAULT_SPOOL_THRESHOLD, budget=None, **kwargs):
+        kwargs.setdefault('mode', 'w+b')
+        self._budget = budget
+        self._reserved = 0
+        super(ManagedSpool, self).__init__(max_size, **kwargs)
+
+    def _make_room(self, size):
+        if self._rolled or size <= self._reserved:
+            return
+        if self._max_size and size > self._max_size:
+            self.rollover()
+        elif self._budget is not None and not self._budget.reserve(size - self._reserved):
+            self.rollover()
+        else:
+            self._reserved = size
+
+    def _release(self):
+        reserved, self._reserved = self._reserved, 0
+        if reserved and self._budget is not None:
+            self._budget.release(reserved)
+
+    def write(self, s):
+        if not self._rolled:
+            self._make_room(self._file.tell() + len(s))
+        return super(ManagedSpool, self).write(s)
+
+    def writelines(self, iterable):
+        for line in iterable:
+            self.write(line)
+
+    def rollover(self):
+        super(ManagedSpool, self).rollover()
+        self._release()
+
+    def close(self):
+        try:
+            super(ManagedSpool, self).close()
+        finally:
+            self._release()
+
+    def __del__(self):
+        self._release()
+
+
+_default_budget = MemoryBudget(DEFAULT_SPOOL_BUDGET)
+_defaults = {'threshold': DEFAULT_SPOOL_THRESHOLD, 'directory': None}
+_budget_lock = threading.Lock()
+
+
+def settings():
+    "The current app's spool settings as (threshold, budget, directory)."
+    if not has_app_context():
+        return _defaults['threshold'], _default_budget.limit, _defaults['directory']
+    config = current_app.config
+    return (config.get('TRANSFER_SPOOL_THRESHOLD', DEFAULT_SPOOL_THRESHOLD),
+            config.get('TRANSFER_SPOOL_BUDGET', DEFAULT_SPOOL_BUDGET),
+            config.get('TRANSFER_SPOOL_DIR'))
+
+
+def configure(threshold, budget, directory):
+    """Sets the spool settings used outside of an app context, e.g. by
+    `offload.CPUBound` in its worker processes.
+    """
+    _defaults.update(threshold=threshold, directory=directory)
+    _default_budget.limit = budget
+
+
+def spool_budget():
+    """Returns the MemoryBudget for the current app, created from its
+    ``TRANSFER_SPOOL_BUDGET`` the first time. Outside of an app context, a
+    budget shared by the whole process is used.
+    """
+    if not has_app_context():
+        return _default_budget
+
+    extensions = current_app.extensions
+    budget = extensions.get('flask_transfer.spool_budget')
+    if budget is None:
+        with _budget_lock:
+            budget = extensions.setdefault('flask_transfer.spool_budget',
+                                           MemoryBudget(settings()[1]))
+    return budget
+
+
+def spool(threshold=None, budget=None):
+    """Creates an output stream for a processor that replaces the upload's
+    stream. Write the new contents to it, seek back to the start and put it
+    on the filehandle:
+
+    .. code-block:: python
+
+        @Text.preprocessor
+        def make_uppercase(filehandle, meta):
+            out = spool()
+            for chunk in iter(lambda: filehandle.stream.read(16384), b''):
+                out.write(chunk.upper())
+            out.seek(0)
+            filehandle.stream = out
+            return filehandle
+
+    Unlike a BytesIO, it moves to disk once it holds more than `threshold`
+    bytes, or when every spool in the process together would hold more
+    than the app's budget, so memory stays bounded however many big uploads
+    are in flight. They're configured with:
+
+        * ``TRANSFER_SPOOL_THRESHOLD``: bytes a single spool keeps in memory,
+          1MB by default.
+        * ``TRANSFER_SPOOL_BUDGET``: bytes all spools keep in memory, 64MB by
+          default. None for no limit.
+        * ``TRANSFER_SPOOL_DIR``: where spools go on disk, the system's
+          temporary directory by default.
+
+    Memory is given back to the budget when the spool moves to disk or is
+    closed. Preprocessors run by `offload.CPUBound` get the app's settings
+    too, with a budget per worker process.
+    """
+    default_threshold, _, directory = settings()
+    if threshold is None:
+        threshold = default_threshold
+    return ManagedSpool(threshold, budget or spool_budget(), dir=directory,
+                        prefix='flask-transfer-')
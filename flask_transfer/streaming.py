@@ -0,0 +1,263 @@
+"""
+    flask_transfer.streaming
+    ~~~~~~~~~~~~~~~~~~~~~~~~
+    Single pass, fixed size chunk reading of uploads.
+"""
+import os
+import stat
+
+__all__ = ['StreamPipeline', 'PeekableStream', 'CountingStream', 'peek',
+           'known_size', 'DEFAULT_CHUNK_SIZE']
+
+
+DEFAULT_CHUNK_SIZE = 16384
+
+
+class StreamPipeline(object):
+    """Read only file-like object that pulls the wrapped stream in fixed size
+    chunks. Every chunk is run through the transformers and then shown to the
+    consumers before being handed to whoever is reading the pipeline (usually
+    the destination). This lets an upload be read exactly once, with peak
+    memory bounded by the chunk size rather than the size of the upload.
+
+    Consumers and transformers are factories: each one is called once per
+    upload with the filehandle and metadata and must return a callable that
+    accepts a single chunk of bytes. An empty chunk signals the end of the
+    stream.
+
+    * Consumers observe chunks. Their return value is ignored; they signal
+      failure by raising UploadError, which aborts the read (and so the
+      write) right where it is.
+    * Transformers return the bytes that replace the chunk. They may buffer
+      internally and return an empty bytestring, and they're expected to
+      return anything still buffered when handed the final, empty chunk.
+
+    .. code-block:: python
+
+        def count_bytes(filehandle, metadata):
+            metadata['size'] = 0
+
+            def consume(chunk):
+                metadata['size'] += len(chunk)
+            return consume
+
+        pipeline = StreamPipeline(filehandle.stream, filehandle, {},
+                                  consumers=[count_bytes])
+        pipeline.read(1024)
+    """
+    def __init__(self, stream, filehandle, metadata, consumers=(),
+                 transformers=(), chunk_size=DEFAULT_CHUNK_SIZE):
+        self.source = stream
+        self.chunk_size = chunk_size
+        self.bytes_read = 0
+        self._transformers = [make(filehandle, metadata) for make in transformers]
+        self._consumers = [make(filehandle, metadata) for make in consumers]
+        self._buffer = b''
+        self._exhausted = False
+
+    def _transform(self, chunk, final):
+        for transform in self._transformers:
+            data = transform(chunk) if chunk else b''
+            if final:
+                data += transform(b'')
+            chunk = data
+        return chunk
+
+    def _next_chunk(self):
+        chunk = self.source.read(self.chunk_size)
+        self.bytes_read += len(chunk)
+        self._exhausted = not chunk
+        chunk = self._transform(chunk, self._exhausted)
+
+        for consume in self._consumers:
+            if chunk:
+                consume(chunk)
+            if self._exhausted:
+                consume(b'')
+        return chunk
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            chunks = [self._buffer]
+            while not self._exhausted:
+                chunks.append(self._next_chunk())
+            self._buffer = b''
+            return b''.join(chunks)
+
+        # joined once, rather than growing the buffer a chunk at a time
+        chunks, have = [self._buffer], len(self._buffer)
+        while have < size and not self._exhausted:
+            chunk = self._next_chunk()
+            chunks.append(chunk)
+            have += len(chunk)
+
+        data = b''.join(chunks)
+        if have <= size:
+            self._buffer = b''
+            return data
+        data, self._buffer = data[:size], data[size:]
+        return data
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    def finish(self):
+        """Drains whatever the reader left behind so every consumer sees the
+        entire upload, including the end of stream signal.
+        """
+        while not self._exhausted:
+            self._next_chunk()
+        self._buffer = b''
+
+    @property
+    def exhausted(self):
+        return self._exhausted
+
+
+class PeekableStream(object):
+    """Wraps a stream that can't seek so the front of it can be looked at
+    without being consumed. Only the peeked prefix is held in memory, reads
+    past it go straight to the wrapped stream.
+    """
+    def __init__(self, stream):
+        self.source = stream
+        self._prefix = b''
+
+    def peek(self, size):
+        "Returns up to size bytes from the front of the stream."
+        while len(self._prefix) < size:
+            chunk = self.source.read(size - len(self._prefix))
+            if not chunk:
+                break
+            self._prefix += chunk
+        return self._prefix[:size]
+
+    def read(self, size=-1):
+        if not self._prefix:
+            return self.source.read(size)
+
+        if size is None or size < 0:
+            data, self._prefix = self._prefix + self.source.read(), b''
+        elif size <= len(self._prefix):
+            data, self._prefix = self._prefix[:size], self._prefix[size:]
+        else:
+            data = self._prefix + self.source.read(size - len(self._prefix))
+            self._prefix = b''
+        return data
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    def __getattr__(self, attr):
+        return getattr(self.source, attr)
+
+
+def _seekable(stream):
+    try:
+        return stream.seekable()
+    except AttributeError:
+        return hasattr(stream, 'seek') and hasattr(stream, 'tell')
+
+
+def peek(filehandle, size):
+    """Returns up to size bytes from the front of a filehandle's stream
+    without consuming them. Seekable streams are read and rewound, anything
+    else is wrapped in a PeekableStream that's placed back on the filehandle
+    so later readers still see the entire upload.
+    """
+    stream = filehandle.stream
+    if isinstance(stream, PeekableStream):
+        return stream.peek(size)
+
+    if _seekable(stream):
+        position = stream.tell()
+        try:
+            return stream.read(size)
+        finally:
+            stream.seek(position)
+
+    stream = filehandle.stream = PeekableStream(stream)
+    return stream.peek(size)
+
+
+class CountingStream(object):
+    """Wraps a stream and counts the bytes read from it. After every read,
+    `check` is called with the running count and whether the end of the
+    stream was reached, it may raise to abort the read.
+
+    If `limit` is provided, reads are clamped so that no more than limit + 1
+    bytes are ever pulled from the wrapped stream -- just enough to know the
+    limit has been crossed.
+
+    A read of everything reaches the end of the stream, as does an empty
+    read. Readers that stop short of either should call `finish`.
+    """
+    def __init__(self, stream, check, limit=None):
+        self.source = stream
+        self.count = 0
+        self.finished = False
+        self._check = check
+        self._limit = limit
+
+    def read(self, size=-1):
+        everything = size is None or size < 0
+        if self._limit is not None:
+            allowed = self._limit - self.count + 1
+            if everything or size > allowed:
+                size = allowed
+
+        data = self.source.read(size)
+        self.count += len(data)
+        if everything:
+            # it read to the end, unless the limit cut it short
+            finished = self._limit is None or len(data) < size
+        else:
+            finished = not data and size != 0
+        self.finished = self.finished or finished
+        self._check(self.count, finished)
+        return data
+
+    def finish(self, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Reads whatever the reader left behind, so `check` sees the whole
+        stream and its end.
+        """
+        while not self.finished:
+            if not self.read(chunk_size) and not self.finished:
+                # clamped to nothing, the limit's been crossed
+                break
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    def __getattr__(self, attr):
+        return getattr(self.source, attr)
+
+
+def known_size(filehandle):
+    """Returns the number of bytes left in a filehandle's stream if that can
+    be learned without reading or seeking it -- that is, if it's backed by a
+    regular file. Otherwise returns None.
+    """
+    stream = filehandle.stream
+    # SpooledTemporaryFile.fileno writes the spooled data to disk
+    if not getattr(stream, '_rolled', True):
+        return None
+
+    try:
+        info = os.fstat(stream.fileno())
+        position = stream.tell()
+    except (AttributeError, IOError, OSError, ValueError):
+        return None
+
+    if not stat.S_ISREG(info.st_mode):
+        return None
+    return max(info.st_size - position, 0)
@@ -1,17 +1,121 @@
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from copy import copy
+from functools import partial
+import os
+import threading
+import uuid
+from flask import (copy_current_request_context, current_app, has_app_context,
+                   has_request_context)
 from werkzeug._compat import string_types
+from .buffering import buffered_copy
+from .destinations import copy_to_file, copy_to_path
+from .deferred import SavedFile, ThreadQueue
 from .exc import UploadError
+from .metrics import _observe, _Span
+from .offload import CPUBound
+from .streaming import CountingStream, StreamPipeline, DEFAULT_CHUNK_SIZE
 
-__all__ = ['Transfer']
+__all__ = ['Transfer', 'SaveResult']
+
+
+class SaveResult(namedtuple('SaveResult', ['filehandle', 'metadata', 'error'])):
+    """Outcome of saving a single file with `Transfer.save_many`. `error` is
+    the exception that stopped the file from being saved, or None if it was
+    saved successfully.
+    """
+    __slots__ = ()
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+def _finish_stream(stream):
+    """Drains what the destination left of the upload through every
+    StreamPipeline and CountingStream wrapping it, outermost first, so
+    consumers and size checks all see the whole upload and its end.
+    """
+    while stream is not None:
+        if isinstance(stream, (StreamPipeline, CountingStream)):
+            stream.finish()
+        stream = getattr(stream, 'source', None)
 
 
 def _use_filehandle_to_save(dest):
     def saver(filehandle, metadata):
-        "Uses the save method on the filehandle to save to the destination"
-        buffer_size = metadata.get('buffer_size', 16384)
-        filehandle.save(dest, buffer_size)
+        """Uses the save method on the filehandle to save to the destination,
+        unless the upload is already on disk and the kernel can copy it
+        directly. Setting `hardlink` in the metadata allows linking an
+        upload that's a named file into place instead of copying it.
+
+        If the upload is rejected while it's copied to a path, the partial
+        file is removed.
+
+        The buffer size is chosen by `buffering.buffer_size_for`.
+        """
+        if not isinstance(dest, string_types):
+            if not copy_to_file(filehandle.stream, dest):
+                buffered_copy(filehandle, metadata, partial(filehandle.save, dest), None)
+            return
+
+        metadata['path'] = dest
+        try:
+            if not copy_to_path(filehandle.stream, dest, metadata.get('hardlink', False)):
+                buffered_copy(filehandle, metadata, partial(filehandle.save, dest), dest)
+            _finish_stream(filehandle.stream)
+        except UploadError:
+            try:
+                os.remove(dest)
+            except OSError:
+                pass
+            raise
     return saver
 
 
+def _in_context(fn):
+    """Wraps fn so that, called from another thread, it runs in a copy of
+    the current request context -- or in the current app's context outside
+    of a request -- so validators and processors can still use `request`,
+    `g` and `current_app`. Must be called in the thread that has the context.
+    """
+    if has_request_context():
+        @copy_current_request_context
+        def run_in_request(*args, **kwargs):
+            return fn(*args, **kwargs)
+        return run_in_request
+
+    if has_app_context():
+        app = current_app._get_current_object()
+
+        def run_in_app(*args, **kwargs):
+            with app.app_context():
+                return fn(*args, **kwargs)
+        return run_in_app
+
+    return fn
+
+
+def _falsey_validator_error(validator, filehandle, metadata):
+    "Builds the UploadError reported when a validator returns a falsey value."
+    msg = '{0!r}({1!r}, {2!r}) returned False'
+    return UploadError(partial(msg.format, validator, filehandle, metadata),
+                       reason='returned_false', validator=validator,
+                       filename=getattr(filehandle, 'filename', None))
+
+
+def _commit(pending):
+    "Commits a destination's pending write, if it returned one."
+    if hasattr(pending, 'commit') and hasattr(pending, 'rollback'):
+        pending.commit()
+
+
+def _rollback(pending):
+    "Rolls back a destination's pending write, if it returned one."
+    if hasattr(pending, 'commit') and hasattr(pending, 'rollback'):
+        pending.rollback()
+
+
 def _make_destination_callable(dest):
     """Creates a callable out of the destination. If it's already callable,
     the destination is returned. Instead, if the object is a string or a
@@ -69,10 +173,36 @@ class Transfer(object):
     :param postprocessors: List-like of processors to run on the filehandle
         after passing it to the destination. Maybe be None to run no post
         processing.
+    :param consumers: List-like of chunk consumer factories that observe the
+        upload as the destination reads it. See `Transfer.consumer`.
+    :param transformers: List-like of chunk transformer factories that rewrite
+        the upload as the destination reads it. See `Transfer.transformer`.
+    :param chunk_size: Size of the chunks pulled from the filehandle when
+        consumers or transformers are attached.
+    :param scheduler: Optional callable that takes over running validators,
+        such as `flask_transfer.scheduling.ValidatorScheduler`. It's called
+        with the validators, filehandle, metadata and catch_all_errors flag,
+        and the listeners as `listeners` when there are any. AsyncTransfer
+        doesn't use it.
+    :param listeners: List-like of callables that are passed a
+        `metrics.TransferEvent` whenever a stage starts or stops. See
+        `Transfer.listener`.
+    :param deferred: List-like of postprocessors to run after the save
+        returns. See `Transfer.postprocessor`.
+    :param deferred_queue: `deferred.DeferredQueue` that runs the deferred
+        postprocessors. Defaults to a `deferred.ThreadQueue`, created the
+        first time it's needed.
+    :param cpu_pool: `offload.CPUPool` that CPU bound preprocessors run in.
+        Defaults to the current app's, see `offload.cpu_pool`.
+    :param limiter: `limits.ConcurrencyLimiter` that saves wait their turn
+        in between validating and preprocessing, so only so many are
+        processed and written at once.
     """
 
     def __init__(self, destination=None, validators=None, preprocessors=None,
-                 postprocessors=None):
+                 postprocessors=None, consumers=None, transformers=None,
+                 chunk_size=DEFAULT_CHUNK_SIZE, scheduler=None, listeners=None,
+                 deferred=None, deferred_queue=None, cpu_pool=None, limiter=None):
         if destination is not None:
             self._destination = _make_destination_callable(destination)
         else:
@@ -80,6 +210,16 @@ class Transfer(object):
         self._validators = validators or []
         self._preprocessors = preprocessors or []
         self._postprocessors = postprocessors or []
+        self._consumers = consumers or []
+        self._transformers = transformers or []
+        self._chunk_size = chunk_size
+        self._scheduler = scheduler
+        self._listeners = listeners or []
+        self._deferred = deferred or []
+        self._deferred_queue = deferred_queue
+        self._deferred_lock = threading.Lock()
+        self._cpu_pool = cpu_pool
+        self._limiter = limiter
 
     def validator(self, fn):
         """Adds a validator to the Transfer instance
@@ -100,7 +240,7 @@ class Transfer(object):
         self._validators.append(fn)
         return fn
 
-    def preprocessor(self, fn):
+    def preprocessor(self, fn=None, cpu_bound=False):
         """Adds a preprocessor to the Transfer instance.
 
         .. code-block:: python
@@ -110,13 +250,37 @@ class Transfer(object):
             @Text.preprocessor
             def make_uppercase(filehandle, meta):
                 "Makes a text document all uppercase"
-                filehandle.stream = filehandle.stream.upper()
+                out = spooling.spool()
+                for chunk in iter(lambda: filehandle.stream.read(16384), b''):
+                    out.write(chunk.upper())
+                out.seek(0)
+                filehandle.stream = out
                 return filehandle
+
+        Preprocessors that replace the stream should write the new one to
+        `spooling.spool()` rather than a BytesIO, so big outputs go to disk
+        instead of piling up in memory.
+
+        CPU heavy preprocessors, such as rasterizing a PDF, hold the GIL and
+        stall every other thread in the worker. Declaring them `cpu_bound`
+        runs them in a process pool instead, see `offload.CPUBound`. They
+        have to be module level functions.
+
+        .. code-block:: python
+
+            @PDFTransfer.preprocessor(cpu_bound=True)
+            def pdftojpg(filehandle, meta):
+                ...
         """
-        self._preprocessors.append(fn)
+        if fn is None:
+            return partial(self.preprocessor, cpu_bound=cpu_bound)
+        if cpu_bound:
+            self._preprocessors.append(CPUBound(fn, pool=self._cpu_pool))
+        else:
+            self._preprocessors.append(fn)
         return fn
 
-    def postprocessor(self, fn):
+    def postprocessor(self, fn=None, deferred=False):
         """Adds a postprocessor ito the Transfer instance.
 
         .. code-block:: python
@@ -132,10 +296,133 @@ class Transfer(object):
                     ratio = meta['width'] / img.width
                     img.resize(width, int(ratio * img.height)
                     img.save(filename=meta['thumbnail_path'])
+
+        Slow postprocessors like that can be deferred, so the save returns as
+        soon as the upload is written and they run later in the Transfer's
+        deferred queue. Since the upload's stream is gone by then, deferred
+        postprocessors are passed a `deferred.SavedFile` -- the filename,
+        content type and the path it was saved to -- and a copy of the
+        metadata. Their return value is ignored.
+
+        .. code-block:: python
+
+            @ImageTransfer.postprocessor(deferred=True)
+            def thumbnailify(saved, meta):
+                with saved.stream as stream, Image(file=stream) as img:
+                    ...
+
+        Each save gets an `upload_id` in its metadata, which can be used to
+        look up how the deferred postprocessors are getting on with
+        `Transfer.deferred_status`.
+        """
+        if fn is None:
+            return partial(self.postprocessor, deferred=deferred)
+        if deferred:
+            self._deferred.append(fn)
+        else:
+            self._postprocessors.append(fn)
+        return fn
+
+    @property
+    def deferred_queue(self):
+        "The queue deferred postprocessors run in."
+        if self._deferred_queue is None:
+            # only one of the requests racing to defer their first upload
+            # gets to start the queue's workers
+            with self._deferred_lock:
+                if self._deferred_queue is None:
+                    self._deferred_queue = ThreadQueue()
+        return self._deferred_queue
+
+    def deferred_status(self, upload_id):
+        """Returns a `deferred.TaskStatus` for each deferred postprocessor
+        queued for upload_id.
+        """
+        return self.deferred_queue.status(upload_id)
+
+    def _defer(self, filehandle, metadata):
+        "Hands the deferred postprocessors to the deferred queue."
+        if self._deferred:
+            upload_id = metadata.setdefault('upload_id', uuid.uuid4().hex)
+            self.deferred_queue.submit(upload_id, self._deferred,
+                                       SavedFile.from_filehandle(filehandle, metadata),
+                                       metadata)
+        return filehandle
+
+    def consumer(self, fn):
+        """Adds a chunk consumer to the Transfer instance. Consumers let
+        validation happen while the destination reads the upload, rather than
+        in a separate pass over the whole file beforehand.
+
+        The registered callable is a factory called once per upload with the
+        filehandle and metadata. It returns the callable that actually receives
+        each chunk, an empty chunk marks the end of the upload. Raising
+        UploadError aborts the save mid-stream.
+
+        .. code-block:: python
+
+            Text = Transfer(validators=[AllowedExts('txt')])
+
+            @Text.consumer
+            def no_null_bytes(filehandle, meta):
+                def consume(chunk):
+                    if b'\\x00' in chunk:
+                        raise UploadError('Text files may not contain nulls')
+                return consume
+        """
+        self._consumers.append(fn)
+        return fn
+
+    def transformer(self, fn):
+        """Adds a chunk transformer to the Transfer instance. Transformers
+        rewrite the upload chunk by chunk as the destination reads it, rather
+        than replacing the entire stream in a preprocessor.
+
+        Like consumers, the registered callable is a per upload factory. The
+        callable it returns receives each chunk and returns the bytes to pass
+        along. When handed the final, empty chunk it should return anything
+        it's still holding on to.
+
+        .. code-block:: python
+
+            Text = Transfer(validators=[AllowedExts('txt')])
+
+            @Text.transformer
+            def make_uppercase(filehandle, meta):
+                return lambda chunk: chunk.upper()
         """
-        self._postprocessors.append(fn)
+        self._transformers.append(fn)
         return fn
 
+    def listener(self, fn):
+        """Adds a listener to the Transfer instance. Listeners are passed a
+        `metrics.TransferEvent` when each stage of a save starts and stops --
+        validating, preprocessing, writing, postprocessing, committing -- and
+        for every individual validator and processor. Stop events carry the
+        duration, the outcome and, for writes, the bytes read.
+
+        With no listeners attached, none of this is timed at all.
+
+        .. code-block:: python
+
+            @ImageTransfer.listener
+            def log_slow_stages(event):
+                if event.phase == 'stop' and event.elapsed > 1:
+                    log.warning('%s %s took %.2fs', event.stage, event.name,
+                                event.elapsed)
+
+        `metrics.HistogramCollector` is a listener that keeps histograms of
+        the durations, ready to be exported to Prometheus.
+        """
+        self._listeners.append(fn)
+        return fn
+
+    def _stage(self, stage, fn, filehandle, *args, **kwargs):
+        "Runs fn as stage, reporting it to the listeners if there are any."
+        if not self._listeners:
+            return fn(*args)
+        return _observe(self._listeners, stage, stage, filehandle, fn, *args, **kwargs)
+
     def destination(self, dest):
         """Changes the default destination of the Transfer object. Can be used
         as a standard method or as a decorator.
@@ -153,36 +440,151 @@ class Transfer(object):
         and the first one by toggling the `catch_all_errors` flag. If
         catch_all_errors is Truthy then a single UploadError is raised
         consisting of all UploadErrors raised.
+
+        If a scheduler is attached, running the validators is handed off to it,
+        along with the listeners when there are any.
         """
+        if self._scheduler is not None:
+            if self._listeners:
+                return self._scheduler(self._validators, filehandle, metadata,
+                                       catch_all_errors, listeners=self._listeners)
+            return self._scheduler(self._validators, filehandle, metadata,
+                                   catch_all_errors)
+
         errors = []
-        DEFAULT_ERROR_MSG = '{0!r}({1!r}, {2!r}) returned False'
+        listeners = self._listeners
 
         for validator in self._validators:
             try:
-                if not validator(filehandle, metadata):
-                    msg = DEFAULT_ERROR_MSG.format(validator, filehandle, metadata)
-                    raise UploadError(msg)
+                if listeners:
+                    valid = _observe(listeners, 'validator', validator, filehandle,
+                                     validator, filehandle, metadata)
+                else:
+                    valid = validator(filehandle, metadata)
+                if not valid:
+                    raise _falsey_validator_error(validator, filehandle, metadata)
             except UploadError as e:
                 if catch_all_errors:
-                    errors.append(e.args[0])
+                    errors.append(e)
                 else:
                     raise
 
         if errors:
-            raise UploadError(errors)
+            raise UploadError(errors=errors, reason='multiple',
+                              filename=getattr(filehandle, 'filename', None))
 
     def _preprocess(self, filehandle, metadata):
         "Runs all attached preprocessors on the provided filehandle."
+        listeners = self._listeners
         for process in self._preprocessors:
-            filehandle = process(filehandle, metadata)
+            if listeners:
+                filehandle = _observe(listeners, 'preprocessor', process, filehandle,
+                                      process, filehandle, metadata)
+            else:
+                filehandle = process(filehandle, metadata)
         return filehandle
 
     def _postprocess(self, filehandle, metadata):
         "Runs all attached postprocessors on the provided filehandle."
+        listeners = self._listeners
         for process in self._postprocessors:
-            filehandle = process(filehandle, metadata)
+            if listeners:
+                filehandle = _observe(listeners, 'postprocessor', process, filehandle,
+                                      process, filehandle, metadata)
+            else:
+                filehandle = process(filehandle, metadata)
         return filehandle
 
+    def _resolve_destination(self, destination):
+        "Picks and normalizes the destination for a save."
+        destination = destination or self._destination
+        if destination is None:
+            raise RuntimeError("Destination for filehandle must be provided.")
+
+        elif destination is not self._destination:
+            destination = _make_destination_callable(destination)
+        return destination
+
+    def _write(self, filehandle, destination, metadata):
+        """Hands the filehandle to the destination, streaming it if needed.
+        Returns whatever the destination returned.
+        """
+        pipeline = self._open_stream(filehandle, metadata)
+
+        try:
+            pending = destination(filehandle, metadata)
+        except Exception:
+            self._close_stream(filehandle, pipeline, drain=False)
+            raise
+
+        try:
+            self._close_stream(filehandle, pipeline)
+        except Exception:
+            _rollback(pending)
+            raise
+        return pending
+
+    def _persist(self, filehandle, destination, metadata):
+        """Preprocesses, saves and postprocesses an already validated
+        filehandle. If the destination returned a pending write (an object
+        with `commit` and `rollback` methods) it's committed once
+        postprocessing succeeds, and rolled back if it doesn't.
+
+        With a limiter, it waits for its turn first and gives it up once
+        committed, before the deferred postprocessors are queued.
+        """
+        slot = None
+        if self._limiter is not None:
+            slot = self._stage('queue', self._limiter.acquire, filehandle, filehandle)
+        try:
+            filehandle = self._stage('preprocess', self._preprocess, filehandle,
+                                     filehandle, metadata)
+            pending = self._stage('write', self._write, filehandle,
+                                  filehandle, destination, metadata, count_bytes=True)
+
+            try:
+                filehandle = self._stage('postprocess', self._postprocess, filehandle,
+                                         filehandle, metadata)
+            except Exception:
+                _rollback(pending)
+                raise
+
+            self._stage('commit', _commit, filehandle, pending)
+        finally:
+            if slot is not None:
+                slot.release()
+        return self._defer(filehandle, metadata)
+
+    def _open_stream(self, filehandle, metadata):
+        """Places a StreamPipeline on the filehandle if any consumers or
+        transformers are attached. Returns the pipeline or None.
+        """
+        if not (self._consumers or self._transformers):
+            return None
+
+        pipeline = StreamPipeline(filehandle.stream, filehandle, metadata,
+                                  consumers=self._consumers,
+                                  transformers=self._transformers,
+                                  chunk_size=self._chunk_size)
+        filehandle.stream = pipeline
+        return pipeline
+
+    def _close_stream(self, filehandle, pipeline, drain=True):
+        """Finishes the pipeline, so consumers see the whole upload even if
+        the destination didn't read all of it, then puts the original stream
+        back on the filehandle. Without a pipeline, the size checks wrapping
+        the stream are finished instead.
+        """
+        if pipeline is None:
+            if drain:
+                _finish_stream(getattr(filehandle, 'stream', None))
+            return
+        try:
+            if drain:
+                pipeline.finish()
+        finally:
+            filehandle.stream = pipeline.source
+
     def save(self, filehandle, destination=None, metadata=None,
              validate=True, catch_all_errors=False, *args, **kwargs):
         """Saves the filehandle to the provided destination or the attached
@@ -199,25 +601,194 @@ class Transfer(object):
         :param catch_all_errors boolean: Toggles if validation should collect
             all UploadErrors and raise a collected error message or bail out on
             the first one.
-        """
-        destination = destination or self._destination
-        if destination is None:
-            raise RuntimeError("Destination for filehandle must be provided.")
 
-        elif destination is not self._destination:
-            destination = _make_destination_callable(destination)
+        A destination may return a pending write -- an object with `commit`
+        and `rollback` methods. It's committed after postprocessing succeeds,
+        or rolled back if anything after the destination fails.
+        """
+        destination = self._resolve_destination(destination)
 
         if metadata is None:
             metadata = {}
 
-        if validate:
-            self._validate(filehandle, metadata)
-
-        filehandle = self._preprocess(filehandle, metadata)
-        destination(filehandle, metadata)
-        filehandle = self._postprocess(filehandle, metadata)
+        if not self._listeners:
+            if validate:
+                self._validate(filehandle, metadata)
+            return self._persist(filehandle, destination, metadata)
+
+        span = _Span(self._listeners, 'save', 'save', filehandle)
+        try:
+            if validate:
+                self._stage('validate', self._validate, filehandle, filehandle, metadata)
+            filehandle = self._persist(filehandle, destination, metadata)
+        except Exception as e:
+            span.fail(e)
+            raise
+        span.finish('ok')
         return filehandle
 
+    def save_many(self, filehandles, destination=None, metadata=None,
+                  validate=True, catch_all_errors=False, max_workers=4):
+        """Saves a batch of filehandles, such as `request.files.getlist(...)`.
+        The whole batch is validated first and the files that pass are then
+        processed and saved in a pool of at most `max_workers` threads. The
+        destination is only resolved once for the entire batch.
+
+        If the destination has a `save_many` attribute, it's called once with
+        a list of (filehandle, metadata) pairs instead of calling the
+        destination for every file. This lets a destination batch its I/O,
+        e.g. a single directory fsync or a single archive append:
+
+        .. code-block:: python
+
+            class ZipDestination(object):
+                def __init__(self, archive):
+                    self.archive = archive
+
+                def __call__(self, filehandle, metadata):
+                    self.save_many([(filehandle, metadata)])
+
+                def save_many(self, pairs):
+                    with zipfile.ZipFile(self.archive, 'a') as zf:
+                        for filehandle, metadata in pairs:
+                            zf.writestr(filehandle.filename,
+                                        filehandle.stream.read())
+
+        `save_many` may return a list with a pending write (or None) for each
+        pair, which is committed or rolled back just like the return value of
+        a destination in `Transfer.save`. With a limiter, the batch is handed
+        over in as many groups as it takes to stay within its limits.
+
+        A failure saving one file doesn't stop the others from being saved,
+        instead a SaveResult is returned for every filehandle, in the order
+        they were provided. Failed files have their exception in `error`.
+        Validators and processors in the pool run in a copy of the current
+        request context.
+
+        :param filehandles: Iterable of werkzeug.FileStorage instances
+        :param destination: See `Transfer.save`
+        :param metadata: Optional mapping of metadata, each file receives a
+            shallow copy of it.
+        :param validate boolean: Toggle validation, defaults to True
+        :param catch_all_errors boolean: See `Transfer.save`
+        :param max_workers: Maximum number of files processed at once.
+        """
+        destination = self._resolve_destination(destination)
+        filehandles = list(filehandles)
+        metadatas = [{} if metadata is None else copy(metadata) for _ in filehandles]
+        errors = [None] * len(filehandles)
+
+        if validate:
+            for idx, (filehandle, meta) in enumerate(zip(filehandles, metadatas)):
+                try:
+                    self._validate(filehandle, meta, catch_all_errors)
+                except UploadError as e:
+                    errors[idx] = e
+
+        pending = [idx for idx, error in enumerate(errors) if error is None]
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            def run_stage(stage, idxs):
+                "Runs stage on every file at idxs, recording failures."
+                def run(idx):
+                    try:
+                        filehandles[idx] = stage(filehandles[idx], metadatas[idx])
+                    except Exception as e:
+                        errors[idx] = e
+                # each worker needs its own copy of the request context
+                for future in [pool.submit(_in_context(run), idx) for idx in idxs]:
+                    future.result()
+                return [idx for idx in idxs if errors[idx] is None]
+
+            if hasattr(destination, 'save_many'):
+                for group, slots in self._bulk_groups(pending, filehandles, errors):
+                    try:
+                        self._bulk_persist(group, filehandles, metadatas, errors,
+                                           destination, run_stage)
+                    finally:
+                        for slot in slots:
+                            slot.release()
+            else:
+                run_stage(lambda fh, meta: self._persist(fh, destination, meta),
+                          pending)
+
+        return [SaveResult(*result) for result in zip(filehandles, metadatas, errors)]
+
+    def _bulk_groups(self, pending, filehandles, errors):
+        """Splits the files at pending into groups to hand to a bulk
+        destination, with the limiter's slots for each. A group grows until
+        the limiter has no slot free, and only waits for one when it's empty,
+        since the slots it holds aren't given back until it's been saved.
+        """
+        if self._limiter is None:
+            if pending:
+                yield pending, []
+            return
+
+        group, slots = [], []
+        for idx in pending:
+            slot = self._limiter.try_acquire(filehandles[idx]) if group else None
+            if slot is None and group:
+                yield group, slots
+                group, slots = [], []
+            if slot is None:
+                try:
+                    slot = self._limiter.acquire(filehandles[idx])
+                except Exception as e:
+                    errors[idx] = e
+                    continue
+            group.append(idx)
+            slots.append(slot)
+        if group:
+            yield group, slots
+
+    def _bulk_persist(self, group, filehandles, metadatas, errors, destination,
+                      run_stage):
+        """Preprocesses each file, hands every file that's still okay to the
+        destination's bulk hook at once, then finishes, postprocesses and
+        commits them one by one like `_persist`.
+        """
+        pipelines, pendings = {}, {}
+
+        def prepare(filehandle, meta):
+            filehandle = self._stage('preprocess', self._preprocess, filehandle,
+                                     filehandle, meta)
+            pipelines[id(filehandle)] = self._open_stream(filehandle, meta)
+            return filehandle
+
+        group = run_stage(prepare, group)
+        if not group:
+            return
+
+        try:
+            written = destination.save_many([(filehandles[idx], metadatas[idx])
+                                             for idx in group])
+        except Exception as e:
+            for idx in group:
+                errors[idx] = e
+                self._close_stream(filehandles[idx], pipelines[id(filehandles[idx])],
+                                   drain=False)
+            return
+
+        if written is None:
+            written = [None] * len(group)
+        for idx, pending in zip(group, written):
+            pendings[id(filehandles[idx])] = pending
+
+        def finish(filehandle, meta):
+            pending = pendings[id(filehandle)]
+            pipeline = pipelines[id(filehandle)]
+            try:
+                self._close_stream(filehandle, pipeline)
+                filehandle = self._stage('postprocess', self._postprocess, filehandle,
+                                         filehandle, meta)
+            except Exception:
+                _rollback(pending)
+                raise
+            self._stage('commit', _commit, filehandle, pending)
+            return self._defer(filehandle, meta)
+
+        run_stage(finish, group)
+
     def __call__(self, filehandle, destination=None, metadata=None,
                  validate=True, catch_all_errors=False, *args, **kwargs):
         "Short cut to Transfer.save."
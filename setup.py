@@ -59,7 +59,7 @@ if __name__ == "__main__":
             'Programming Language :: Python :: 2.7',
             'Programming Language :: Python :: 3.4'
         ],
-        install_requires=['Flask'],
+        install_requires=['Flask', 'futures; python_version < "3.2"'],
         test_suite='test',
         tests_require=['tox'],
         cmdclass={'tox': ToxTest},
@@ -0,0 +1,154 @@
+from flask_transfer import UploadError
+from flask_transfer.aio import AsyncTransfer
+from flask_transfer.validators import FunctionValidator
+from werkzeug import FileStorage
+import asyncio
+import threading
+import pytest
+
+try:
+    from io import BytesIO
+except ImportError:
+    from StringIO import StringIO as BytesIO
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+@pytest.fixture
+def transf():
+    return AsyncTransfer()
+
+
+def test_AsyncTransfer_awaits_coroutines(transf):
+    calls = []
+
+    @transf.validator
+    async def validate(fh, meta):
+        calls.append('validate')
+        return True
+
+    @transf.preprocessor
+    async def pre(fh, meta):
+        calls.append('pre')
+        return fh
+
+    @transf.postprocessor
+    async def post(fh, meta):
+        calls.append('post')
+        return fh
+
+    @transf.destination
+    async def dest(fh, meta):
+        calls.append('dest')
+
+    run(transf.save(FileStorage(stream=BytesIO(b'hello'))))
+
+    assert calls == ['validate', 'pre', 'dest', 'post']
+
+
+def test_AsyncTransfer_offloads_sync_callables(transf):
+    threads = []
+
+    @transf.validator
+    def validate(fh, meta):
+        threads.append(threading.current_thread())
+        return True
+
+    async def main():
+        await transf.save(FileStorage(stream=BytesIO(b'hello')),
+                          destination=lambda fh, meta: None)
+        return threading.current_thread()
+
+    loop_thread = run(main())
+    assert threads and threads[0] is not loop_thread
+
+
+def test_AsyncTransfer_awaits_wrapped_coroutines(transf):
+    async def falsey(fh, meta):
+        return False
+
+    transf.validator(FunctionValidator(falsey))
+
+    with pytest.raises(UploadError) as excinfo:
+        run(transf.save(FileStorage(stream=BytesIO()),
+                        destination=lambda fh, meta: None))
+
+    assert 'returned False' in str(excinfo.value)
+
+
+def test_AsyncTransfer_validate_catch_all_errors(transf):
+    @transf.validator
+    @transf.validator
+    async def derp(filehandle, meta):
+        raise UploadError('error')
+
+    with pytest.raises(UploadError) as excinfo:
+        run(transf._validate('', {}, catch_all_errors=True))
+
+    assert excinfo.value.args[0] == ['error', 'error']
+
+
+def test_AsyncTransfer_save_to_writable(transf):
+    destination = BytesIO()
+    transf.transformer(lambda fh, meta: lambda chunk: chunk.upper())
+
+    run(transf.save(FileStorage(stream=BytesIO(b'hello')), destination=destination))
+
+    assert destination.getvalue() == b'HELLO'
+
+
+def test_AsyncTransfer_raises_with_no_destination(transf):
+    with pytest.raises(RuntimeError):
+        run(transf.save(FileStorage()))
+
+
+def test_AsyncTransfer_reports_to_listeners():
+    events = []
+
+    async def validate(fh, meta):
+        return True
+
+    transf = AsyncTransfer(destination=BytesIO(), validators=[validate],
+                           listeners=[events.append])
+    run(transf.save(FileStorage(stream=BytesIO(b'hello'), filename='a.txt')))
+
+    stops = [(e.stage, e.outcome) for e in events if e.phase == 'stop']
+    assert stops[0] == ('validator', 'ok')
+    assert stops[-1] == ('save', 'ok')
+    assert [e.nbytes for e in events if e.phase == 'stop' and e.stage == 'write'] == [5]
+
+
+def test_sync_callables_keep_request_context():
+    from flask import Flask, request
+    app = Flask(__name__)
+    transfer = AsyncTransfer()
+    seen = []
+
+    @transfer.validator
+    def remote_addr(filehandle, metadata):
+        seen.append(request.remote_addr)
+        return True
+
+    with app.test_request_context(environ_base={'REMOTE_ADDR': '1.1.1.1'}):
+        run(transfer.save(FileStorage(stream=BytesIO(b'x'), filename='a.txt'),
+                          destination=BytesIO()))
+    assert seen == ['1.1.1.1']
+
+
+def test_AsyncTransfer_save_many(transf):
+    from flask_transfer.validators import AllowedExts
+    transf.validator(AllowedExts('png'))
+    outs = {}
+
+    def destination(filehandle, metadata):
+        outs[filehandle.filename] = filehandle.stream.read()
+
+    files = [FileStorage(stream=BytesIO(b'a'), filename='a.png'),
+             FileStorage(stream=BytesIO(b'b'), filename='b.exe')]
+    results = run(transf.save_many(files, destination=destination, metadata={'x': 1}))
+
+    assert results[0].ok and results[0].metadata == {'x': 1}
+    assert isinstance(results[1].error, UploadError)
+    assert outs == {'a.png': b'a'}
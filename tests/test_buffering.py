@@ -0,0 +1,83 @@
+from flask import Flask
+from flask_transfer import buffering
+from werkzeug import FileStorage
+import pytest
+
+try:
+    from io import BytesIO
+except ImportError:
+    from StringIO import StringIO as BytesIO
+
+
+def upload(size):
+    return FileStorage(stream=BytesIO(b'x' * size), filename='upload.bin',
+                       content_length=size)
+
+
+@pytest.fixture
+def app():
+    return Flask(__name__)
+
+
+def test_buffer_size_for_prefers_metadata(app):
+    app.config['TRANSFER_BUFFER_SIZE'] = 8192
+    with app.app_context():
+        assert buffering.buffer_size_for(upload(10), {'buffer_size': 1}) == 1
+
+
+def test_buffer_size_for_uses_config(app):
+    app.config['TRANSFER_BUFFER_SIZE'] = 8192
+    with app.app_context():
+        assert buffering.buffer_size_for(upload(10), {}) == 8192
+
+
+def test_buffer_size_for_small_upload(monkeypatch):
+    monkeypatch.setattr(buffering, 'block_size', lambda path: 4096)
+    assert buffering.buffer_size_for(upload(10), {}, 'dest/file') == 4096
+
+
+def test_buffer_size_for_large_upload(monkeypatch):
+    monkeypatch.setattr(buffering, 'block_size', lambda path: 4096)
+    fh = FileStorage(stream=BytesIO(), content_length=10 ** 9)
+    assert buffering.buffer_size_for(fh, {}, 'dest/file') == buffering.MAX_BUFFER_SIZE
+
+
+def test_buffer_size_for_rounds_to_block_size(monkeypatch):
+    monkeypatch.setattr(buffering, 'block_size', lambda path: 4096)
+    assert buffering.buffer_size_for(upload(5000), {}, 'dest/file') == 8192
+
+
+def test_buffer_size_for_unknown_size(monkeypatch):
+    monkeypatch.setattr(buffering, 'block_size', lambda path: 4096)
+    fh = FileStorage(stream=BytesIO())
+    assert buffering.buffer_size_for(fh, {}, 'dest/file') == buffering.DEFAULT_CHUNK_SIZE
+
+
+def test_block_size_of_missing_path(tmpdir):
+    assert buffering.block_size(str(tmpdir.join('nope', 'nope'))) > 0
+
+
+def test_BufferTuner_explores_neighbours():
+    tuner = buffering.BufferTuner(explore_every=2)
+    suggested = [tuner.suggest(1000, 8192) for _ in range(4)]
+    assert suggested == [8192, 16384, 8192, 4096]
+
+
+def test_BufferTuner_keeps_fastest():
+    tuner = buffering.BufferTuner()
+    tuner.suggest(1000, 8192)
+    tuner.record(1000, 8192, 1000, 1.0)
+    tuner.record(1000, 16384, 1000, 0.5)
+    assert tuner.best(1000, None) == 16384
+    tuner.record(1000, 4096, 1000, 1.0)
+    assert tuner.best(1000, None) == 16384
+
+
+def test_buffered_copy_autotunes(app):
+    app.config['TRANSFER_BUFFER_AUTOTUNE'] = True
+    fh = upload(100)
+    with app.app_context():
+        buffering.buffered_copy(fh, {}, lambda size: fh.stream.read())
+        tuner = app.config['TRANSFER_BUFFER_TUNER']
+
+    assert tuner._throughput
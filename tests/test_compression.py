@@ -0,0 +1,106 @@
+from flask_transfer import compression
+from flask_transfer.compression import (CompressingDestination, CompressingStream,
+                                        choose_level, decompress_stream, get_codec,
+                                        open_compressed)
+from flask_transfer.destinations import AtomicFileDestination
+from flask_transfer.transfer import Transfer
+from werkzeug import FileStorage
+import gzip
+import os
+import pytest
+
+try:
+    from io import BytesIO
+except ImportError:
+    from StringIO import StringIO as BytesIO
+
+
+CSV = b''.join(b'%d,widget,%d.99\n' % (i, i % 100) for i in range(5000))
+PNG = b'\x89PNG\r\n\x1a\n' + os.urandom(1000)
+
+
+def upload(data=CSV, filename='report.csv', content_type='text/csv', **kwargs):
+    return FileStorage(stream=BytesIO(data), filename=filename, content_type=content_type,
+                       **kwargs)
+
+
+def test_gzip_always_available():
+    assert 'gzip' in compression.available_codecs()
+    assert get_codec(['nope', 'gzip']).name == 'gzip'
+    with pytest.raises(ValueError):
+        get_codec('nope')
+
+
+def test_CompressingStream_round_trips():
+    stream = CompressingStream(BytesIO(CSV), get_codec('gzip').compressor(6), chunk_size=1000)
+    compressed = b''.join(iter(lambda: stream.read(100), b''))
+
+    assert gzip.GzipFile(fileobj=BytesIO(compressed)).read() == CSV
+    assert stream.bytes_in == len(CSV) and stream.bytes_out == len(compressed)
+
+
+@pytest.mark.parametrize('codec', compression.available_codecs())
+def test_round_trip_every_codec(codec):
+    out, metadata = BytesIO(), {}
+    destination = CompressingDestination(out, codec=codec)
+    Transfer().save(upload(), destination=destination, metadata=metadata)
+
+    assert metadata['codec'] == codec
+    assert metadata['original_size'] == len(CSV)
+    assert metadata['compressed_size'] == len(out.getvalue()) < len(CSV) // 5
+    assert decompress_stream(BytesIO(out.getvalue()), codec).read() == CSV
+    assert decompress_stream(BytesIO(out.getvalue())).read() == CSV
+
+
+def test_choose_level():
+    gz = get_codec('gzip')
+    assert choose_level(upload(content_length=len(CSV)), {}, gz) == gz.best
+    assert choose_level(upload(), {}, gz) == gz.default
+    assert choose_level(upload(content_length=100 * 1024 * 1024), {}, gz) == gz.fast
+    assert choose_level(upload(b'\x00' * 10, 'a.bin', None), {}, gz) == gz.default
+    # the sniffed type wins over the client's
+    assert choose_level(upload(PNG, 'a.csv'), {}, gz) is None
+    assert choose_level(upload(b'<svg/>', 'a.svg', 'image/svg+xml', content_length=6), {},
+                        gz) == gz.best
+
+
+def test_already_compressed_stored_as_is():
+    out, metadata = BytesIO(), {}
+    fh = upload(PNG, 'image.png', 'image/png')
+    Transfer().save(fh, destination=CompressingDestination(out), metadata=metadata)
+
+    assert out.getvalue() == PNG
+    assert metadata['codec'] is None and fh.filename == 'image.png'
+    assert decompress_stream(BytesIO(PNG), None).read() == PNG
+
+
+def test_fixed_level():
+    metadata = {}
+    Transfer().save(upload(), destination=CompressingDestination(BytesIO(), 'gzip', level=1),
+                    metadata=metadata)
+    assert metadata['compression_level'] == 1
+
+
+def test_with_atomic_destination(tmpdir):
+    metadata = {}
+    destination = CompressingDestination(AtomicFileDestination(str(tmpdir)), codec='gzip')
+    Transfer(destination=destination).save(upload(), metadata=metadata)
+
+    assert metadata['path'] == str(tmpdir.join('report.csv.gz'))
+    with open_compressed(metadata['path'], metadata['codec']) as fh:
+        assert b''.join(fh) == CSV
+
+
+def gzipped(data):
+    compressor = get_codec('gzip').compressor(6)
+    return compressor.compress(data) + compressor.flush()
+
+
+def test_decompress_concatenated_members():
+    data = gzipped(b'hello ') + gzipped(b'world')
+    assert decompress_stream(BytesIO(data), 'gzip', chunk_size=4).read() == b'hello world'
+
+
+def test_decompress_unknown_format():
+    with pytest.raises(ValueError):
+        decompress_stream(BytesIO(b'plain text'))
@@ -0,0 +1,245 @@
+from flask_transfer import deferred
+from flask_transfer.transfer import Transfer
+from werkzeug import FileStorage
+import pytest
+import time
+
+try:
+    from io import BytesIO
+except ImportError:
+    from StringIO import StringIO as BytesIO
+
+
+calls = []
+
+
+def record(saved, metadata):
+    calls.append((saved.filename, metadata.get('step')))
+    metadata['step'] = 'recorded'
+
+
+def flaky(saved, metadata):
+    metadata['tries'] = metadata.get('tries', 0) + 1
+    calls.append(metadata['tries'])
+    if metadata['tries'] < 2:
+        raise ValueError('try again')
+
+
+def broken(saved, metadata):
+    raise ValueError('broken')
+
+
+def read_saved(saved, metadata):
+    with saved.stream as stream:
+        calls.append(stream.read())
+
+
+@pytest.fixture(autouse=True)
+def reset_calls():
+    del calls[:]
+
+
+@pytest.fixture
+def saved():
+    return deferred.SavedFile('test.txt', 'text/plain', None)
+
+
+def states(statuses):
+    return [(s.name, s.state) for s in statuses]
+
+
+def test_ThreadQueue_runs_steps_in_order(saved):
+    queue = deferred.ThreadQueue(backoff=0)
+    queue.submit('abc', [record, record], saved, {}).result()
+
+    assert calls == [('test.txt', None), ('test.txt', 'recorded')]
+    assert states(queue.status('abc')) == [('record', 'done'), ('record', 'done')]
+
+
+def test_ThreadQueue_retries(saved):
+    queue = deferred.ThreadQueue(backoff=0)
+    queue.submit('abc', [flaky], saved, {}).result()
+
+    assert calls == [1, 2]
+    assert queue.status('abc')[0].attempts == 2
+
+
+def test_ThreadQueue_gives_up_and_skips_the_rest(saved):
+    queue = deferred.ThreadQueue(retries=1, backoff=0)
+    queue.submit('abc', [broken, record], saved, {}).result()
+
+    statuses = queue.status('abc')
+    assert states(statuses) == [('broken', 'failed'), ('record', 'skipped')]
+    assert statuses[0].attempts == 2
+    assert 'broken' in statuses[0].error
+    assert calls == []
+
+
+def test_ThreadQueue_forget(saved):
+    queue = deferred.ThreadQueue()
+    queue.submit('abc', [record], saved, {}).result()
+    queue.forget('abc')
+    assert queue.status('abc') == []
+
+
+def test_ThreadQueue_forgets_oldest_finished(saved):
+    queue = deferred.ThreadQueue(keep_finished=2, backoff=0)
+    for upload_id in ['a', 'b', 'c']:
+        queue.submit(upload_id, [record], saved, {}).result()
+
+    assert queue.status('a') == []
+    assert states(queue.status('b')) == states(queue.status('c')) == [('record', 'done')]
+
+
+def test_ProcessQueue_runs_steps(saved):
+    queue = deferred.ProcessQueue(max_workers=1, backoff=0)
+    try:
+        queue.submit('abc', [flaky, record], saved, {}).result()
+    finally:
+        queue.shutdown()
+
+    assert states(queue.status('abc')) == [('flaky', 'done'), ('record', 'done')]
+    assert queue.status('abc')[0].attempts == 2
+
+
+@pytest.fixture
+def sqlite_queue(tmpdir):
+    return deferred.SQLiteQueue(str(tmpdir.join('deferred.db')), backoff=0)
+
+
+def test_SQLiteQueue_runs_steps_in_order(sqlite_queue, saved):
+    sqlite_queue.submit('abc', [record, record], saved, {'step': 'start'})
+    assert states(sqlite_queue.status('abc')) == [('record', 'pending'),
+                                                  ('record', 'pending')]
+
+    while sqlite_queue.process_once():
+        pass
+
+    assert calls == [('test.txt', 'start'), ('test.txt', 'recorded')]
+    assert states(sqlite_queue.status('abc')) == [('record', 'done'), ('record', 'done')]
+
+
+def test_SQLiteQueue_retries_then_fails(sqlite_queue, saved):
+    sqlite_queue.retries = 1
+    sqlite_queue.submit('abc', [broken, record], saved, {})
+
+    assert sqlite_queue.process_once()
+    assert sqlite_queue.status('abc')[0].state == 'retrying'
+    assert sqlite_queue.process_once()
+    assert not sqlite_queue.process_once()
+
+    statuses = sqlite_queue.status('abc')
+    assert states(statuses) == [('broken', 'failed'), ('record', 'skipped')]
+    assert statuses[0].attempts == 2
+
+
+def test_SQLiteQueue_survives_restarts(tmpdir, saved):
+    path = str(tmpdir.join('deferred.db'))
+    deferred.SQLiteQueue(path).submit('abc', [record], saved, {})
+
+    assert deferred.SQLiteQueue(path).process_once()
+    assert calls == [('test.txt', None)]
+
+
+def test_SQLiteQueue_retakes_expired_leases(sqlite_queue, saved):
+    sqlite_queue.lease = -1
+    sqlite_queue.submit('abc', [record], saved, {})
+    # a worker claims it and dies
+    sqlite_queue._claim()
+
+    assert sqlite_queue.process_once()
+    assert sqlite_queue.status('abc')[0].state == 'done'
+
+
+def test_SQLiteQueue_gives_up_on_steps_that_crash_workers(sqlite_queue, saved):
+    sqlite_queue.lease = -1
+    sqlite_queue.retries = 1
+    sqlite_queue.submit('abc', [record, record], saved, {})
+    # two workers claim it and die
+    sqlite_queue._claim()
+    sqlite_queue._claim()
+
+    assert not sqlite_queue.process_once()
+    statuses = sqlite_queue.status('abc')
+    assert states(statuses) == [('record', 'failed'), ('record', 'skipped')]
+    assert statuses[0].attempts == 2 and calls == []
+
+
+def test_SQLiteQueue_refuses_unimportable_steps(sqlite_queue, saved):
+    with pytest.raises(ValueError):
+        sqlite_queue.submit('abc', [lambda saved, meta: None], saved, {})
+
+
+def test_SQLiteQueue_reports_unserializable_metadata(sqlite_queue, saved):
+    sqlite_queue.submit('abc', [record, record], saved, {'when': object()})
+
+    assert not sqlite_queue.process_once()
+    statuses = sqlite_queue.status('abc')
+    assert states(statuses) == [('record', 'failed'), ('record', 'skipped')]
+    assert 'TypeError' in statuses[0].error
+
+
+def test_SQLiteQueue_workers(sqlite_queue, saved):
+    sqlite_queue.poll_interval = 0.01
+    sqlite_queue.start()
+    try:
+        sqlite_queue.submit('abc', [record], saved, {})
+        for _ in range(500):
+            if sqlite_queue.status('abc')[0].state == 'done':
+                break
+            time.sleep(0.01)
+    finally:
+        sqlite_queue.stop()
+
+    assert sqlite_queue.status('abc')[0].state == 'done'
+
+
+def test_Transfer_deferred_postprocessor(tmpdir):
+    queue = deferred.ThreadQueue(backoff=0)
+    transf = Transfer(deferred_queue=queue)
+    transf.postprocessor(read_saved, deferred=True)
+
+    @transf.postprocessor(deferred=True)
+    def not_inline(saved, metadata):
+        pass
+
+    metadata = {}
+    target = str(tmpdir.join('test.txt'))
+    transf.save(FileStorage(stream=BytesIO(b'hello'), filename='test.txt'),
+                destination=target, metadata=metadata)
+    queue.shutdown()
+
+    assert transf._postprocessors == []
+    assert calls == [b'hello']
+    assert states(transf.deferred_status(metadata['upload_id'])) == [
+        ('read_saved', 'done'), ('not_inline', 'done')]
+
+
+def test_Transfer_creates_one_default_queue():
+    import threading
+
+    transf = Transfer()
+    queues = []
+    barrier = threading.Barrier(8)
+
+    def first_deferral():
+        barrier.wait()
+        queues.append(transf.deferred_queue)
+
+    threads = [threading.Thread(target=first_deferral) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(set(map(id, queues))) == 1
+
+
+def test_Transfer_without_deferred_postprocessors_doesnt_queue():
+    transf = Transfer(destination=BytesIO())
+    metadata = {}
+    transf.save(FileStorage(stream=BytesIO(b'hello'), filename='test.txt'),
+                metadata=metadata)
+
+    assert 'upload_id' not in metadata
+    assert transf._deferred_queue is None
@@ -0,0 +1,304 @@
+from flask_transfer import transfer
+from flask_transfer import destinations
+from werkzeug import FileStorage
+import hashlib
+import os
+import pytest
+
+try:
+    from io import BytesIO
+except ImportError:
+    from StringIO import StringIO as BytesIO
+
+
+def upload(data, filename='upload.txt'):
+    return FileStorage(stream=BytesIO(data), filename=filename)
+
+
+@pytest.fixture
+def cas(tmpdir):
+    return destinations.ContentAddressedDestination(str(tmpdir.join('blobs')),
+                                                    names=str(tmpdir.join('names')))
+
+
+def test_ContentAddressed_stores_by_digest(cas):
+    meta = {}
+    cas(upload(b'hello world'), meta)
+    digest = hashlib.sha256(b'hello world').hexdigest()
+
+    assert meta['digest'] == digest and not meta['duplicate']
+    assert meta['path'] == cas.path_for(digest)
+    with open(meta['path'], 'rb') as fh:
+        assert fh.read() == b'hello world'
+
+
+def test_ContentAddressed_dedups(cas, tmpdir):
+    first, second = {}, {}
+    cas(upload(b'hello world', 'a.txt'), first)
+    cas(upload(b'hello world', 'b.txt'), second)
+
+    assert second['duplicate']
+    assert cas.refcount(first['digest']) == 2
+    assert os.path.samefile(str(tmpdir.join('names', 'a.txt')),
+                            str(tmpdir.join('names', 'b.txt')))
+    assert len(tmpdir.join('blobs').listdir()) == 1
+
+
+def test_ContentAddressed_release(cas):
+    meta = {}
+    cas(upload(b'hello', 'a.txt'), meta)
+    cas(upload(b'hello', 'b.txt'), {})
+
+    assert not cas.release(meta['digest'], 'a.txt')
+    assert cas.release(meta['digest'], 'b.txt')
+    assert not cas.has(meta['digest'])
+
+
+def test_ContentAddressed_renamed_blob_loses_reference(cas, tmpdir):
+    first, second = {}, {}
+    cas(upload(b'first', 'a.txt'), first)
+    cas(upload(b'second', 'a.txt'), second)
+
+    assert tmpdir.join('names', 'a.txt').read_binary() == b'second'
+    # nothing named the first blob any more
+    assert not cas.has(first['digest'])
+    assert cas.refcount(second['digest']) == 1
+
+
+def test_ContentAddressed_release_keeps_relinked_name(cas, tmpdir):
+    first, second = {}, {}
+    cas(upload(b'first', 'a.txt'), first)
+    cas(upload(b'first', 'b.txt'), {})
+    cas(upload(b'second', 'a.txt'), second)
+
+    # a.txt points at the second blob now, so releasing the first leaves it
+    assert not cas.release(first['digest'], 'a.txt')
+    assert tmpdir.join('names', 'a.txt').read_binary() == b'second'
+    assert cas.refcount(first['digest']) == 1
+
+
+def test_ContentAddressed_secures_link_names(cas, tmpdir):
+    cas(upload(b'hello', '../../escape.txt'), {})
+    assert tmpdir.join('names', 'escape.txt').check()
+    assert not tmpdir.join('escape.txt').check()
+
+
+def test_ContentAddressed_blobs_get_default_permissions(cas):
+    meta = {}
+    cas(upload(b'hello'), meta)
+    assert os.stat(meta['path']).st_mode & 0o777 == 0o666 & ~destinations._UMASK
+
+
+def test_ContentAddressed_skips_known_client_digest(tmpdir):
+    cas = destinations.ContentAddressedDestination(str(tmpdir), trust_client_digest=True)
+    digest = hashlib.sha256(b'hello').hexdigest()
+    cas(upload(b'hello'), {})
+
+    filehandle = upload(b'hello')
+    meta = {'expected_digest': digest}
+    cas(filehandle, meta)
+
+    assert meta['duplicate'] and meta['digest'] == digest
+    assert filehandle.stream.tell() == 0
+
+
+def test_ContentAddressed_ignores_client_digest_by_default(tmpdir):
+    cas = destinations.ContentAddressedDestination(str(tmpdir))
+    cas(upload(b'hello'), {})
+    meta = {'expected_digest': hashlib.sha256(b'hello').hexdigest()}
+    cas(upload(b'goodbye'), meta)
+
+    assert meta['digest'] == hashlib.sha256(b'goodbye').hexdigest()
+
+
+def test_ContentAddressed_as_Transfer_destination(cas):
+    t = transfer.Transfer(destination=cas)
+    t.transformer(lambda fh, meta: lambda chunk: chunk.upper())
+    meta = {}
+    t.save(upload(b'hello'), metadata=meta)
+
+    assert meta['digest'] == hashlib.sha256(b'HELLO').hexdigest()
+
+
+def test_AtomicFileDestination_renames_on_commit(tmpdir):
+    path = tmpdir.join('report.txt')
+    atomic = destinations.AtomicFileDestination(str(path))
+    pending = atomic(upload(b'hello'), {})
+
+    assert not path.exists()
+    assert len(tmpdir.listdir()) == 1
+
+    pending.commit()
+    assert path.read_binary() == b'hello'
+    assert tmpdir.listdir() == [path]
+
+
+def test_AtomicFileDestination_rolls_back(tmpdir):
+    atomic = destinations.AtomicFileDestination(str(tmpdir))
+    atomic(upload(b'hello', 'a.txt'), {}).rollback()
+
+    assert tmpdir.listdir() == []
+
+
+def test_AtomicFileDestination_secures_filename_and_permissions(tmpdir):
+    root = tmpdir.mkdir('uploads')
+    atomic = destinations.AtomicFileDestination(str(root))
+    meta = {}
+    atomic(upload(b'hello', '../escape.txt'), meta).commit()
+
+    assert meta['path'] == str(root.join('escape.txt'))
+    assert os.stat(meta['path']).st_mode & 0o777 == 0o666 & ~destinations._UMASK
+
+
+def test_AtomicFileDestination_with_Transfer(tmpdir):
+    t = transfer.Transfer(destination=destinations.AtomicFileDestination(str(tmpdir)))
+    t.save(upload(b'hello', 'good.txt'))
+
+    @t.postprocessor
+    def explode(filehandle, meta):
+        raise RuntimeError('thumbnailer broke')
+
+    with pytest.raises(RuntimeError):
+        t.save(upload(b'hello', 'bad.txt'))
+
+    assert [p.basename for p in tmpdir.listdir()] == ['good.txt']
+
+
+def test_AtomicFileDestination_rolls_back_on_rejected_stream(tmpdir):
+    from flask_transfer import UploadError
+
+    def reject_at_end(fh, meta):
+        def consume(chunk):
+            if not chunk:
+                raise UploadError('checksum mismatch')
+        return consume
+
+    t = transfer.Transfer(destination=destinations.AtomicFileDestination(str(tmpdir)),
+                          consumers=[reject_at_end])
+    with pytest.raises(UploadError):
+        t.save(upload(b'hello', 'a.txt'))
+
+    assert tmpdir.listdir() == []
+
+
+def test_GroupCommit_batches_directory_syncs(tmpdir):
+    import threading
+
+    group = destinations.GroupCommit(window=0.05)
+    atomic = destinations.AtomicFileDestination(str(tmpdir), group_commit=group)
+    t = transfer.Transfer(destination=atomic)
+    synced = []
+    flush = group._flush
+
+    def recording_flush(files, directories):
+        synced.append((len(files), len(directories)))
+        flush(files, directories)
+    group._flush = recording_flush
+
+    threads = [threading.Thread(target=t.save, args=(upload(b'x', '{0}.txt'.format(i)),))
+               for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(tmpdir.listdir()) == 8
+    assert sum(files for files, _ in synced) == 8
+    assert len(synced) < 16
+
+
+def test_GroupCommit_reports_failures(tmpdir):
+    group = destinations.GroupCommit(window=0)
+    closed = os.open(str(tmpdir.join('closed')), os.O_CREAT | os.O_WRONLY)
+    os.close(closed)
+
+    with pytest.raises(OSError):
+        group.sync(files=[closed])
+
+    group.sync()
+    assert not group._failures and not group._waiting
+
+
+def test_copy_to_path_copies_rest_of_real_file(tmpdir):
+    source = tmpdir.join('source').open('w+b')
+    source.write(b'headerbody')
+    source.seek(6)
+    target = str(tmpdir.join('target'))
+
+    assert destinations.copy_to_path(source, target)
+    assert source.tell() == 10
+    with open(target, 'rb') as fh:
+        assert fh.read() == b'body'
+
+
+def test_copy_to_path_refuses_memory_streams(tmpdir):
+    target = tmpdir.join('target')
+    assert not destinations.copy_to_path(BytesIO(b'hello'), str(target))
+    assert not target.exists()
+
+
+def test_copy_to_path_doesnt_roll_spooled_file(tmpdir):
+    import tempfile
+    source = tempfile.SpooledTemporaryFile(max_size=1024)
+    source.write(b'hello')
+    source.seek(0)
+
+    assert not destinations.copy_to_path(source, str(tmpdir.join('target')))
+    assert not source._rolled
+
+
+def test_copy_to_path_hardlinks(tmpdir):
+    path = tmpdir.join('source')
+    path.write_binary(b'hello')
+    target = str(tmpdir.join('target'))
+
+    with path.open('rb') as source:
+        assert destinations.copy_to_path(source, target, hardlink=True)
+
+    assert os.path.samefile(str(path), target)
+
+
+def test_copy_to_file_falls_back_when_unsupported(tmpdir, monkeypatch):
+    import errno
+
+    def unsupported(src, dst, offset, count):
+        raise OSError(errno.EXDEV, 'cross device')
+
+    monkeypatch.setattr(destinations, '_KERNEL_COPIES',
+                        [unsupported, destinations._pread_write])
+    source = tmpdir.join('source').open('w+b')
+    source.write(b'hello')
+    source.seek(0)
+
+    with tmpdir.join('target').open('wb') as out:
+        assert destinations.copy_to_file(source, out)
+    assert tmpdir.join('target').read_binary() == b'hello'
+
+
+def test_AtomicFile_copies_real_files(tmpdir):
+    source = tmpdir.join('source').open('w+b')
+    source.write(b'hello world')
+    source.seek(0)
+    dest = destinations.AtomicFileDestination(str(tmpdir.join('out.txt')), fsync=False)
+
+    pending = dest(FileStorage(stream=source, filename='out.txt'), {})
+    pending.commit()
+
+    assert tmpdir.join('out.txt').read_binary() == b'hello world'
+
+
+def test_AtomicFile_checks_for_real_file_once(tmpdir, monkeypatch):
+    calls = []
+    copy_to_file = destinations.copy_to_file
+
+    def counting_copy(stream, out):
+        calls.append(stream)
+        return copy_to_file(stream, out)
+    monkeypatch.setattr(destinations, 'copy_to_file', counting_copy)
+
+    dest = destinations.AtomicFileDestination(str(tmpdir.join('out.txt')), fsync=False,
+                                              buffer_size=2)
+    dest(upload(b'hello world'), {}).commit()
+
+    assert len(calls) == 1
+    assert tmpdir.join('out.txt').read_binary() == b'hello world'
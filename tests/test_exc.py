@@ -0,0 +1,102 @@
+from flask_transfer import UploadError, transfer, validators
+import pickle
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+
+class DummyFile(object):
+    def __init__(self, filename):
+        self.filename = filename
+
+
+def test_UploadError_plain_message():
+    error = UploadError('something bad happened')
+
+    assert str(error) == 'something bad happened'
+    assert error.args == ('something bad happened',)
+    assert error.reason is None and error.errors == []
+
+
+def test_UploadError_message_is_lazy():
+    render = mock.Mock(return_value='rendered')
+    error = UploadError(render, reason='returned_false')
+
+    assert not render.called
+    assert str(error) == 'rendered'
+    assert error.args[0] == 'rendered'
+    assert render.call_count == 1
+
+
+def test_UploadError_nested_errors():
+    error = UploadError(errors=[UploadError('one'), UploadError(['two', 'three'])])
+
+    assert error.args[0] == ['one', ['two', 'three']]
+
+
+def test_UploadError_to_dict():
+    allowed = validators.AllowedExts('png')
+    error = UploadError(errors=[UploadError('nope', reason='invalid_extension',
+                                            validator=allowed, filename='a.exe')],
+                        reason='multiple', filename='a.exe')
+
+    assert error.to_dict() == {
+        'reason': 'multiple', 'filename': 'a.exe', 'validator': None,
+        'message': "['nope']",
+        'errors': [{'reason': 'invalid_extension', 'filename': 'a.exe',
+                    'validator': 'AllowedExts', 'message': 'nope', 'errors': []}]
+    }
+
+
+def test_UploadError_pickles():
+    error = pickle.loads(pickle.dumps(UploadError('nope', reason='too_large', filename='a')))
+
+    assert str(error) == 'nope' and error.reason == 'too_large' and error.filename == 'a'
+
+
+def test_validator_failures_dont_repr_until_needed():
+    class Expensive(validators.BaseValidator):
+        reprs = 0
+
+        def _validate(self, filehandle, metadata):
+            return False
+
+        def __repr__(self):
+            Expensive.reprs += 1
+            return 'Expensive'
+
+    t = transfer.Transfer(validators=[validators.AndValidator(Expensive())])
+
+    try:
+        t._validate(DummyFile('a.png'), {})
+    except UploadError as e:
+        error = e
+
+    assert Expensive.reprs == 0
+    assert error.reason == 'returned_false'
+    assert error.filename == 'a.png'
+    assert 'Expensive' in str(error)
+
+
+def test_validators_report_reasons():
+    cases = [(validators.AllowedExts('png'), 'invalid_extension'),
+             (~validators.AllowAll(), 'negated'),
+             (validators.AllowedExts('png') | validators.AllowedExts('jpg'), 'no_match')]
+
+    for validator, reason in cases:
+        try:
+            validator(DummyFile('a.exe'), {})
+        except UploadError as e:
+            assert e.reason == reason
+            assert e.validator is validator
+
+
+def test_TransferBusy_is_a_503_with_retry_after():
+    from flask_transfer import TransferBusy
+    error = TransferBusy(retry_after=1.5)
+
+    assert error.code == 503
+    assert ('Retry-After', '2') in error.get_headers()
+    assert ('Retry-After', '2') not in TransferBusy().get_headers()
@@ -0,0 +1,104 @@
+from base64 import b64encode
+from flask import Flask
+from flask_transfer import UploadError
+from flask_transfer.destinations import AtomicFileDestination
+from flask_transfer.hashing import Digests, expected_digests
+from flask_transfer.transfer import Transfer
+from werkzeug import FileStorage
+from werkzeug.datastructures import Headers
+import hashlib
+import pytest
+
+try:
+    from io import BytesIO
+except ImportError:
+    from StringIO import StringIO as BytesIO
+
+
+DATA = b'hello world' * 1000
+MD5 = hashlib.md5(DATA).hexdigest()
+SHA256 = hashlib.sha256(DATA).hexdigest()
+
+
+def b64(digest):
+    return b64encode(bytes(bytearray.fromhex(digest))).decode('ascii')
+
+
+def upload(headers=None):
+    return FileStorage(stream=BytesIO(DATA), filename='hello.txt',
+                       headers=Headers(headers or []))
+
+
+def test_Digests_computes_during_write():
+    transfer = Transfer(consumers=[Digests('md5', 'sha256')], chunk_size=1024)
+    out, metadata = BytesIO(), {}
+    transfer.save(upload(), destination=out, metadata=metadata)
+
+    assert out.getvalue() == DATA
+    assert metadata['digests'] == {'md5': MD5, 'sha256': SHA256}
+
+
+def test_Digests_available_to_postprocessors():
+    seen = []
+    transfer = Transfer(consumers=[Digests(key='checksums')])
+
+    @transfer.postprocessor
+    def record(filehandle, metadata):
+        seen.append(metadata['checksums'])
+        return filehandle
+
+    transfer.save(upload(), destination=BytesIO())
+    assert seen == [{'sha256': SHA256}]
+
+
+def test_Digests_rejects_unknown_algorithms():
+    with pytest.raises(ValueError):
+        Digests('nope')
+    with pytest.raises(TypeError):
+        Digests('md5', verfiy=True)
+
+
+def test_expected_digests_from_headers():
+    filehandle = upload([('Content-MD5', b64(MD5)),
+                         ('Content-Digest', 'sha-256=:{0}:, unknown=abc'.format(b64(SHA256)))])
+    assert expected_digests(filehandle, {}) == {'md5': MD5, 'sha256': SHA256}
+
+
+def test_expected_digests_prefers_metadata():
+    filehandle = upload([('Digest', 'MD5=' + b64(MD5))])
+    assert expected_digests(filehandle, {'expected_digests': {'md5': 'ABC'}}) == {'md5': 'abc'}
+
+
+def test_expected_digests_from_request_body_only():
+    app = Flask(__name__)
+    headers = {'Digest': 'sha-256=' + b64(SHA256)}
+
+    with app.test_request_context('/', method='PUT', data=DATA, headers=headers,
+                                  content_type='application/octet-stream'):
+        assert expected_digests(upload(), {}) == {'sha256': SHA256}
+
+    with app.test_request_context('/', method='POST', headers=headers,
+                                  data={'file': (BytesIO(DATA), 'hello.txt')}):
+        assert expected_digests(upload(), {}) == {}
+
+
+def test_Digests_verifies():
+    transfer = Transfer(consumers=[Digests('sha256', verify=True)])
+    metadata = {}
+    transfer.save(upload([('Content-MD5', b64(MD5))]), destination=BytesIO(),
+                  metadata=metadata)
+
+    # md5 was computed too, to check it
+    assert metadata['digests'] == {'md5': MD5, 'sha256': SHA256}
+
+
+def test_Digests_mismatch_rolls_back(tmpdir):
+    transfer = Transfer(consumers=[Digests(verify=True)])
+    wrong = hashlib.md5(b'something else').hexdigest()
+
+    with pytest.raises(UploadError) as excinfo:
+        transfer.save(upload([('Content-MD5', b64(wrong))]),
+                      destination=AtomicFileDestination(str(tmpdir)))
+
+    assert excinfo.value.reason == 'digest_mismatch'
+    assert tmpdir.listdir() == []
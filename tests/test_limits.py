@@ -0,0 +1,215 @@
+from flask_transfer.aio import AsyncTransfer
+from flask_transfer.exc import TransferBusy
+from flask_transfer.limits import ConcurrencyLimiter, LimitedDestination
+from flask_transfer.metrics import HistogramCollector, prometheus_text
+from flask_transfer.transfer import Transfer
+from werkzeug import FileStorage
+import asyncio
+import threading
+import pytest
+
+try:
+    from io import BytesIO
+except ImportError:
+    from StringIO import StringIO as BytesIO
+
+
+def upload(size=10, filename='test.txt'):
+    return FileStorage(stream=BytesIO(b'x' * size), filename=filename,
+                       content_length=size)
+
+
+def test_grants_up_to_max_saves():
+    limiter = ConcurrencyLimiter(max_saves=2, timeout=0)
+    first, second = limiter.acquire(upload()), limiter.acquire(upload())
+    assert limiter.in_flight == 2
+
+    with pytest.raises(TransferBusy):
+        limiter.acquire(upload())
+    assert limiter.rejected == 1
+
+    first.release()
+    first.release()
+    assert limiter.in_flight == 1
+    with limiter.acquire(upload()):
+        assert limiter.in_flight == 2
+    second.release()
+    assert limiter.in_flight == 0
+
+
+def test_limits_bytes_in_flight():
+    limiter = ConcurrencyLimiter(max_bytes=100, timeout=0)
+    slot = limiter.acquire(upload(60))
+    assert limiter.bytes_in_flight == 60
+    with pytest.raises(TransferBusy):
+        limiter.acquire(upload(50))
+    limiter.acquire(upload(40)).release()
+    slot.release()
+
+    # too big to ever fit, but let in on its own
+    limiter.acquire(upload(500)).release()
+
+
+def test_busy_sets_retry_after():
+    limiter = ConcurrencyLimiter(max_saves=1, timeout=0.01, retry_after=7)
+    slot = limiter.acquire(upload())
+    with pytest.raises(TransferBusy) as excinfo:
+        limiter.acquire(upload())
+    slot.release()
+
+    response = excinfo.value.get_response()
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '7'
+    assert limiter.queued == 0
+
+
+def test_queue_full():
+    limiter = ConcurrencyLimiter(max_saves=1, max_queue=1)
+    held = limiter.acquire(upload())
+    waiting = limiter.request(upload())
+    assert not waiting.granted and limiter.queued == 1
+
+    with pytest.raises(TransferBusy):
+        limiter.request(upload())
+
+    held.release()
+    assert waiting.wait(1)
+    waiting.release()
+
+
+def test_waiters_granted_in_turn():
+    limiter = ConcurrencyLimiter(max_saves=1)
+    held = limiter.acquire(upload())
+    order = []
+
+    def save(n):
+        with limiter.acquire(upload()):
+            order.append(n)
+
+    threads = []
+    for n in range(3):
+        thread = threading.Thread(target=save, args=(n,))
+        thread.start()
+        threads.append(thread)
+        while limiter.queued <= n:
+            pass
+
+    held.release()
+    for thread in threads:
+        thread.join(1)
+    assert order == [0, 1, 2]
+
+
+def test_large_uploads_not_starved():
+    limiter = ConcurrencyLimiter(max_saves=1, small_upload=100, large_every=2)
+    held = limiter.acquire(upload())
+    large = limiter.request(upload(1000))
+    small = [limiter.request(upload()) for _ in range(4)]
+
+    granted = []
+    current = held
+    for _ in range(5):
+        current.release()
+        current = next(slot for slot in [large] + small
+                       if slot.granted and not slot.released)
+        granted.append('large' if current is large else 'small')
+    current.release()
+
+    # the held slot counts towards the streak of small uploads
+    assert granted == ['small', 'large', 'small', 'small', 'small']
+
+
+def test_publishes_gauges():
+    collector = HistogramCollector()
+    limiter = ConcurrencyLimiter(max_saves=1, small_upload=100, collector=collector,
+                                 name='images')
+    held = limiter.acquire(upload(10))
+    limiter.request(upload(1000))
+
+    text = prometheus_text(collector)
+    assert 'flask_transfer_limiter_queue_depth{limiter="images",size="large"} 1' in text
+    assert 'flask_transfer_limiter_queue_depth{limiter="images",size="small"} 0' in text
+    assert 'flask_transfer_limiter_saves_in_flight{limiter="images"} 1' in text
+    assert 'flask_transfer_limiter_bytes_in_flight{limiter="images"} 10' in text
+
+    held.release()
+    text = prometheus_text(collector)
+    assert 'flask_transfer_limiter_bytes_in_flight{limiter="images"} 1000' in text
+
+
+def test_transfer_releases_after_save():
+    limiter = ConcurrencyLimiter(max_saves=1, timeout=0)
+    transfer = Transfer(limiter=limiter)
+    seen = []
+
+    @transfer.preprocessor
+    def record(filehandle, metadata):
+        seen.append(limiter.in_flight)
+        return filehandle
+
+    transfer.save(upload(), destination=BytesIO())
+    assert seen == [1] and limiter.in_flight == 0
+
+    @transfer.postprocessor
+    def explode(filehandle, metadata):
+        raise RuntimeError('nope')
+
+    with pytest.raises(RuntimeError):
+        transfer.save(upload(), destination=BytesIO())
+    assert limiter.in_flight == 0
+
+
+def test_transfer_reports_queue_stage():
+    limiter = ConcurrencyLimiter(max_saves=1)
+    events = []
+    Transfer(limiter=limiter, listeners=[events.append]).save(upload(), destination=BytesIO())
+    stages = [e.stage for e in events if e.phase == 'stop']
+    assert stages.index('validate') < stages.index('queue') < stages.index('preprocess')
+
+
+def test_limited_destination():
+    limiter = ConcurrencyLimiter(max_saves=1, timeout=0)
+    out = BytesIO()
+    destination = LimitedDestination(out, limiter)
+    Transfer(destination=destination).save(upload(3))
+    assert out.getvalue() == b'xxx'
+
+    held = limiter.acquire(upload())
+    with pytest.raises(TransferBusy):
+        Transfer(destination=destination).save(upload())
+    held.release()
+
+
+def test_async_transfer_waits_on_the_loop():
+    limiter = ConcurrencyLimiter(max_saves=1)
+    transfer = AsyncTransfer(limiter=limiter)
+    outs = [BytesIO() for _ in range(3)]
+
+    async def main():
+        await asyncio.gather(*[transfer.save(upload(4), destination=out) for out in outs])
+
+    asyncio.run(main())
+    assert [out.getvalue() for out in outs] == [b'xxxx'] * 3
+    assert limiter.in_flight == 0 and limiter.queued == 0
+
+
+def test_async_transfer_times_out():
+    limiter = ConcurrencyLimiter(max_saves=1, timeout=0.01)
+    held = limiter.acquire(upload())
+
+    with pytest.raises(TransferBusy):
+        asyncio.run(AsyncTransfer(limiter=limiter).save(upload(), destination=BytesIO()))
+    held.release()
+    assert limiter.queued == 0
+
+
+def test_cancel_after_grant_still_releases():
+    limiter = ConcurrencyLimiter(max_saves=1)
+    held = limiter.acquire(upload())
+    waiting = limiter.request(upload())
+    held.release()
+
+    # granted by the release, so cancelling is too late
+    assert waiting.granted and not waiting.cancel()
+    waiting.release()
+    assert limiter.in_flight == 0
@@ -0,0 +1,154 @@
+from flask import Flask
+from flask_transfer import UploadError, metrics
+from flask_transfer.transfer import Transfer
+from werkzeug import FileStorage
+import pytest
+
+try:
+    from io import BytesIO
+except ImportError:
+    from StringIO import StringIO as BytesIO
+
+
+def upload(data=b'hello world', filename='test.txt'):
+    return FileStorage(stream=BytesIO(data), filename=filename)
+
+
+def passing(fh, meta):
+    return True
+
+
+def failing(fh, meta):
+    return False
+
+
+def rejecting(fh, meta):
+    raise UploadError('nope')
+
+
+@pytest.fixture
+def events():
+    return []
+
+
+@pytest.fixture
+def transf(events):
+    return Transfer(destination=BytesIO(), validators=[passing],
+                    preprocessors=[lambda fh, meta: fh],
+                    postprocessors=[lambda fh, meta: fh],
+                    listeners=[events.append])
+
+
+def stops(events):
+    return [(e.stage, e.name, e.outcome) for e in events if e.phase == 'stop']
+
+
+def test_listener_sees_every_stage(transf, events):
+    transf.save(upload())
+
+    assert stops(events) == [
+        ('validator', 'passing', 'ok'),
+        ('validate', 'validate', 'ok'),
+        ('preprocessor', '<lambda>', 'ok'),
+        ('preprocess', 'preprocess', 'ok'),
+        ('write', 'write', 'ok'),
+        ('postprocessor', '<lambda>', 'ok'),
+        ('postprocess', 'postprocess', 'ok'),
+        ('commit', 'commit', 'ok'),
+        ('save', 'save', 'ok'),
+    ]
+    assert [e.stage for e in events if e.phase == 'start'][:2] == ['save', 'validate']
+
+
+def test_listener_gets_durations_and_bytes(transf, events):
+    transf.save(upload())
+    write = [e for e in events if e.phase == 'stop' and e.stage == 'write'][0]
+
+    assert write.nbytes == 11
+    assert write.elapsed >= 0
+    assert write.filename == 'test.txt'
+
+
+def test_listener_sees_falsey_validator_as_rejected(events):
+    transf = Transfer(destination=BytesIO(), validators=[failing],
+                      listeners=[events.append])
+
+    with pytest.raises(UploadError):
+        transf.save(upload())
+
+    assert stops(events) == [('validator', 'failing', 'rejected'),
+                             ('validate', 'validate', 'rejected'),
+                             ('save', 'save', 'rejected')]
+
+
+def test_listener_sees_errors(events):
+    def broken(fh, meta):
+        raise ValueError('broken')
+
+    transf = Transfer(destination=broken, listeners=[events.append])
+
+    with pytest.raises(ValueError):
+        transf.save(upload())
+
+    write = [e for e in events if e.phase == 'stop' and e.stage == 'write'][0]
+    assert write.outcome == 'error' and isinstance(write.error, ValueError)
+
+
+def test_listener_decorator():
+    transf = Transfer(destination=BytesIO())
+
+    @transf.listener
+    def listen(event):
+        pass
+
+    assert transf._listeners == [listen]
+
+
+def test_HistogramCollector_buckets():
+    collector = metrics.HistogramCollector(buckets=(0.1, 1.0))
+    transf = Transfer(destination=BytesIO(), validators=[passing, rejecting],
+                      listeners=[collector])
+    transf.save(upload(), validate=False)
+    with pytest.raises(UploadError):
+        transf.save(upload())
+
+    assert collector.count('save') == 2
+    assert collector.count('save', outcome='rejected') == 1
+    assert collector.count('validator', 'rejecting') == 1
+    assert collector.total_bytes() == 11
+    assert collector.quantile('save', 0.5) == 0.1
+
+
+def test_prometheus_text():
+    collector = metrics.HistogramCollector(buckets=(0.1, 1.0))
+    collector(metrics.TransferEvent('stop', 'write', 'write', 'a.txt', 0.5, 10, 'ok', None))
+    collector.set_gauge('queue_depth', 3, pool='default')
+    text = metrics.prometheus_text(collector)
+
+    labels = 'stage="write",name="write",outcome="ok"'
+    assert '# TYPE flask_transfer_stage_duration_seconds histogram' in text
+    assert 'flask_transfer_stage_duration_seconds_bucket{%s,le="0.1"} 0' % labels in text
+    assert 'flask_transfer_stage_duration_seconds_bucket{%s,le="1.0"} 1' % labels in text
+    assert 'flask_transfer_stage_duration_seconds_bucket{%s,le="+Inf"} 1' % labels in text
+    assert 'flask_transfer_stage_duration_seconds_count{%s} 1' % labels in text
+    assert 'flask_transfer_bytes_total{stage="write",name="write"} 10' in text
+    assert 'flask_transfer_queue_depth{pool="default"} 3' in text
+
+
+def test_prometheus_text_escapes_labels():
+    collector = metrics.HistogramCollector()
+    collector(metrics.TransferEvent('stop', 'validator', 'say "hi"', None, 0.1, None,
+                                    'ok', None))
+    assert 'name="say \\"hi\\""' in metrics.prometheus_text(collector)
+
+
+def test_metrics_view():
+    app = Flask(__name__)
+    collector = metrics.HistogramCollector()
+    app.add_url_rule('/metrics', 'metrics', metrics.metrics_view(collector))
+
+    response = app.test_client().get('/metrics')
+
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    assert b'flask_transfer_stage_duration_seconds' in response.data
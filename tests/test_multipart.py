@@ -0,0 +1,220 @@
+from flask import Flask
+from flask_transfer import validators
+from flask_transfer.multipart import MultipartUploadStore, MultipartUploads
+from flask_transfer.resumable import UploadLocked
+from flask_transfer.transfer import Transfer
+from threading import Thread
+import json
+import os
+import pytest
+
+try:
+    from io import BytesIO
+except ImportError:
+    from StringIO import StringIO as BytesIO
+
+
+PNG = b'\x89PNG\r\n\x1a\n' + bytes(bytearray(range(256))) * 4
+
+
+@pytest.fixture
+def store(tmpdir):
+    return MultipartUploadStore(str(tmpdir.join('parts')))
+
+
+@pytest.fixture
+def saved(tmpdir):
+    return tmpdir.mkdir('saved')
+
+
+def make_client(store, saved, transfer=None, **kwargs):
+    transfer = transfer or Transfer(validators=[validators.AllowedExts('png')])
+    kwargs.setdefault('min_part_size', 1)
+    uploads = MultipartUploads(transfer, store, destination=str(saved.join('image.png')),
+                               **kwargs)
+    app = Flask(__name__)
+    app.register_blueprint(uploads.blueprint(), url_prefix='/multipart')
+    return app.test_client()
+
+
+def loads(response):
+    return json.loads(response.data.decode('utf-8'))
+
+
+def initiate(client, length, **body):
+    body.setdefault('filename', 'image.png')
+    body['length'] = length
+    return client.post('/multipart/', data=json.dumps(body),
+                       content_type='application/json')
+
+
+def put_part(client, upload_id, number, data):
+    return client.put('/multipart/{0}/parts/{1}'.format(upload_id, number), data=data)
+
+
+def test_part_ranges(store):
+    upload = store.create(10, part_size=4)
+    assert upload.part_count == 3
+    assert [upload.part_range(n) for n in (1, 2, 3)] == [(0, 4), (4, 4), (8, 2)]
+    with pytest.raises(ValueError):
+        upload.part_range(4)
+    assert store.create(0, part_size=4).part_range(1) == (0, 0)
+
+
+def test_store_creates_sparse_file(store):
+    upload = store.create(10 * 1024 * 1024, part_size=1024 * 1024)
+    info = os.stat(store.data_path(upload))
+    assert info.st_size == 10 * 1024 * 1024
+    if hasattr(info, 'st_blocks'):
+        assert info.st_blocks * 512 < info.st_size
+
+
+def test_store_writes_parts_out_of_order(store):
+    upload = store.create(10, part_size=4)
+    for number, data in [(3, b'89'), (1, b'0123')]:
+        store.write_part(upload, number, BytesIO(data))
+
+    assert store.parts(upload) == [1, 3]
+    assert store.missing(upload) == [2]
+    store.write_part(upload, 2, BytesIO(b'4567'))
+    with store.open(upload) as fh:
+        assert fh.read() == b'0123456789'
+
+
+def test_store_writes_parts_concurrently(store):
+    data = os.urandom(64 * 1024)
+    upload = store.create(len(data), part_size=4096)
+    threads = [Thread(target=store.write_part,
+                      args=(upload, n, BytesIO(data[(n - 1) * 4096:n * 4096])))
+               for n in range(1, upload.part_count + 1)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert store.missing(upload) == []
+    with store.open(upload) as fh:
+        assert fh.read() == data
+
+
+def test_store_rejects_wrong_sized_parts(store):
+    upload = store.create(10, part_size=4)
+    for data in (b'012', b'01234'):
+        with pytest.raises(ValueError):
+            store.write_part(upload, 1, BytesIO(data))
+    assert store.parts(upload) == []
+
+
+def test_store_parts_wait_for_completion(store):
+    upload = store.create(8, part_size=4)
+    with store.lock(upload, shared=True):
+        store.write_part(upload, 1, BytesIO(b'0123'))
+    with store.lock(upload):
+        with pytest.raises(UploadLocked):
+            store.write_part(upload, 2, BytesIO(b'4567'))
+    assert store.parts(upload) == [1]
+
+
+def test_store_assembled_moves_data_aside(store):
+    upload = store.create(4, part_size=4)
+    store.write_part(upload, 1, BytesIO(b'0123'))
+    with pytest.raises(RuntimeError):
+        with store.assembled(upload) as stream:
+            assert stream.read() == b'0123'
+            assert not os.path.exists(store.data_path(upload))
+            os.link(stream.name, os.path.join(store.directory, 'published'))
+            raise RuntimeError('save failed')
+    # put back for the client to try again, without touching what was linked
+    store.write_part(upload, 1, BytesIO(b'abcd'))
+    with store.open(upload) as fh:
+        assert fh.read() == b'abcd'
+    with open(os.path.join(store.directory, 'published'), 'rb') as fh:
+        assert fh.read() == b'0123'
+
+
+def test_store_purge(store):
+    old, new = store.create(1, 1), store.create(1, 1)
+    old.created -= 100
+    with open(os.path.join(store.directory, old.id, 'info.json'), 'w') as fh:
+        json.dump(old.to_dict(), fh)
+
+    assert store.purge(50) == 1
+    assert store.get(old.id) is None and store.get(new.id) is not None
+
+
+def test_multipart_upload(store, saved):
+    client = make_client(store, saved)
+    response = initiate(client, len(PNG), part_size=300)
+    assert response.status_code == 201
+    status = loads(response)
+    assert status['part_count'] == 4 and status['missing'] == [1, 2, 3, 4]
+    upload_id = status['upload_id']
+
+    for number in (4, 2, 1):
+        assert put_part(client, upload_id, number,
+                        PNG[(number - 1) * 300:number * 300]).status_code == 200
+
+    response = client.post('/multipart/{0}/complete'.format(upload_id))
+    assert response.status_code == 409
+    assert loads(response)['missing'] == [3]
+
+    put_part(client, upload_id, 3, PNG[600:900])
+    assert loads(client.get('/multipart/' + upload_id))['missing'] == []
+    response = client.post('/multipart/{0}/complete'.format(upload_id))
+    assert response.status_code == 200
+    assert saved.join('image.png').read_binary() == PNG
+    assert store.get(upload_id) is None
+
+
+def test_complete_links_path_destinations(store, saved):
+    client = make_client(store, saved)
+    upload_id = loads(initiate(client, len(PNG), part_size=len(PNG)))['upload_id']
+    put_part(client, upload_id, 1, PNG)
+    inode = os.stat(store.data_path(store.get(upload_id))).st_ino
+
+    client.post('/multipart/{0}/complete'.format(upload_id))
+    assert os.stat(str(saved.join('image.png'))).st_ino == inode
+
+
+def test_initiate_validates(store, saved):
+    client = make_client(store, saved, max_size=100, min_part_size=10)
+    assert client.post('/multipart/', data='nope').status_code == 400
+    assert initiate(client, 101).status_code == 413
+    assert initiate(client, 100, part_size=5).status_code == 400
+
+    response = initiate(client, 10, filename='evil.exe')
+    assert response.status_code == 400
+    assert loads(response)['reason'] == 'invalid_extension'
+    assert os.listdir(store.directory) == []
+
+
+def test_initiate_grows_parts_to_max_parts(store, saved):
+    client = make_client(store, saved, max_parts=4)
+    assert loads(initiate(client, 100, part_size=10))['part_size'] == 25
+
+
+def test_first_part_type_checked(store, saved):
+    transfer = Transfer(validators=[validators.AllowedTypes('image/png', header_size=8)])
+    client = make_client(store, saved, transfer=transfer)
+    upload_id = loads(initiate(client, 200, part_size=100))['upload_id']
+
+    assert put_part(client, upload_id, 2, b'\x00' * 100).status_code == 200
+    response = put_part(client, upload_id, 1, b'PK\x03\x04' + b'\x00' * 96)
+    assert response.status_code == 415
+    assert store.get(upload_id) is None
+
+
+def test_bad_part(store, saved):
+    client = make_client(store, saved)
+    upload_id = loads(initiate(client, 10, part_size=4))['upload_id']
+    assert put_part(client, upload_id, 5, b'0123').status_code == 400
+    assert put_part(client, upload_id, 1, b'01').status_code == 400
+    assert put_part(client, '0' * 32, 1, b'0123').status_code == 404
+
+
+def test_abort(store, saved):
+    client = make_client(store, saved)
+    upload_id = loads(initiate(client, 10, part_size=4))['upload_id']
+    assert client.delete('/multipart/' + upload_id).status_code == 204
+    assert client.get('/multipart/' + upload_id).status_code == 404
+    assert os.listdir(store.directory) == []
@@ -0,0 +1,87 @@
+from flask import Flask
+from flask_transfer import TransferBusy, offload
+from flask_transfer.transfer import Transfer
+from werkzeug import FileStorage
+import pytest
+import time
+
+try:
+    from io import BytesIO
+except ImportError:
+    from StringIO import StringIO as BytesIO
+
+
+def shout(filehandle, meta):
+    filehandle.stream = BytesIO(filehandle.stream.read().upper())
+    filehandle.filename = filehandle.filename.upper()
+    meta['pid'] = __import__('os').getpid()
+    return filehandle
+
+
+def nap(seconds):
+    time.sleep(seconds)
+
+
+@pytest.fixture(scope='module')
+def pool():
+    pool = offload.CPUPool(max_workers=1)
+    yield pool
+    pool.shutdown()
+
+
+def test_CPUBound_runs_in_another_process(pool):
+    import os
+    meta = {}
+    filehandle = FileStorage(stream=BytesIO(b'hello'), filename='a.txt',
+                             content_type='text/plain')
+
+    filehandle = offload.CPUBound(shout, pool=pool)(filehandle, meta)
+
+    assert filehandle.stream.read() == b'HELLO'
+    assert filehandle.filename == 'A.TXT'
+    assert meta['pid'] != os.getpid()
+    assert pool.in_flight == 0
+
+
+def test_CPUBound_cleans_up_temp_files(pool, tmpdir):
+    filehandle = FileStorage(stream=BytesIO(b'hello'), filename='a.txt')
+    offload.CPUBound(shout, pool=pool, tmpdir=str(tmpdir))(filehandle, {})
+    assert tmpdir.listdir() == []
+
+
+def test_Transfer_cpu_bound_preprocessor(pool):
+    transf = Transfer(cpu_pool=pool)
+    result = transf.preprocessor(shout, cpu_bound=True)
+    dest = BytesIO()
+
+    transf.save(FileStorage(stream=BytesIO(b'hello'), filename='a.txt'), destination=dest)
+
+    assert result is shout
+    assert isinstance(transf._preprocessors[0], offload.CPUBound)
+    assert dest.getvalue() == b'HELLO'
+
+
+def test_CPUPool_backpressure():
+    pool = offload.CPUPool(max_workers=1, max_pending=0, timeout=0.01)
+    try:
+        running = pool.submit(nap, 0.5)
+        with pytest.raises(TransferBusy) as excinfo:
+            pool.submit(nap, 0)
+        running.result()
+        pool.submit(nap, 0).result()
+    finally:
+        pool.shutdown()
+
+    assert excinfo.value.code == 503
+
+
+def test_cpu_pool_is_configured_per_app():
+    app = Flask(__name__)
+    app.config.update(TRANSFER_CPU_WORKERS=3, TRANSFER_CPU_MAX_PENDING=2)
+
+    with app.app_context():
+        pool = offload.cpu_pool()
+        assert offload.cpu_pool() is pool
+
+    assert (pool.max_workers, pool.max_pending) == (3, 2)
+    assert offload.cpu_pool() is not pool
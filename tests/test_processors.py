@@ -0,0 +1,87 @@
+from flask_transfer import processors
+from werkzeug import FileStorage
+import os
+import threading
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+
+def make_file(filename):
+    return FileStorage(filename=filename)
+
+
+def test_UniqueFilename_keeps_unused_name(tmpdir):
+    unique = processors.UniqueFilename(str(tmpdir))
+    filehandle = unique(make_file('report.pdf'), {})
+
+    assert filehandle.filename == 'report.pdf'
+    assert tmpdir.join('report.pdf').exists()
+
+
+def test_UniqueFilename_increments(tmpdir):
+    unique = processors.UniqueFilename(str(tmpdir))
+    names = [unique(make_file('report.pdf'), {}).filename for _ in range(3)]
+
+    assert names == ['report.pdf', 'report_1.pdf', 'report_2.pdf']
+
+
+def test_UniqueFilename_callable_directory_and_template(tmpdir):
+    unique = processors.UniqueFilename(lambda fh, meta: meta['dir'],
+                                       template='{name}-{counter}{ext}')
+    unique(make_file('a.txt'), {'dir': str(tmpdir)})
+
+    assert unique(make_file('a.txt'), {'dir': str(tmpdir)}).filename == 'a-1.txt'
+
+
+def test_UniqueFilename_searches_instead_of_probing(tmpdir):
+    tmpdir.join('report.pdf').write('')
+    for counter in range(1, 100):
+        tmpdir.join('report_{0}.pdf'.format(counter)).write('')
+
+    unique = processors.UniqueFilename(str(tmpdir))
+    with mock.patch('os.path.exists', wraps=os.path.exists) as exists:
+        filehandle = unique(make_file('report.pdf'), {})
+
+    assert filehandle.filename == 'report_100.pdf'
+    assert exists.call_count < 20
+
+
+def test_UniqueFilename_concurrent_workers_never_collide(tmpdir):
+    # separate instances stand in for separate processes, no shared cache
+    names = []
+
+    def worker():
+        unique = processors.UniqueFilename(str(tmpdir))
+        for _ in range(10):
+            names.append(unique(make_file('report.pdf'), {}).filename)
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(names) == len(set(names)) == 40
+
+
+def test_UniqueFilename_cache_is_bounded(tmpdir):
+    unique = processors.UniqueFilename(str(tmpdir), cache_size=2)
+    for name in ['a.txt', 'b.txt', 'a.txt', 'c.txt']:
+        unique(make_file(name), {})
+
+    # b.txt was the least recently used
+    assert list(unique._next) == [(str(tmpdir), 'a.txt'), (str(tmpdir), 'c.txt')]
+    assert unique(make_file('b.txt'), {}).filename == 'b_1.txt'
+
+
+def test_UniqueFilename_stays_in_directory(tmpdir):
+    uploads = tmpdir.mkdir('uploads')
+    unique = processors.UniqueFilename(str(uploads))
+    filehandle = unique(make_file('../escaped.txt'), {})
+
+    assert filehandle.filename == 'escaped.txt'
+    assert uploads.join('escaped.txt').check()
+    assert not tmpdir.join('escaped.txt').check()
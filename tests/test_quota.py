@@ -0,0 +1,155 @@
+from flask_transfer import transfer, UploadError
+from flask_transfer import quota
+from werkzeug import FileStorage
+import pytest
+
+try:
+    from io import BytesIO
+except ImportError:
+    from StringIO import StringIO as BytesIO
+
+
+@pytest.fixture(params=['memory', 'sqlite', 'json'])
+def store(request, tmpdir):
+    if request.param == 'memory':
+        return quota.MemoryUsageStore()
+    elif request.param == 'sqlite':
+        return quota.SQLiteUsageStore(str(tmpdir.join('usage.db')))
+    return quota.JSONUsageStore(str(tmpdir.join('usage.json')))
+
+
+def test_store_add_and_set(store):
+    assert store.usage('alec') == 0
+    assert store.add('alec', 10) == 10
+    assert store.add('alec', -3) == 7
+    store.set('alec', 100)
+    assert store.usage('alec') == 100
+    assert store.usage('someone') == 0
+
+
+@pytest.mark.parametrize('store_type', [quota.SQLiteUsageStore, quota.JSONUsageStore])
+def test_store_persists(tmpdir, store_type):
+    path = str(tmpdir.join('usage'))
+    store_type(path).add('alec', 42)
+
+    assert store_type(path).usage('alec') == 42
+
+
+def test_QuotaValidator_rejects_known_size(tmpdir):
+    store = quota.MemoryUsageStore()
+    store.set('default', 15)
+    path = tmpdir.join('upload.bin')
+    path.write_binary(b'x' * 10)
+
+    with path.open('rb') as fh:
+        with pytest.raises(UploadError) as excinfo:
+            quota.QuotaValidator(store, 20)(FileStorage(fh, filename='a.bin'), {})
+
+    assert 'exceeds the upload allotment' in str(excinfo.value)
+
+
+def test_QuotaValidator_enforces_while_saving():
+    store = quota.MemoryUsageStore()
+    store.set('default', 15)
+    filehandle = FileStorage(BytesIO(b'x' * 10), filename='a.bin')
+
+    assert quota.QuotaValidator(store, 20)(filehandle, {})
+    with pytest.raises(UploadError):
+        filehandle.save(BytesIO(), 4)
+
+
+def test_QuotaValidator_keys_and_limits():
+    store = quota.MemoryUsageStore()
+    store.set('alec', 5)
+    validator = quota.QuotaValidator(store, limit=lambda key: {'alec': 5}.get(key, 100),
+                                     key=lambda fh, meta: meta['user'])
+    big = FileStorage(BytesIO(), filename='a.bin', content_length=50)
+
+    assert validator(big, {'user': 'someone'})
+    with pytest.raises(UploadError):
+        validator(FileStorage(BytesIO(), filename='a.bin', content_length=1), {'user': 'alec'})
+
+
+def test_QuotaValidator_records_and_releases(tmpdir):
+    store = quota.MemoryUsageStore()
+    validator = quota.QuotaValidator(store, 100)
+    t = transfer.Transfer(validators=[validator], postprocessors=[validator.record])
+
+    t.save(FileStorage(BytesIO(b'x' * 10), filename='a.bin'), destination=BytesIO())
+    assert store.usage('default') == 10
+
+    path = tmpdir.join('a.bin')
+    path.write_binary(b'x' * 4)
+    validator.delete('default', str(path))
+
+    assert store.usage('default') == 6
+    assert not path.exists()
+
+
+def test_Reconciler(tmpdir):
+    store = quota.MemoryUsageStore()
+    store.set('alec', 1000)
+    tmpdir.join('a.bin').write_binary(b'x' * 10)
+    tmpdir.mkdir('nested').join('b.bin').write_binary(b'x' * 5)
+
+    reconciler = quota.Reconciler(store, {'alec': str(tmpdir)})
+    assert reconciler.reconcile() == {'alec': 15}
+    assert store.usage('alec') == 15
+
+
+def test_Reconciler_background(tmpdir):
+    store = quota.MemoryUsageStore()
+    tmpdir.join('a.bin').write_binary(b'x' * 10)
+    reconciler = quota.Reconciler(store, lambda: {'alec': str(tmpdir)}, interval=0.01)
+
+    reconciler.start()
+    try:
+        for _ in range(100):
+            if store.usage('alec') == 10:
+                break
+            reconciler._stop.wait(0.01)
+    finally:
+        reconciler.stop()
+
+    assert store.usage('alec') == 10
+
+
+def test_store_reserve(store):
+    assert store.reserve('alec', 60, 100)
+    assert not store.reserve('alec', 60, 100)
+    assert store.usage('alec') == 60
+    assert store.reserve('alec', 40, 100)
+
+
+class Unseekable(object):
+    def __init__(self, data):
+        self._stream = BytesIO(data)
+
+    def read(self, size=-1):
+        return self._stream.read(size)
+
+
+def test_QuotaValidator_records_bytes_read_not_declared():
+    store = quota.MemoryUsageStore()
+    validator = quota.QuotaValidator(store, 100)
+    t = transfer.Transfer(validators=[validator], postprocessors=[validator.record])
+
+    # claims 1 byte, sends 30
+    t.save(FileStorage(Unseekable(b'x' * 30), filename='a.bin', content_length=1),
+           destination=BytesIO())
+    assert store.usage('default') == 30
+
+
+def test_QuotaValidator_record_rejects_overshoot():
+    store = quota.MemoryUsageStore()
+    validator = quota.QuotaValidator(store, 100)
+    first = FileStorage(BytesIO(b'x' * 60), filename='a.bin')
+    second = FileStorage(BytesIO(b'x' * 60), filename='b.bin')
+    # both pass before either is recorded
+    assert validator(first, {}) and validator(second, {})
+    first.stream.read(), second.stream.read()
+
+    validator.record(first, {})
+    with pytest.raises(UploadError):
+        validator.record(second, {})
+    assert store.usage('default') == 60
@@ -0,0 +1,125 @@
+from flask import Flask
+from flask_transfer.ratelimit import (MemoryRateLimitStore, RateLimit, RateLimited,
+                                      SQLiteRateLimitStore)
+from flask_transfer.transfer import Transfer
+from werkzeug import FileStorage
+import pytest
+
+try:
+    from io import BytesIO
+except ImportError:
+    from StringIO import StringIO as BytesIO
+
+
+def upload(data=b'x' * 10, filename='test.txt', **kwargs):
+    return FileStorage(stream=BytesIO(data), filename=filename, **kwargs)
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def store(request, tmpdir):
+    if request.param == 'memory':
+        return MemoryRateLimitStore()
+    return SQLiteRateLimitStore(str(tmpdir.join('limits.db')))
+
+
+def test_store_limits_count(store):
+    for _ in range(3):
+        assert store.hit('a', 60, max_count=3, now=100).allowed
+    result = store.hit('a', 60, max_count=3, now=100)
+    assert not result.allowed and result.count == 3
+    # other keys are counted separately
+    assert store.hit('b', 60, max_count=3, now=100).allowed
+
+
+def test_store_slides(store):
+    # three hits late in the window starting at 60
+    for _ in range(3):
+        store.hit('a', 60, max_count=3, now=110)
+
+    # a quarter into the next window, they still count for 3 * 0.75
+    result = store.hit('a', 60, max_count=3, now=135)
+    assert not result.allowed and result.count == pytest.approx(2.25)
+    assert result.retry_after == pytest.approx(5)
+
+    assert store.hit('a', 60, max_count=3, now=140).allowed
+    # two windows on, they're forgotten
+    assert store.hit('a', 60, max_count=1, now=300).count == 1
+
+
+def test_store_limits_bytes(store):
+    assert store.hit('a', 60, nbytes=80, max_bytes=100, now=0).allowed
+    result = store.hit('a', 60, nbytes=30, max_bytes=100, now=0)
+    assert not result.allowed and result.nbytes == 80
+    assert result.retry_after == pytest.approx(60 + 60 * (1 - 70.0 / 80))
+    assert store.hit('a', 60, nbytes=20, max_bytes=100, now=0).allowed
+
+
+def test_memory_store_expires_keys():
+    store = MemoryRateLimitStore()
+    for n in range(10):
+        store.hit(n, 60, now=0)
+    assert len(store) == 10
+    store.hit('a', 60, now=200)
+    assert len(store) == 1
+
+
+def test_sqlite_store_shared(tmpdir):
+    path = str(tmpdir.join('limits.db'))
+    SQLiteRateLimitStore(path).hit('a', 60, max_count=1, now=0)
+    assert not SQLiteRateLimitStore(path).hit('a', 60, max_count=1, now=0).allowed
+
+
+def test_RateLimit_by_ip():
+    app = Flask(__name__)
+    limit = RateLimit(count=2, window=60, clock=lambda: 100)
+
+    with app.test_request_context(environ_base={'REMOTE_ADDR': '10.0.0.1'}):
+        assert limit(upload(), {}) and limit(upload(), {})
+        with pytest.raises(RateLimited) as excinfo:
+            limit(upload(), {})
+    with app.test_request_context(environ_base={'REMOTE_ADDR': '10.0.0.2'}):
+        assert limit(upload(), {})
+
+    error = excinfo.value
+    assert error.reason == 'rate_limited' and error.validator is limit
+    # counted in the next window, starting at 120, as the previous one
+    # until its weight has halved
+    assert error.to_dict()['retry_after'] == pytest.approx(20 + 30)
+
+
+def test_RateLimit_by_user_or_callable():
+    limit = RateLimit(count=1, key='user', clock=lambda: 0)
+    assert limit(upload(), {'user': 'alice'})
+    assert limit(upload(), {'user': 'bob'})
+    with pytest.raises(RateLimited):
+        limit(upload(), {'user': 'alice'})
+
+    limit = RateLimit(count=1, key=lambda fh, meta: fh.filename, clock=lambda: 0)
+    assert limit(upload(filename='a.txt'), {})
+    assert limit(upload(filename='b.txt'), {})
+
+
+def test_RateLimit_bytes_declared():
+    limit = RateLimit(nbytes=100, key='user', clock=lambda: 0)
+    assert limit(upload(content_length=60), {'user': 'a'})
+    with pytest.raises(RateLimited):
+        limit(upload(content_length=60), {'user': 'a'})
+
+
+def test_store_waits_at_most_until_weights_reach_zero(store):
+    store.hit('a', 60, max_count=1, now=0)
+    assert store.hit('a', 60, 5, max_count=1, now=10).retry_after == 50 + 60
+    assert store.hit('a', 60, max_count=1, now=70).retry_after == pytest.approx(50)
+
+
+def test_RateLimit_bytes_counted_while_reading():
+    limit = RateLimit(nbytes=100, clock=lambda: 0)
+    transfer = Transfer(validators=[limit])
+
+    transfer.save(upload(b'x' * 60), destination=BytesIO())
+    assert limit.store.hit('uploads:unknown', 60, 0, 0, now=0).nbytes == 60
+
+    with pytest.raises(RateLimited) as excinfo:
+        transfer.save(upload(b'x' * 60), destination=BytesIO())
+    # 60 bytes in the next window leave room for 40 more once they've shrunk to 40
+    assert excinfo.value.retry_after == pytest.approx(60 + 20)
@@ -0,0 +1,257 @@
+from base64 import b64encode
+from flask import Flask
+from flask_transfer import validators
+from flask_transfer.resumable import (PartialUploadStore, ResumableUploads,
+                                      UploadLocked, _parse_metadata)
+from flask_transfer.transfer import Transfer
+import json
+import os
+import pytest
+
+try:
+    from io import BytesIO
+except ImportError:
+    from StringIO import StringIO as BytesIO
+
+
+PNG = b'\x89PNG\r\n\x1a\n' + b'\x00' * 56
+
+
+def upload_metadata(**pairs):
+    return ','.join('{0} {1}'.format(k, b64encode(v.encode('utf-8')).decode('ascii'))
+                    for k, v in sorted(pairs.items()))
+
+
+@pytest.fixture
+def store(tmpdir):
+    return PartialUploadStore(str(tmpdir.join('partial')))
+
+
+@pytest.fixture
+def saved(tmpdir):
+    return tmpdir.mkdir('saved')
+
+
+def make_client(store, saved, transfer=None, **kwargs):
+    transfer = transfer or Transfer(validators=[validators.AllowedExts('png')])
+    destination = kwargs.pop('destination', str(saved.join('image.png')))
+    uploads = ResumableUploads(transfer, store, destination=destination, **kwargs)
+    app = Flask(__name__)
+    app.register_blueprint(uploads.blueprint(), url_prefix='/uploads')
+    return app.test_client()
+
+
+def create(client, length, **metadata):
+    metadata.setdefault('filename', 'image.png')
+    return client.post('/uploads/', headers={'Upload-Length': str(length),
+                                             'Upload-Metadata': upload_metadata(**metadata)})
+
+
+def patch(client, location, offset, data):
+    return client.patch(location, data=data,
+                        headers={'Upload-Offset': str(offset),
+                                 'Content-Type': 'application/offset+octet-stream'})
+
+
+def test_parse_metadata():
+    assert _parse_metadata(upload_metadata(filename='a.png', filetype='image/png')) == \
+        {'filename': 'a.png', 'filetype': 'image/png'}
+    assert _parse_metadata('is_private') == {'is_private': ''}
+    with pytest.raises(ValueError):
+        _parse_metadata('filename YQ')
+
+
+def test_store_append_and_resume(store):
+    upload = store.create(10, filename='a.txt')
+    assert store.append(upload, BytesIO(b'hello'), chunk_size=2) == 5
+
+    # more than the recorded offset made it to disk before a crash
+    with open(store.data_path(upload), 'ab') as fh:
+        fh.write(b'junk')
+
+    upload = store.get(upload.id)
+    assert upload.offset == 5
+    store.append(upload, BytesIO(b'world and more'))
+    with store.open(upload) as fh:
+        assert fh.read() == b'helloworld'
+    assert store.get(upload.id).offset == 10
+
+
+def test_store_get_rejects_bad_ids(store):
+    assert store.get('../../etc/passwd') is None
+    assert store.get('0' * 32) is None
+
+
+def test_store_lock(store):
+    upload = store.create(1)
+    with store.lock(upload):
+        with pytest.raises(UploadLocked):
+            with store.lock(upload):
+                pass
+
+
+def test_store_purge(store):
+    old, new = store.create(1), store.create(1)
+    old.created -= 100
+    store.save(old)
+
+    assert store.purge(50) == 1
+    assert store.get(old.id) is None and store.get(new.id) is not None
+    assert not os.path.exists(store.data_path(old))
+
+
+def test_options(store, saved):
+    client = make_client(store, saved, max_size=100)
+    response = client.open('/uploads/', method='OPTIONS')
+    assert response.status_code == 204
+    assert response.headers['Tus-Version'] == '1.0.0'
+    assert response.headers['Tus-Max-Size'] == '100'
+
+
+def test_resumable_upload(store, saved):
+    client = make_client(store, saved)
+    response = create(client, len(PNG))
+    assert response.status_code == 201
+    location = response.headers['Location']
+
+    assert patch(client, location, 0, PNG[:20]).headers['Upload-Offset'] == '20'
+    head = client.head(location)
+    assert head.headers['Upload-Offset'] == '20'
+    assert head.headers['Upload-Length'] == str(len(PNG))
+    assert head.headers['Cache-Control'] == 'no-store'
+
+    response = patch(client, location, 20, PNG[20:])
+    assert response.status_code == 204
+    assert saved.join('image.png').read_binary() == PNG
+    assert store.get(location.rsplit('/', 1)[1]).complete
+
+
+def test_complete_links_path_destinations(store, saved):
+    client = make_client(store, saved)
+    location = create(client, len(PNG)).headers['Location']
+    upload = store.get(location.rsplit('/', 1)[1])
+    patch(client, location, 0, PNG[:10])
+    inode = os.stat(store.data_path(upload)).st_ino
+
+    patch(client, location, 10, PNG[10:])
+    assert os.stat(str(saved.join('image.png'))).st_ino == inode
+
+
+def test_complete_passes_metadata(store, saved):
+    seen = {}
+    transfer = Transfer()
+
+    @transfer.postprocessor
+    def remember(filehandle, metadata):
+        seen.update(metadata)
+        return filehandle
+
+    client = make_client(store, saved, transfer=transfer,
+                         metadata=lambda upload: {'user': 'alice'})
+    location = create(client, 3, filename='a.txt', hardlink='0').headers['Location']
+    patch(client, location, 0, b'abc')
+
+    assert seen['user'] == 'alice'
+    assert seen['upload_id'] == location.rsplit('/', 1)[1]
+    assert seen['upload_metadata'] == {'filename': 'a.txt', 'hardlink': '0'}
+    assert seen['hardlink'] is True
+
+
+def test_failed_save_can_be_resumed(store, saved):
+    transfer = Transfer()
+    failures = [RuntimeError('disk full')]
+
+    @transfer.postprocessor
+    def flaky(filehandle, metadata):
+        if failures:
+            raise failures.pop()
+        return filehandle
+
+    client = make_client(store, saved, transfer=transfer)
+    location = create(client, len(PNG)).headers['Location']
+    assert patch(client, location, 0, PNG).status_code == 500
+    # hold on to what the failed save put in place
+    os.link(str(saved.join('image.png')), str(saved.join('published.png')))
+
+    # left a byte short, so the client resends it and the save is retried
+    assert client.head(location).headers['Upload-Offset'] == str(len(PNG) - 1)
+    assert patch(client, location, len(PNG) - 1, b'!').status_code == 204
+    assert saved.join('image.png').read_binary() == PNG[:-1] + b'!'
+    assert saved.join('published.png').read_binary() == PNG
+    assert store.get(location.rsplit('/', 1)[1]).complete
+
+
+def test_patch_after_delete_is_not_found(store, saved, monkeypatch):
+    client = make_client(store, saved)
+    location = create(client, len(PNG)).headers['Location']
+    upload = store.get(location.rsplit('/', 1)[1])
+    lock = store.lock
+
+    def delete_then_lock(upload):
+        # deleted between the lookup and taking the lock
+        store.delete(upload)
+        return lock(upload)
+    monkeypatch.setattr(store, 'lock', delete_then_lock)
+
+    assert patch(client, location, 0, PNG[:10]).status_code == 404
+    assert store.get(upload.id) is None
+
+
+def test_offset_mismatch_conflicts(store, saved):
+    client = make_client(store, saved)
+    location = create(client, len(PNG)).headers['Location']
+    patch(client, location, 0, PNG[:10])
+
+    response = patch(client, location, 0, PNG[:10])
+    assert response.status_code == 409
+    assert response.headers['Upload-Offset'] == '10'
+
+
+def test_patch_needs_offset_content_type(store, saved):
+    client = make_client(store, saved)
+    location = create(client, len(PNG)).headers['Location']
+    response = client.patch(location, data=PNG, headers={'Upload-Offset': '0'})
+    assert response.status_code == 415
+
+
+def test_create_checks_length(store, saved):
+    client = make_client(store, saved, max_size=10)
+    assert client.post('/uploads/').status_code == 400
+    assert create(client, 11).status_code == 413
+    assert os.listdir(store.directory) == []
+
+
+def test_create_runs_incremental_validators(store, saved):
+    client = make_client(store, saved)
+    response = create(client, 10, filename='evil.exe')
+    assert response.status_code == 400
+    assert json.loads(response.data.decode('utf-8'))['reason'] == 'invalid_extension'
+    assert os.listdir(store.directory) == []
+
+
+def test_declared_size_rejected_on_create(store, saved):
+    transfer = Transfer(validators=[validators.MaxSize(10)])
+    client = make_client(store, saved, transfer=transfer)
+    response = create(client, 11)
+    assert response.status_code == 413
+    assert json.loads(response.data.decode('utf-8'))['reason'] == 'too_large'
+
+
+def test_type_checked_on_first_chunk(store, saved):
+    transfer = Transfer(validators=[validators.AllowedTypes('image/png', header_size=8)])
+    client = make_client(store, saved, transfer=transfer)
+    location = create(client, 1000).headers['Location']
+    upload_id = location.rsplit('/', 1)[1]
+
+    response = patch(client, location, 0, b'PK\x03\x04' + b'\x00' * 60)
+    assert response.status_code == 415
+    assert store.get(upload_id) is None
+    assert client.head(location).status_code == 404
+
+
+def test_delete(store, saved):
+    client = make_client(store, saved)
+    location = create(client, len(PNG)).headers['Location']
+    assert client.delete(location).status_code == 204
+    assert client.head(location).status_code == 404
+    assert os.listdir(store.directory) == []
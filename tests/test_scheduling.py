@@ -0,0 +1,151 @@
+from flask_transfer import transfer, validators, UploadError
+from flask_transfer.scheduling import ValidatorScheduler, independent
+import threading
+import time
+import pytest
+
+
+class DummyFile(object):
+    def __init__(self, filename):
+        self.filename = filename
+
+    def __repr__(self):
+        return 'DummyFile(filename={0})'.format(self.filename)
+
+
+@pytest.fixture
+def scheduler():
+    scheduler = ValidatorScheduler(max_workers=4)
+    yield scheduler
+    scheduler.shutdown()
+
+
+def test_independent_marks_callables():
+    @independent
+    def _(fh, meta):
+        return True
+
+    assert _.independent
+
+
+def test_validators_independence():
+    allowed = validators.AllowedExts('png')
+    opaque = validators.FunctionValidator(lambda fh, meta: True)
+
+    assert allowed.independent
+    assert (allowed & validators.DeniedExts('psd')).independent
+    assert (~allowed).independent
+    assert not (allowed | opaque).independent
+    assert not validators.NegatedValidator(opaque).independent
+
+
+def test_scheduler_orders_by_cost_and_rejections(scheduler):
+    def slow(fh, meta):
+        time.sleep(0.01)
+        return True
+
+    def cheap(fh, meta):
+        return True
+
+    for _ in range(3):
+        scheduler([slow, cheap], DummyFile('a.png'), {})
+
+    assert [v for _, v in scheduler.order([slow, cheap])] == [cheap, slow]
+    assert scheduler.stats(slow).calls == 3
+
+
+def test_scheduler_raises_first_failure(scheduler):
+    def falsey(fh, meta):
+        return False
+
+    with pytest.raises(UploadError) as excinfo:
+        scheduler([lambda fh, m: True, falsey], DummyFile('a.png'), {})
+
+    assert 'returned False' in str(excinfo.value)
+
+
+def test_scheduler_collects_errors_in_registration_order(scheduler):
+    def make(message):
+        @independent
+        def fail(fh, meta):
+            raise UploadError(message)
+        return fail
+
+    with pytest.raises(UploadError) as excinfo:
+        scheduler([make('one'), make('two'), make('three')],
+                  DummyFile('a.png'), {}, catch_all_errors=True)
+
+    assert excinfo.value.args[0] == ['one', 'two', 'three']
+
+
+def test_scheduler_bails_without_waiting(scheduler):
+    release = threading.Event()
+
+    @independent
+    def blocking(fh, meta):
+        release.wait(5)
+        return True
+
+    start = time.time()
+    with pytest.raises(UploadError):
+        scheduler([blocking, validators.AllowedExts('png')], DummyFile('a.exe'), {})
+    release.set()
+
+    assert time.time() - start < 1
+
+
+def test_scheduler_stops_dependent_chain(scheduler):
+    calls = []
+
+    def first(fh, meta):
+        calls.append('first')
+        raise UploadError('first')
+
+    def second(fh, meta):
+        calls.append('second')
+        return True
+
+    with pytest.raises(UploadError):
+        scheduler([first, second], DummyFile('a.png'), {})
+
+    assert calls == ['first']
+
+
+def test_Transfer_uses_scheduler():
+    calls = []
+
+    def scheduler(validators, filehandle, metadata, catch_all_errors):
+        calls.append((validators, catch_all_errors))
+
+    t = transfer.Transfer(validators=[validators.AllowAll()], scheduler=scheduler)
+    t._validate(DummyFile('a.png'), {}, catch_all_errors=True)
+
+    assert calls == [(t._validators, True)]
+
+
+def test_scheduler_keeps_request_context(scheduler):
+    from flask import Flask, request
+    app = Flask(__name__)
+    seen = []
+
+    @independent
+    def remote_addr(filehandle, metadata):
+        seen.append(request.remote_addr)
+        return True
+
+    def also_remote_addr(filehandle, metadata):
+        seen.append(request.remote_addr)
+        return True
+
+    with app.test_request_context(environ_base={'REMOTE_ADDR': '1.1.1.1'}):
+        scheduler([remote_addr, also_remote_addr], DummyFile('a.png'), {})
+    assert seen == ['1.1.1.1'] * 2
+
+
+def test_scheduler_reports_to_listeners(scheduler):
+    events = []
+    t = transfer.Transfer(validators=[validators.AllowAll(), independent(lambda f, m: True)],
+                          scheduler=scheduler, listeners=[events.append])
+    t._validate(DummyFile('a.png'), {})
+
+    assert len([e for e in events if e.stage == 'validator' and e.phase == 'stop']) == 2
@@ -0,0 +1,111 @@
+from flask import Flask
+from flask_transfer import spooling
+from flask_transfer.spooling import ManagedSpool, MemoryBudget, spool, spool_budget
+from flask_transfer.streaming import known_size
+from flask_transfer.transfer import Transfer
+from werkzeug import FileStorage
+import gc
+
+try:
+    from io import BytesIO
+except ImportError:
+    from StringIO import StringIO as BytesIO
+
+
+def test_MemoryBudget():
+    budget = MemoryBudget(10)
+    assert budget.reserve(6)
+    assert not budget.reserve(5)
+    budget.release(6)
+    assert budget.reserve(10) and budget.in_use == 10
+    assert MemoryBudget(None).reserve(10 ** 12)
+
+
+def test_spool_rolls_over_past_threshold():
+    budget = MemoryBudget(None)
+    out = ManagedSpool(10, budget)
+    out.write(b'12345')
+    assert not out._rolled and budget.in_use == 5
+
+    # moved before the write, not after
+    out.write(b'678901')
+    assert out._rolled and budget.in_use == 0
+    out.seek(0)
+    assert out.read() == b'12345678901'
+
+
+def test_spools_share_a_budget():
+    budget = MemoryBudget(10)
+    first, second = ManagedSpool(0, budget), ManagedSpool(0, budget)
+    first.write(b'x' * 8)
+    second.write(b'x' * 4)
+
+    assert not first._rolled and second._rolled
+    assert budget.in_use == 8
+
+    first.close()
+    assert budget.in_use == 0
+    third = ManagedSpool(0, budget)
+    third.write(b'x' * 10)
+    assert not third._rolled
+
+
+def test_spool_released_when_collected():
+    budget = MemoryBudget(None)
+    out = ManagedSpool(100, budget)
+    out.write(b'x' * 50)
+    del out
+    gc.collect()
+    assert budget.in_use == 0
+
+
+def test_spool_uses_app_config(tmpdir):
+    app = Flask(__name__)
+    app.config.update(TRANSFER_SPOOL_THRESHOLD=4, TRANSFER_SPOOL_BUDGET=100,
+                      TRANSFER_SPOOL_DIR=str(tmpdir))
+    with app.app_context():
+        budget = spool_budget()
+        assert budget.limit == 100 and spool_budget() is budget
+
+        out = spool()
+        out.write(b'12')
+        assert budget.in_use == 2
+        out.write(b'345')
+        assert out._rolled
+        out.close()
+
+    assert spool_budget().limit is not None
+
+
+def test_preprocessor_spooling_output():
+    transfer = Transfer()
+
+    @transfer.preprocessor
+    def make_uppercase(filehandle, metadata):
+        out = spool(threshold=1024)
+        for chunk in iter(lambda: filehandle.stream.read(4096), b''):
+            out.write(chunk.upper())
+        out.seek(0)
+        filehandle.stream = out
+        metadata['spooled_size'] = known_size(filehandle)
+        return filehandle
+
+    dest, metadata = BytesIO(), {}
+    fh = FileStorage(stream=BytesIO(b'abc' * 1000), filename='shout.txt')
+    transfer.save(fh, destination=dest, metadata=metadata)
+
+    assert dest.getvalue() == b'ABC' * 1000
+    # on disk, so its size is known without reading it
+    assert metadata['spooled_size'] == 3000
+
+
+def test_configure_outside_app_context():
+    before = spooling.settings()
+    try:
+        spooling.configure(8, 16, None)
+        assert spooling.settings() == (8, 16, None)
+        out = spool()
+        out.write(b'x' * 9)
+        assert out._rolled
+    finally:
+        spooling.configure(*before)
@@ -0,0 +1,188 @@
+from flask_transfer import UploadError
+from flask_transfer.streaming import (StreamPipeline, PeekableStream, CountingStream,
+                                     peek, known_size)
+import pytest
+
+try:
+    from io import BytesIO
+except ImportError:
+    from StringIO import StringIO as BytesIO
+
+
+def recorder(seen):
+    def factory(filehandle, metadata):
+        return seen.append
+    return factory
+
+
+def test_StreamPipeline_reads_in_chunks():
+    seen = []
+    pipeline = StreamPipeline(BytesIO(b'hello world'), None, {},
+                              consumers=[recorder(seen)], chunk_size=4)
+
+    assert pipeline.read() == b'hello world'
+    assert seen == [b'hell', b'o wo', b'rld', b'']
+    assert pipeline.bytes_read == 11
+
+
+def test_StreamPipeline_read_sized():
+    pipeline = StreamPipeline(BytesIO(b'hello world'), None, {}, chunk_size=4)
+
+    assert pipeline.read(6) == b'hello '
+    assert pipeline.read(6) == b'world'
+    assert pipeline.read(6) == b''
+    assert pipeline.exhausted
+
+
+def test_StreamPipeline_transforms_before_consuming():
+    seen = []
+    upper = lambda fh, m: lambda chunk: chunk.upper()
+    pipeline = StreamPipeline(BytesIO(b'hello'), None, {},
+                              consumers=[recorder(seen)],
+                              transformers=[upper], chunk_size=8)
+
+    assert pipeline.read() == b'HELLO'
+    assert seen == [b'HELLO', b'']
+
+
+def test_StreamPipeline_flushes_buffering_transformers():
+    def hold_everything(fh, m):
+        held = []
+
+        def transform(chunk):
+            if chunk:
+                held.append(chunk)
+                return b''
+            return b''.join(held)
+        return transform
+
+    upper = lambda fh, m: lambda chunk: chunk.upper()
+    pipeline = StreamPipeline(BytesIO(b'hello world'), None, {},
+                              transformers=[hold_everything, upper],
+                              chunk_size=2)
+
+    assert pipeline.read() == b'HELLO WORLD'
+
+
+def test_StreamPipeline_consumer_aborts_read():
+    def only_short(fh, m):
+        def consume(chunk):
+            raise UploadError('too long')
+        return consume
+
+    source = BytesIO(b'a' * 100)
+    pipeline = StreamPipeline(source, None, {}, consumers=[only_short],
+                              chunk_size=10)
+
+    with pytest.raises(UploadError):
+        pipeline.read(50)
+
+    assert source.tell() == 10
+
+
+def test_StreamPipeline_finish_drains():
+    seen = []
+    pipeline = StreamPipeline(BytesIO(b'hello world'), None, {},
+                              consumers=[recorder(seen)], chunk_size=4)
+    pipeline.read(2)
+    pipeline.finish()
+
+    assert b''.join(seen) == b'hello world'
+    assert seen[-1] == b''
+
+
+class Unseekable(object):
+    def __init__(self, data):
+        self._stream = BytesIO(data)
+
+    def read(self, size=-1):
+        return self._stream.read(size)
+
+    def seekable(self):
+        return False
+
+
+class DummyFile(object):
+    def __init__(self, stream):
+        self.stream = stream
+
+
+def test_peek_rewinds_seekable_streams():
+    source = BytesIO(b'hello world')
+    filehandle = DummyFile(source)
+
+    assert peek(filehandle, 5) == b'hello'
+    assert filehandle.stream is source
+    assert source.tell() == 0
+
+
+def test_peek_wraps_unseekable_streams():
+    filehandle = DummyFile(Unseekable(b'hello world'))
+
+    assert peek(filehandle, 5) == b'hello'
+    assert isinstance(filehandle.stream, PeekableStream)
+    assert peek(filehandle, 7) == b'hello w'
+    assert filehandle.stream.read(3) == b'hel'
+    assert filehandle.stream.read() == b'lo world'
+
+
+def test_PeekableStream_read_past_prefix():
+    stream = PeekableStream(Unseekable(b'hello world'))
+    stream.peek(3)
+
+    assert stream.read(8) == b'hello wo'
+    assert stream.read(8) == b'rld'
+
+
+def test_CountingStream_clamps_to_limit():
+    counts = []
+    stream = CountingStream(BytesIO(b'x' * 100), lambda c, done: counts.append((c, done)),
+                            limit=10)
+
+    assert len(stream.read(50)) == 11
+    assert counts == [(11, False)]
+
+
+def test_CountingStream_reports_end_of_stream():
+    counts = []
+    stream = CountingStream(BytesIO(b'abc'), lambda c, done: counts.append((c, done)))
+    stream.read(3)
+    stream.read(3)
+
+    assert counts == [(3, False), (3, True)]
+
+
+def test_CountingStream_read_everything_reaches_the_end():
+    counts = []
+    stream = CountingStream(BytesIO(b'abc'), lambda c, done: counts.append((c, done)))
+    assert stream.read() == b'abc'
+    assert counts == [(3, True)] and stream.finished
+
+    # cut short by the limit, so there may be more
+    counts = []
+    stream = CountingStream(BytesIO(b'abcdef'), lambda c, done: counts.append((c, done)),
+                            limit=3)
+    stream.read()
+    assert counts == [(4, False)]
+
+
+def test_CountingStream_finish_drains():
+    counts = []
+    stream = CountingStream(BytesIO(b'abcdef'), lambda c, done: counts.append((c, done)))
+    stream.read(2)
+    stream.finish(chunk_size=3)
+
+    assert counts[-1] == (6, True) and stream.finished
+    stream.finish()
+    assert len(counts) == 4
+
+
+def test_known_size(tmpdir):
+    path = tmpdir.join('upload.bin')
+    path.write_binary(b'x' * 10)
+
+    with path.open('rb') as fh:
+        fh.read(4)
+        assert known_size(DummyFile(fh)) == 6
+
+    assert known_size(DummyFile(BytesIO(b'x'))) is None
@@ -1,4 +1,4 @@
-from flask_transfer import transfer, UploadError
+from flask_transfer import transfer, validators, UploadError
 from werkzeug import FileStorage
 import pytest
 
@@ -85,6 +85,20 @@ def test_string_path_saving():
     assert mocked_save.call_args == mock.call('test.png', None)
 
 
+def test_string_path_saving_copies_real_files(tmpdir):
+    source = tmpdir.join('source').open('w+b')
+    source.write(b'hello')
+    source.seek(0)
+    filehandle = FileStorage(stream=source, filename='test.png')
+    target = str(tmpdir.join('test.png'))
+
+    with mock.patch('werkzeug.FileStorage.save') as mocked_save:
+        transfer._use_filehandle_to_save(target)(filehandle, {})
+
+    assert not mocked_save.called
+    assert tmpdir.join('test.png').read_binary() == b'hello'
+
+
 def test_Transfer_setup_blank():
     t = transfer.Transfer()
     assert t._destination is None
@@ -251,3 +265,238 @@ def test_nest_Transfer_objs():
     Outer.save(dummy_file, metadata={}, destination=lambda *a, **k: True)
 
     assert Inner.verify()
+
+
+def test_register_consumer(transf):
+    @transf.consumer
+    def _(fh, meta):
+        return lambda chunk: None
+
+    assert len(transf._consumers) == 1
+
+
+def test_register_transformer(transf):
+    @transf.transformer
+    def _(fh, meta):
+        return lambda chunk: chunk
+
+    assert len(transf._transformers) == 1
+
+
+def test_Transfer_save_streams_through_pipeline(transf):
+    seen = []
+    transf.transformer(lambda fh, meta: lambda chunk: chunk.upper())
+    transf.consumer(lambda fh, meta: seen.append)
+    source = BytesIO(b'hello world')
+    destination = BytesIO()
+
+    filehandle = FileStorage(stream=source, filename='test.txt')
+    transf.save(filehandle, destination=destination, metadata={'buffer_size': 4})
+
+    assert destination.getvalue() == b'HELLO WORLD'
+    assert b''.join(seen) == b'HELLO WORLD'
+    assert filehandle.stream is source
+
+
+def test_Transfer_save_drains_unread_stream(transf):
+    seen = []
+    transf.consumer(lambda fh, meta: seen.append)
+    filehandle = FileStorage(stream=BytesIO(b'hello world'))
+
+    transf.save(filehandle, destination=lambda fh, meta: None)
+
+    assert b''.join(seen) == b'hello world'
+
+
+def test_Transfer_save_consumer_aborts(transf):
+    def reject(fh, meta):
+        def consume(chunk):
+            raise UploadError('nope')
+        return consume
+
+    transf.consumer(reject)
+    source = BytesIO(b'hello world')
+    filehandle = FileStorage(stream=source)
+
+    with pytest.raises(UploadError):
+        transf.save(filehandle, destination=BytesIO())
+
+    assert filehandle.stream is source
+
+
+def test_Transfer_save_many(transf):
+    saved = []
+    transf.validator(validators.AllowedExts('txt'))
+
+    @transf.preprocessor
+    def tag(filehandle, meta):
+        meta['tagged'] = filehandle.filename
+        return filehandle
+
+    files = [FileStorage(stream=BytesIO(b'a'), filename='a.txt'),
+             FileStorage(stream=BytesIO(b'b'), filename='b.png'),
+             FileStorage(stream=BytesIO(b'c'), filename='c.txt')]
+
+    results = transf.save_many(files, metadata={'user': 'me'},
+                               destination=lambda fh, meta: saved.append(fh.filename))
+
+    assert [r.ok for r in results] == [True, False, True]
+    assert isinstance(results[1].error, UploadError)
+    assert results[0].metadata == {'user': 'me', 'tagged': 'a.txt'}
+    assert results[1].metadata == {'user': 'me'}
+    assert sorted(saved) == ['a.txt', 'c.txt']
+
+
+def test_Transfer_save_many_isolates_failures(transf):
+    def destination(filehandle, meta):
+        if filehandle.filename == 'bad.txt':
+            raise IOError('disk full')
+
+    files = [FileStorage(stream=BytesIO(), filename='bad.txt'),
+             FileStorage(stream=BytesIO(), filename='good.txt')]
+    results = transf.save_many(files, destination=destination)
+
+    assert isinstance(results[0].error, IOError)
+    assert results[1].ok
+
+
+def test_Transfer_save_many_uses_bulk_hook(transf):
+    class BulkDestination(object):
+        def __init__(self):
+            self.batches = []
+
+        def __call__(self, filehandle, meta):
+            raise AssertionError('should use bulk hook')
+
+        def save_many(self, pairs):
+            self.batches.append([fh.stream.read() for fh, meta in pairs])
+
+    transf.transformer(lambda fh, meta: lambda chunk: chunk.upper())
+    destination = BulkDestination()
+    files = [FileStorage(stream=BytesIO(b'a')), FileStorage(stream=BytesIO(b'b'))]
+
+    results = transf.save_many(files, destination=destination)
+
+    assert all(r.ok for r in results)
+    assert destination.batches == [[b'A', b'B']]
+
+
+def test_Transfer_save_many_bulk_hook_failure(transf):
+    class BrokenBulk(object):
+        def __call__(self, filehandle, meta):
+            pass
+
+        def save_many(self, pairs):
+            raise IOError('archive locked')
+
+    files = [FileStorage(stream=BytesIO(b'a')), FileStorage(stream=BytesIO(b'b'))]
+    results = transf.save_many(files, destination=BrokenBulk())
+
+    assert all(isinstance(r.error, IOError) for r in results)
+
+
+class PendingWrite(object):
+    def __init__(self, log, name):
+        self.log, self.name = log, name
+
+    def commit(self):
+        self.log.append(('commit', self.name))
+
+    def rollback(self):
+        self.log.append(('rollback', self.name))
+
+
+def test_Transfer_save_many_bulk_commits_and_rolls_back(transf):
+    log = []
+
+    class Bulk(object):
+        def __call__(self, filehandle, meta):
+            pass
+
+        def save_many(self, pairs):
+            return [PendingWrite(log, fh.filename) for fh, meta in pairs]
+
+    @transf.postprocessor
+    def explode(filehandle, meta):
+        if filehandle.filename == 'bad.txt':
+            raise IOError('nope')
+        return filehandle
+
+    files = [FileStorage(stream=BytesIO(b'a'), filename='good.txt'),
+             FileStorage(stream=BytesIO(b'b'), filename='bad.txt')]
+    results = transf.save_many(files, destination=Bulk())
+
+    assert results[0].ok and isinstance(results[1].error, IOError)
+    assert sorted(log) == [('commit', 'good.txt'), ('rollback', 'bad.txt')]
+
+
+def test_Transfer_save_many_bulk_respects_limiter():
+    from flask_transfer.limits import ConcurrencyLimiter
+    limiter = ConcurrencyLimiter(max_saves=2)
+    batches = []
+
+    class Bulk(object):
+        def __call__(self, filehandle, meta):
+            pass
+
+        def save_many(self, pairs):
+            batches.append([fh.filename for fh, meta in pairs])
+
+    files = [FileStorage(stream=BytesIO(b'x'), filename=name) for name in 'abcde']
+    results = transfer.Transfer(limiter=limiter).save_many(files, destination=Bulk())
+
+    assert all(r.ok for r in results)
+    assert batches == [['a', 'b'], ['c', 'd'], ['e']]
+    assert limiter.in_flight == 0
+
+
+def test_Transfer_save_many_keeps_request_context(transf):
+    from flask import Flask, request
+    app = Flask(__name__)
+    seen = []
+
+    @transf.preprocessor
+    def remote_addr(filehandle, meta):
+        seen.append(request.remote_addr)
+        return filehandle
+
+    files = [FileStorage(stream=BytesIO(b'x'), filename='a.txt') for _ in range(3)]
+    with app.test_request_context(environ_base={'REMOTE_ADDR': '1.1.1.1'}):
+        results = transf.save_many(files, destination=lambda fh, meta: None)
+
+    assert all(r.ok for r in results)
+    assert seen == ['1.1.1.1'] * 3
+
+
+def test_MinSize_checked_after_a_single_read():
+    def read_once(filehandle, metadata):
+        metadata['data'] = filehandle.stream.read()
+
+    for checks in ([validators.MinSize(10)],
+                   [validators.MinSize(10), validators.MaxSize(100)]):
+        transf = transfer.Transfer(destination=read_once, validators=checks)
+        with pytest.raises(UploadError) as excinfo:
+            transf.save(FileStorage(stream=BytesIO(b'abc'), filename='a.txt'))
+        assert excinfo.value.reason == 'too_small'
+
+
+def test_MinSize_checked_when_destination_reads_part():
+    transf = transfer.Transfer(destination=lambda fh, meta: fh.stream.read(1),
+                               validators=[validators.MinSize(10)])
+    with pytest.raises(UploadError):
+        transf.save(FileStorage(stream=BytesIO(b'abc'), filename='a.txt'))
+
+
+def test_rejected_mid_copy_removes_partial_file(tmpdir):
+    path = tmpdir.join('big.txt')
+    transf = transfer.Transfer(validators=[validators.MaxSize(10)])
+    with pytest.raises(UploadError):
+        transf.save(FileStorage(stream=BytesIO(b'x' * 100), filename='big.txt'),
+                    destination=str(path))
+    assert not path.check()
+
+    transf = transfer.Transfer(validators=[validators.MinSize(10)])
+    with pytest.raises(UploadError):
+        transf.save(FileStorage(stream=BytesIO(b'x'), filename='small.txt'),
+                    destination=str(path))
+    assert not path.check()
@@ -1,6 +1,11 @@
 from flask_transfer import validators, UploadError
 import pytest
 
+try:
+    from io import BytesIO
+except ImportError:
+    from StringIO import StringIO as BytesIO
+
 try:
     from unittest import mock
 except ImportError:
@@ -220,3 +225,233 @@ def test_invert_DeniedExts():
     exts = frozenset(['jpg', 'gif', 'png'])
     flipped = ~validators.DeniedExts(*exts)
     assert isinstance(flipped, validators.AllowedExts) and flipped.exts == exts
+
+
+class DummyUpload(DummyFile):
+    def __init__(self, filename, data):
+        super(DummyUpload, self).__init__(filename)
+        self.stream = BytesIO(data)
+
+
+@pytest.mark.parametrize('header, expected', [
+    (b'\x89PNG\r\n\x1a\n\x00\x00', 'image/png'),
+    (b'%PDF-1.4\n', 'application/pdf'),
+    (b'RIFF\x00\x00\x00\x00WEBPVP8 ', 'image/webp'),
+    (b'RIFF\x00\x00\x00\x00WAVEfmt ', 'audio/wav'),
+    (b'just some text', None),
+])
+def test_sniff_type(header, expected):
+    assert validators.sniff_type(header) == expected
+
+
+def test_AllowedTypes_okays():
+    upload = DummyUpload('lies.txt', b'\x89PNG\r\n\x1a\n' + b'\x00' * 100)
+    allowed = validators.AllowedTypes('image/*')
+
+    assert allowed(upload, {})
+    assert upload.stream.tell() == 0
+
+
+def test_AllowedTypes_raises():
+    allowed = validators.AllowedTypes('image/png', 'application/pdf')
+    with pytest.raises(UploadError) as excinfo:
+        allowed(DummyUpload('lies.png', b'PK\x03\x04'), {})
+
+    assert 'has an invalid type application/zip' in str(excinfo.value)
+
+
+def test_AllowedTypes_rejects_unknown():
+    with pytest.raises(UploadError):
+        validators.AllowedTypes('image/png')(DummyUpload('a.png', b'nope'), {})
+
+
+def test_DeniedTypes():
+    denied = validators.DeniedTypes('application/x-executable')
+
+    assert denied(DummyUpload('a.txt', b'hello'), {})
+    with pytest.raises(UploadError):
+        denied(DummyUpload('a.txt', b'\x7fELF\x02\x01'), {})
+
+
+def test_invert_TypeValidators():
+    flipped = ~validators.AllowedTypes('image/png', header_size=8)
+
+    assert isinstance(flipped, validators.DeniedTypes)
+    assert flipped.types == frozenset(['image/png']) and flipped.header_size == 8
+    assert isinstance(~flipped, validators.AllowedTypes)
+
+
+def test_TypeValidators_compose():
+    pdf_not_zip = validators.AllowedTypes('application/pdf') | validators.AllowedExts('txt')
+
+    assert pdf_not_zip(DummyUpload('a.txt', b'hello'), {})
+    assert pdf_not_zip(DummyUpload('a.bin', b'%PDF-1.7'), {})
+
+
+def test_incremental_bytes():
+    types = validators.AllowedTypes('image/png', header_size=16)
+    exts = validators.AllowedExts('png')
+
+    assert exts.incremental_bytes == 0 and types.incremental_bytes == 16
+    assert (exts & types).incremental_bytes == 16
+    assert (~types | validators.MaxSize(10)).incremental_bytes == 16
+    assert (exts & validators.MinSize(1)).incremental_bytes is None
+    assert validators.FunctionValidator(filename_all_lower).incremental_bytes is None
+
+
+class SizedUpload(DummyUpload):
+    def __init__(self, data, content_length=0):
+        super(SizedUpload, self).__init__('sized.bin', data)
+        self.content_length = content_length
+
+
+def drain(upload, buffer_size=4):
+    while upload.stream.read(buffer_size):
+        pass
+
+
+def test_MaxSize_uses_file_size(tmpdir):
+    path = tmpdir.join('upload.bin')
+    path.write_binary(b'x' * 10)
+    upload = DummyFile('upload.bin')
+
+    with path.open('rb') as fh:
+        upload.stream = fh
+        assert validators.MaxSize(10)(upload, {})
+        assert upload.stream is fh
+
+        with pytest.raises(UploadError) as excinfo:
+            validators.MaxSize(9)(upload, {})
+
+    assert 'exceeds the maximum size of 9 bytes' in str(excinfo.value)
+
+
+def test_MaxSize_rejects_declared_size():
+    with pytest.raises(UploadError):
+        validators.MaxSize(10)(SizedUpload(b'', content_length=11), {})
+
+
+def test_MaxSize_trusts_request_length():
+    from flask import Flask
+    app = Flask(__name__)
+    upload = SizedUpload(b'x' * 5)
+
+    with app.test_request_context(data=b'x' * 5, method='POST'):
+        assert validators.MaxSize(10)(upload, {})
+
+    assert isinstance(upload.stream, BytesIO)
+
+
+def test_MaxSize_enforces_while_streaming():
+    upload = SizedUpload(b'x' * 100)
+    source = upload.stream
+
+    assert validators.MaxSize(10)(upload, {})
+    with pytest.raises(UploadError):
+        drain(upload)
+
+    assert source.tell() == 11
+
+
+def test_MaxSize_streaming_within_limit():
+    upload = SizedUpload(b'x' * 10)
+    validators.MaxSize(10)(upload, {})
+    drain(upload)
+
+
+def test_MinSize_known_and_declared(tmpdir):
+    path = tmpdir.join('upload.bin')
+    path.write_binary(b'x' * 10)
+    upload = DummyFile('upload.bin')
+
+    with path.open('rb') as fh:
+        upload.stream = fh
+        assert validators.MinSize(10)(upload, {})
+        with pytest.raises(UploadError):
+            validators.MinSize(11)(upload, {})
+
+    with pytest.raises(UploadError):
+        validators.MinSize(10)(SizedUpload(b'', content_length=5), {})
+
+
+def test_MinSize_enforces_at_end_of_stream():
+    upload = SizedUpload(b'x' * 5)
+    assert validators.MinSize(6)(upload, {})
+
+    with pytest.raises(UploadError) as excinfo:
+        drain(upload)
+
+    assert 'smaller than the minimum size of 6 bytes' in str(excinfo.value)
+
+
+def passes(validator, filehandle):
+    try:
+        return bool(validator(filehandle, {}))
+    except UploadError:
+        return False
+
+
+def test_compile_flattens():
+    a, b, c = [validators.FunctionValidator(lambda fh, m: True) for _ in range(3)]
+
+    compiled = (a & b & c).compile()
+    assert isinstance(compiled, validators.AndValidator)
+    assert compiled._validators == (a, b, c)
+
+    compiled = (a | b | c).compile()
+    assert isinstance(compiled, validators.OrValidator)
+    assert compiled._validators == (a, b, c)
+
+
+def test_compile_de_morgan():
+    a, b = [validators.FunctionValidator(lambda fh, m: True) for _ in range(2)]
+    compiled = validators.compile_validator(~(a & ~b))
+
+    assert isinstance(compiled, validators.OrValidator)
+    negated_a, plain_b = compiled._validators
+    assert isinstance(negated_a, validators.NegatedValidator) and negated_a._nested is a
+    assert plain_b is b
+
+
+def test_compile_merges_exts():
+    compiled = (validators.AllowedExts('png', 'jpg', 'psd') &
+                validators.DeniedExts('psd') &
+                validators.AllowedExts('png', 'psd')).compile()
+
+    assert isinstance(compiled, validators.AllowedExts)
+    assert compiled.exts == frozenset(['png'])
+
+    compiled = (validators.AllowedExts('png') | validators.AllowedExts('jpg')).compile()
+    assert compiled.exts == frozenset(['png', 'jpg'])
+
+
+def test_compile_folds_all_and_deny():
+    ext = validators.AllowedExts('png')
+
+    assert (ext & validators.AllowAll()).compile() is ext
+    assert isinstance((ext & validators.DenyAll()).compile(), validators.DenyAll)
+    assert isinstance((ext | validators.AllowAll()).compile(), validators.AllowAll)
+    assert (ext | validators.DenyAll()).compile() is ext
+    assert isinstance((~validators.AllowAll()).compile(), validators.DenyAll)
+
+
+def test_compile_leaves_other_validators_alone():
+    lone = validators.FunctionValidator(lambda fh, m: True)
+    assert validators.compile_validator(lone) is lone
+
+
+@pytest.mark.parametrize('tree', [
+    ~(validators.AllowedExts('exe') | validators.AllowedExts('sh')) &
+    (validators.AllowedExts('png') | validators.AllowAll()),
+    (validators.AllowedExts('png', 'jpg') | validators.DeniedExts('jpg', 'gif')) &
+    ~validators.DeniedExts('png', 'gif', 'txt'),
+    ~((validators.DeniedExts('png') | validators.DeniedExts('txt')) &
+      validators.NegatedValidator(validators.AllowedExts('gif'))),
+    validators.AndValidator(validators.FunctionValidator(filename_all_lower),
+                            ~validators.DenyAll(), validators.AllowedExts('png', 'gif'),
+                            validators.AllowedExts('gif', 'txt')),
+])
+def test_compile_keeps_semantics(tree):
+    compiled = tree.compile()
+    for name in ['a.png', 'a.jpg', 'a.gif', 'a.txt', 'a.exe', 'a.sh', 'A.GIF', 'noext']:
+        assert passes(tree, DummyFile(name)) == passes(compiled, DummyFile(name)), name